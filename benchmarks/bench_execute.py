@@ -0,0 +1,81 @@
+"""Micro-benchmark for the per-command overhead that
+ScreenshotOnExceptionWebDriver.execute adds on top of webdriver.Remote.
+
+No browser is needed: the driver talks to an in-memory command executor
+that answers every command immediately, so what is measured is the
+plugin's own bookkeeping.
+
+    $ python benchmarks/bench_execute.py [iterations]
+"""
+import inspect
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from selenium import webdriver
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.errorhandler import ErrorHandler
+import nose_selenium
+from nose_selenium import ScreenshotOnExceptionWebDriver
+
+
+class InstantExecutor(object):
+    """Command executor that answers every command without any I/O."""
+
+    def execute(self, command, params):
+        return {'status': 0, 'value': None}
+
+
+class StackInspectingWebDriver(ScreenshotOnExceptionWebDriver):
+    """The caller check as it was before the thread-local wait marker,
+    kept here as the baseline."""
+
+    def execute(self, driver_command, params=None):
+        curframe = inspect.currentframe()
+        calframe = inspect.getouterframes(curframe)
+        if len(calframe) > 4 and calframe[4][3] in ['until', 'until_not']:
+            pass
+        return webdriver.Remote.execute(self, driver_command, params=params)
+
+
+def make_driver(cls):
+    wd = cls.__new__(cls)
+    wd.command_executor = InstantExecutor()
+    wd.error_handler = ErrorHandler()
+    wd.session_id = 'benchmark'
+    wd.capabilities = {}
+    return wd
+
+
+def per_command(wd, iterations):
+    """Best-of-5 seconds per GET_TITLE command."""
+    timer = timeit.Timer(lambda: wd.execute(Command.GET_TITLE))
+    return min(timer.repeat(5, iterations)) / iterations
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    iterations = int(argv[1]) if len(argv) > 1 else 20000
+
+    bare = per_command(make_driver(webdriver.Remote), iterations)
+    before = per_command(make_driver(StackInspectingWebDriver), iterations)
+    after = per_command(make_driver(ScreenshotOnExceptionWebDriver), iterations)
+    nose_selenium.enable_command_timing()
+    timed = per_command(make_driver(ScreenshotOnExceptionWebDriver), iterations)
+    nose_selenium._COMMAND_STATS = None
+
+    print("%-35s %12s %12s" % ('driver', 'us/command', 'overhead us'))
+    for label, value in [
+            ('webdriver.Remote', bare),
+            ('stack inspection (before)', before),
+            ('thread-local marker (after)', after),
+            ('with --command-timing', timed)]:
+        print("%-35s %12.2f %12.2f" %
+              (label, value * 1e6, (value - bare) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Startup time and memory of each local browser mode, plain and with
+--lightweight-browser.
+
+For every mode a few sessions are started one after another through
+build_webdriver. Startup is the median time to a usable session, RSS the
+resident memory of all processes the session added under this one
+(driver and browser), read from /proc, so the RSS column needs Linux.
+Modes whose browser or driver isn't installed are reported as such.
+
+    $ python benchmarks/bench_local_modes.py [sessions] [url]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nose_selenium import SeleniumConfig, build_webdriver, \
+    remove_firefox_profile_clones
+
+MODES = ['FIREFOX', 'HEADLESS_FIREFOX', 'CHROME', 'HEADLESS_CHROME',
+         'PHANTOMJS']
+
+
+def _children():
+    """{pid: parent pid} of every process on the machine."""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        # the command name may hold spaces, the fields after it don't
+        parents[int(name)] = int(stat.rsplit(')', 1)[1].split()[1])
+    return parents
+
+
+def descendants_rss():
+    """Resident memory in MB of every process below this one."""
+    if not os.path.isdir('/proc'):
+        return None
+    parents = _children()
+    pids = set([os.getpid()])
+    while True:
+        more = set(pid for pid, parent in parents.items()
+                   if parent in pids and pid not in pids)
+        if not more:
+            break
+        pids |= more
+    pids.discard(os.getpid())
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/%d/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except IOError:
+            pass
+    return total / 1024.0
+
+
+def measure(browser, lightweight, sessions, url):
+    config = SeleniumConfig(BROWSER_LOCATION='local', BROWSER=browser,
+                            TIMEOUT=0, LIGHTWEIGHT_BROWSER=lightweight)
+    startups = []
+    rss = []
+    for i in range(sessions):
+        start = time.time()
+        wd = build_webdriver(config=config)
+        try:
+            startups.append(time.time() - start)
+            if url:
+                wd.get(url)
+            rss.append(descendants_rss())
+        finally:
+            wd.quit()
+    startups.sort()
+    median_rss = sorted(rss)[len(rss) // 2]
+    return startups[len(startups) // 2], median_rss
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    sessions = int(argv[1]) if len(argv) > 1 else 3
+    url = argv[2] if len(argv) > 2 else 'about:blank'
+
+    print("%-20s %-12s %10s %10s" % ('mode', 'lightweight', 'startup s',
+                                     'RSS MB'))
+    try:
+        for browser in MODES:
+            for lightweight in (False, True):
+                try:
+                    startup, rss = measure(browser, lightweight, sessions, url)
+                except Exception as e:
+                    print("%-20s %-12s unavailable: %s" % (
+                        browser, lightweight, str(e).splitlines()[0]))
+                    break
+                print("%-20s %-12s %10.2f %10s" % (
+                    browser, lightweight, startup,
+                    rss is None and 'n/a' or '%.0f' % rss))
+    finally:
+        remove_firefox_profile_clones()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Benchmarks of nose-selenium against tests/fake_remote.py, a stand-in
+WebDriver remote end on 127.0.0.1, so they need neither a browser nor a
+network and give the same numbers from one run to the next on the same
+machine. Each figure is the median of --repeat runs, per command costs
+the best of them.
+
+    commands     us per command through ScreenshotOnExceptionWebDriver,
+                 against a remote that answers at once
+    sessions     sessions created and quit per second
+    artifacts    what a failing command costs the test when it saves a
+                 screenshot and the html, and the background write
+    concurrency  commands per second and their latency as more sessions
+                 run at once, on threads and on the event-loop client
+
+    $ python benchmarks/bench_remote.py [--latency S] [--repeat N] [section ...]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException
+import nose_selenium
+from nose_selenium import LatencyHistogram, SeleniumConfig, build_webdriver, \
+    close_connection_pools, flush_failure_artifacts
+from nose_selenium_async import EventLoop, Return, run_coroutines, \
+    start_async_session
+from fake_remote import FakeRemoteServer
+
+SECTIONS = ['commands', 'sessions', 'artifacts', 'concurrency']
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def remote_config(remote, pool_size):
+    return SeleniumConfig(BROWSER_LOCATION='remote', BROWSER='FIREFOX',
+                          REMOTE_ADDRESS='127.0.0.1', REMOTE_PORT=remote.port,
+                          TIMEOUT=0, HTTP_POOL_SIZE=pool_size, HTTP_TIMEOUT=30)
+
+
+def per_command(drivers, commands, repeat):
+    """Best seconds per title command of each driver, after a warm-up
+    run. The drivers take turns so that whatever else the machine is
+    doing slows them alike; the best run is the least disturbed one."""
+    runs = [[] for wd in drivers]
+    for i in range(repeat + 1):
+        for wd, times in zip(drivers, runs):
+            start = time.time()
+            for j in range(commands):
+                wd.title
+            times.append((time.time() - start) / commands)
+    return [min(times[1:]) for times in runs]
+
+
+class TimedExecute(object):
+    """execute with --command-timing on for this one driver only."""
+
+    def __init__(self, wd):
+        self.execute = wd.execute
+        self.stats = nose_selenium.CommandStats()
+
+    def __call__(self, driver_command, params=None):
+        saved = nose_selenium._COMMAND_STATS
+        nose_selenium._COMMAND_STATS = self.stats
+        try:
+            return self.execute(driver_command, params)
+        finally:
+            nose_selenium._COMMAND_STATS = saved
+
+
+def bench_commands(options):
+    remote = FakeRemoteServer()
+    remote.start()
+    try:
+        bare = webdriver.Remote(command_executor=remote.url,
+                                desired_capabilities={'browserName': 'firefox'})
+        drivers = [
+            ('webdriver.Remote', bare),
+            ('ScreenshotOnExceptionWebDriver',
+             build_webdriver(config=remote_config(remote, 0))),
+            ('  with --http-pool-size=1',
+             build_webdriver(config=remote_config(remote, 1))),
+        ]
+        timed = build_webdriver(config=remote_config(remote, 1))
+        timed.execute = TimedExecute(timed)
+        drivers.append(('  with --http-pool-size=1 --command-timing', timed))
+        results = zip([label for label, wd in drivers],
+                      per_command([wd for label, wd in drivers],
+                                  options.commands, options.repeat))
+        for label, wd in drivers:
+            wd.quit()
+    finally:
+        close_connection_pools()
+        remote.stop()
+
+    base = results[0][1]
+    print("%-45s %12s %12s" % ('driver', 'us/command', 'overhead us'))
+    for label, value in results:
+        print("%-45s %12.1f %12.1f" % (label, value * 1e6, (value - base) * 1e6))
+
+
+def bench_sessions(options):
+    remote = FakeRemoteServer(latency=options.latency)
+    remote.start()
+    print("%-45s %12s" % ('sessions (latency %gs)' % options.latency,
+                          'sessions/s'))
+    try:
+        for label, pool_size in [('new connection per command', 0),
+                                 ('--http-pool-size=1', 1)]:
+            config = remote_config(remote, pool_size)
+            runs = []
+            for i in range(options.repeat):
+                start = time.time()
+                for j in range(options.sessions):
+                    build_webdriver(config=config).quit()
+                runs.append(options.sessions / (time.time() - start))
+            print("%-45s %12.1f" % (label, median(runs)))
+    finally:
+        close_connection_pools()
+        remote.stop()
+
+
+def bench_artifacts(options):
+    remote = FakeRemoteServer(latency=options.latency)
+    remote.start()
+    rng = random.Random(0)
+    path = tempfile.mkdtemp()
+    failures = options.failures
+    print("%-45s %12s %12s" % ('failing command (latency %gs, %dKB page)' % (
+        options.latency, options.page_kb), 'test ms', 'flush ms'))
+    try:
+        for label, saved_files_path, compress in [
+                ('no --saved-files-storage', None, False),
+                ('--saved-files-storage', path, False),
+                ('  with --compress-saved-files', path, True)]:
+            wd = build_webdriver(config=remote_config(remote, 1).replace(
+                SAVED_FILES_PATH=saved_files_path,
+                COMPRESS_SAVED_FILES=compress))
+            tests = []
+            writes = []
+            for i in range(options.repeat):
+                spent = 0.0
+                for j in range(failures):
+                    # new content every time, or the store would only
+                    # write it once
+                    screenshot = ''.join(chr(rng.randrange(256)) for k in
+                                         range(options.page_kb * 1024))
+                    remote.server.screenshot = screenshot.encode('base64')
+                    remote.server.page_source = '<html>%s</html>' % \
+                        screenshot.encode('hex')[:options.page_kb * 1024]
+                    start = time.time()
+                    try:
+                        wd.find_element_by_css_selector('#missing')
+                    except NoSuchElementException:
+                        pass
+                    spent += time.time() - start
+                tests.append(spent / failures)
+                start = time.time()
+                flush_failure_artifacts()
+                writes.append((time.time() - start) / failures)
+            print("%-45s %12.2f %12.2f" % (label, median(tests) * 1000,
+                                           median(writes) * 1000))
+            wd.quit()
+    finally:
+        close_connection_pools()
+        remote.stop()
+        shutil.rmtree(path)
+
+
+def _threaded_run(config, sessions, commands):
+    """Run `commands` title commands on each of `sessions` sessions, one
+    thread each. Returns (seconds, LatencyHistogram)."""
+    drivers = [build_webdriver(config=config) for i in range(sessions)]
+    histograms = [LatencyHistogram() for wd in drivers]
+    go = threading.Event()
+
+    def work(wd, histogram):
+        go.wait()
+        for i in range(commands):
+            start = time.time()
+            wd.title
+            histogram.record(time.time() - start)
+
+    threads = [threading.Thread(target=work, args=args)
+               for args in zip(drivers, histograms)]
+    for thread in threads:
+        thread.start()
+    start = time.time()
+    go.set()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    for wd in drivers:
+        wd.quit()
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return seconds, merged
+
+
+def _event_loop_run(config, sessions, commands):
+    """The same on one EventLoop with AsyncWebDriver sessions."""
+    loop = EventLoop()
+    merged = LatencyHistogram()
+
+    def work():
+        wd = yield start_async_session(loop, config=config)
+        try:
+            for i in range(commands):
+                start = time.time()
+                yield wd.title()
+                merged.record(time.time() - start)
+        finally:
+            yield wd.quit()
+        raise Return(None)
+
+    start = time.time()
+    run_coroutines([work() for i in range(sessions)], sessions, loop)
+    # session start and quit are in here too, unlike the threaded run
+    return time.time() - start, merged
+
+
+def bench_concurrency(options):
+    remote = FakeRemoteServer(latency=options.latency)
+    remote.start()
+    print("%-12s %9s %12s %9s %9s" % (
+        'client', 'sessions', 'commands/s', 'p50 ms', 'p95 ms'))
+    try:
+        for label, run in [('threads', _threaded_run),
+                           ('event loop', _event_loop_run)]:
+            for sessions in options.levels:
+                config = remote_config(remote, sessions)
+                runs = []
+                for i in range(options.repeat):
+                    seconds, histogram = run(config, sessions, options.commands
+                                             // 10)
+                    runs.append((sessions * (options.commands // 10) / seconds,
+                                 histogram))
+                rate, histogram = sorted(runs)[len(runs) // 2]
+                print("%-12s %9d %12.0f %9.2f %9.2f" % (
+                    label, sessions, rate, histogram.percentile(50) * 1000,
+                    histogram.percentile(95) * 1000))
+                close_connection_pools()
+    finally:
+        close_connection_pools()
+        remote.stop()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = OptionParser("%prog [options] [section ...]")
+    parser.add_option("--latency", dest="latency", type="float", default=0.005,
+            help="seconds every fake remote command takes, except in "
+                 "the commands section (default: 0.005)")
+    parser.add_option("--repeat", dest="repeat", type="int", default=5,
+            help="runs per figure, the median is shown (default: 5)")
+    parser.add_option("--commands", dest="commands", type="int", default=1000,
+            help="commands per run (default: 1000)")
+    parser.add_option("--sessions", dest="sessions", type="int", default=50,
+            help="sessions per run in the sessions section (default: 50)")
+    parser.add_option("--failures", dest="failures", type="int", default=20,
+            help="failures per run in the artifacts section (default: 20)")
+    parser.add_option("--page-kb", dest="page_kb", type="int", default=100,
+            help="screenshot and html size in the artifacts section "
+                 "(default: 100)")
+    parser.add_option("--levels", dest="levels", default="1,2,4,8,16,32",
+            help="concurrent sessions in the concurrency section "
+                 "(default: 1,2,4,8,16,32)")
+
+    options, sections = parser.parse_args(argv[1:])
+    options.levels = [int(level) for level in options.levels.split(',')]
+    for section in sections:
+        if section not in SECTIONS:
+            parser.error("unknown section %s, choose from %s" % (
+                section, ", ".join(SECTIONS)))
+
+    for section in sections or SECTIONS:
+        print("")
+        globals()['bench_' + section](options)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,51 @@
 import os
+import sys
+import atexit
+import base64
+import gzip
+import hashlib
+import heapq
+import itertools
+from bisect import bisect_left
 import requests
+import shutil
+import tempfile
+import threading
 import time
 import inspect
+import httplib
+import select
+import socket
+import urlparse
+import unittest
 from json import dumps, loads
+from nose.case import Test as NoseTest
 from nose.plugins import Plugin
+from nose.plugins.capture import Capture
+from nose.plugins.logcapture import LogCapture, MyMemoryHandler
+import selenium
 from selenium import webdriver
-from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.common.exceptions import WebDriverException, TimeoutException, \
+    NoSuchElementException
+from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.webdriver.firefox import firefox_profile
+from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
+from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
+from selenium.webdriver.ie.service import Service as IeService
 from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.remote_connection import RemoteConnection
 from selenium.webdriver.support.select import Select
 from selenium.webdriver.support.ui import WebDriverWait
 from unittest2 import TestCase
 from exceptions import TypeError #  , Exception
 from ConfigParser import ConfigParser
+from Queue import Queue, Empty
+from StringIO import StringIO
 #from urllib2 import URLError
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import logging
 logger = logging.getLogger(__name__)
@@ -21,6 +54,11 @@ logger.setLevel(logging.DEBUG)
 
 # storing these at module level so they can be imported into scripts
 BROWSER_LOCATION = None
+LOCAL_DRIVER_SERVICE = None
+FIREFOX_PROFILE = None
+FIREFOX_EXTENSIONS = None
+FIREFOX_PREFS = None
+LIGHTWEIGHT_BROWSER = None
 BROWSER = None
 BUILD = None
 BROWSER_VERSION = None
@@ -31,6 +69,70 @@ TIMEOUT = None
 SAUCE_USERNAME = None
 SAUCE_APIKEY = None
 SAVED_FILES_PATH = None
+SESSION_SCOPE = None
+SESSION_POOL_SIZE = None
+SESSION_MAX_USES = None
+SESSION_MAX_AGE = None
+MAX_BROWSERS = None
+SLOT_TIMEOUT = None
+GRID_MAX_PENDING = None
+GRID_QUEUE_TIMEOUT = None
+GROUP_BY_CAPABILITIES = None
+THREADS = None
+BROWSER_MATRIX = None
+SAUCE_BROWSERS_FILE = None
+SAUCE_CACHE_TTL = None
+SAUCE_OFFLINE = None
+COMPRESS_SAVED_FILES = None
+COMMAND_TIMING = None
+COMMAND_TIMING_FILE = None
+PHASE_TIMING = None
+PHASE_TIMING_FILE = None
+HTTP_POOL_SIZE = None
+HTTP_TIMEOUT = None
+WAIT_MODE = None
+WAIT_POLL = None
+WAIT_POLL_MAX = None
+WAIT_BACKOFF = None
+
+VALID_WAIT_MODES = ['implicit', 'explicit']
+
+# option defaults, also used by waits when no config sets them
+DEFAULT_TIMEOUT = 60
+DEFAULT_WAIT_POLL = 0.05
+DEFAULT_WAIT_POLL_MAX = 1.0
+DEFAULT_WAIT_BACKOFF = 1.5
+
+# where the Sauce Labs browser catalogue is cached between runs
+SAUCE_CACHE_PATH = os.path.join(tempfile.gettempdir(),
+                                'nose-selenium-sauce-browsers.json')
+
+# local BROWSERs that run another browser without a display
+HEADLESS_BROWSERS = {
+    'HEADLESS_CHROME': 'CHROME',
+    'HEADLESS_FIREFOX': 'FIREFOX',
+}
+HEADLESS_CHROME_ARGS = ['--headless', '--disable-gpu']
+
+# what --lightweight-browser turns off: images, GPU and extensions
+LIGHTWEIGHT_CHROME_ARGS = ['--disable-gpu', '--disable-extensions',
+                           '--blink-settings=imagesEnabled=false']
+LIGHTWEIGHT_CHROME_PREFS = {'profile.managed_default_content_settings.images': 2}
+# Firefox needs the WebDriver extension, so only its update checks go
+LIGHTWEIGHT_FIREFOX_PREFS = {
+    'permissions.default.image': 2,
+    'layers.acceleration.disabled': True,
+    'gfx.direct2d.disabled': True,
+    'extensions.update.enabled': False,
+    'extensions.blocklist.enabled': False,
+}
+LIGHTWEIGHT_PHANTOMJS_ARGS = ['--load-images=false']
+
+# where built Firefox profile templates are cached between runs
+FIREFOX_PROFILE_CACHE_PATH = os.path.join(tempfile.gettempdir(),
+                                          'nose-selenium-firefox-profiles')
+
+VALID_SESSION_SCOPES = ['test', 'class', 'module', 'run']
 
 def setup_selenium_from_config(config):
     """Start selenium with values from config file, or defaults
@@ -38,6 +140,11 @@ def setup_selenium_from_config(config):
     ConfigParser compliant and have a section called 'SELENIUM'.
     """
     global BROWSER_LOCATION
+    global LOCAL_DRIVER_SERVICE
+    global FIREFOX_PROFILE
+    global FIREFOX_EXTENSIONS
+    global FIREFOX_PREFS
+    global LIGHTWEIGHT_BROWSER
     global BROWSER
     global BUILD
     global BROWSER_VERSION
@@ -48,6 +155,31 @@ def setup_selenium_from_config(config):
     global SAUCE_USERNAME
     global SAUCE_APIKEY
     global SAVED_FILES_PATH
+    global SESSION_SCOPE
+    global SESSION_POOL_SIZE
+    global SESSION_MAX_USES
+    global SESSION_MAX_AGE
+    global MAX_BROWSERS
+    global SLOT_TIMEOUT
+    global GRID_MAX_PENDING
+    global GRID_QUEUE_TIMEOUT
+    global GROUP_BY_CAPABILITIES
+    global THREADS
+    global BROWSER_MATRIX
+    global SAUCE_BROWSERS_FILE
+    global SAUCE_CACHE_TTL
+    global SAUCE_OFFLINE
+    global COMPRESS_SAVED_FILES
+    global COMMAND_TIMING
+    global COMMAND_TIMING_FILE
+    global PHASE_TIMING
+    global PHASE_TIMING_FILE
+    global HTTP_POOL_SIZE
+    global HTTP_TIMEOUT
+    global WAIT_MODE
+    global WAIT_POLL
+    global WAIT_POLL_MAX
+    global WAIT_BACKOFF
 
     if config.has_option("SELENIUM", "BROWSER_LOCATION"):
         BROWSER_LOCATION = config.get("SELENIUM", "BROWSER_LOCATION")
@@ -68,6 +200,16 @@ def setup_selenium_from_config(config):
     if config.has_option("SELENIUM", "OS"):
         OS = config.get("SELENIUM", "OS")
 
+    # lists of browsers, oses or versions, or a [MATRIX] section of
+    # name: BROWSER[, OS[, BROWSER_VERSION]] lines, make a matrix
+    BROWSER_MATRIX = browser_matrix(BROWSER, OS, BROWSER_VERSION)
+    if config.has_section("MATRIX"):
+        BROWSER_MATRIX = [BrowserCombination.parse(value, name)
+                          for name, value in config.items("MATRIX")]
+    if BROWSER_MATRIX:
+        first = BROWSER_MATRIX[0]
+        BROWSER, OS, BROWSER_VERSION = first.browser, first.os, first.version
+
     if config.has_option("SELENIUM", "REMOTE_ADDRESS"):
         REMOTE_ADDRESS = config.get("SELENIUM", "REMOTE_ADDRESS")
 
@@ -79,7 +221,37 @@ def setup_selenium_from_config(config):
     if config.has_option("SELENIUM", "TIMEOUT"):
         TIMEOUT = config.getfloat("SELENIUM", "TIMEOUT")
     else:
-        TIMEOUT = 60
+        TIMEOUT = DEFAULT_TIMEOUT
+
+    if config.has_option("SELENIUM", "WAIT_MODE"):
+        WAIT_MODE = config.get("SELENIUM", "WAIT_MODE")
+    else:
+        WAIT_MODE = 'implicit'
+
+    if config.has_option("SELENIUM", "WAIT_POLL"):
+        WAIT_POLL = config.getfloat("SELENIUM", "WAIT_POLL")
+    else:
+        WAIT_POLL = DEFAULT_WAIT_POLL
+
+    if config.has_option("SELENIUM", "WAIT_POLL_MAX"):
+        WAIT_POLL_MAX = config.getfloat("SELENIUM", "WAIT_POLL_MAX")
+    else:
+        WAIT_POLL_MAX = DEFAULT_WAIT_POLL_MAX
+
+    if config.has_option("SELENIUM", "WAIT_BACKOFF"):
+        WAIT_BACKOFF = config.getfloat("SELENIUM", "WAIT_BACKOFF")
+    else:
+        WAIT_BACKOFF = DEFAULT_WAIT_BACKOFF
+
+    if config.has_option("SELENIUM", "HTTP_POOL_SIZE"):
+        HTTP_POOL_SIZE = config.getint("SELENIUM", "HTTP_POOL_SIZE")
+    else:
+        HTTP_POOL_SIZE = 10
+
+    if config.has_option("SELENIUM", "HTTP_TIMEOUT"):
+        HTTP_TIMEOUT = config.getfloat("SELENIUM", "HTTP_TIMEOUT")
+    else:
+        HTTP_TIMEOUT = 0
 
     if config.has_option("SELENIUM", "SAUCE_USERNAME"):
         SAUCE_USERNAME = config.get("SELENIUM", "SAUCE_USERNAME")
@@ -87,14 +259,509 @@ def setup_selenium_from_config(config):
     if config.has_option("SELENIUM", "SAUCE_APIKEY"):
         SAUCE_APIKEY = config.get("SELENIUM", "SAUCE_APIKEY")
 
+    if config.has_option("SELENIUM", "LOCAL_DRIVER_SERVICE"):
+        LOCAL_DRIVER_SERVICE = config.getboolean("SELENIUM", "LOCAL_DRIVER_SERVICE")
+    else:
+        LOCAL_DRIVER_SERVICE = False
+
+    if config.has_option("SELENIUM", "FIREFOX_PROFILE"):
+        FIREFOX_PROFILE = config.get("SELENIUM", "FIREFOX_PROFILE") or None
+
+    if config.has_option("SELENIUM", "FIREFOX_EXTENSIONS"):
+        FIREFOX_EXTENSIONS = _split_list(config.get("SELENIUM", "FIREFOX_EXTENSIONS"))
+    else:
+        FIREFOX_EXTENSIONS = []
+
+    # one name=value preference per line
+    if config.has_option("SELENIUM", "FIREFOX_PREFS"):
+        FIREFOX_PREFS = parse_firefox_prefs(
+            config.get("SELENIUM", "FIREFOX_PREFS").splitlines())
+    else:
+        FIREFOX_PREFS = {}
+
+    if config.has_option("SELENIUM", "LIGHTWEIGHT_BROWSER"):
+        LIGHTWEIGHT_BROWSER = config.getboolean("SELENIUM", "LIGHTWEIGHT_BROWSER")
+    else:
+        LIGHTWEIGHT_BROWSER = False
+
     if config.has_option("SELENIUM", "SAVED_FILES_PATH"):
         SAVED_FILES_PATH = config.get("SELENIUM", "SAVED_FILES_PATH")
 
+    if config.has_option("SELENIUM", "COMPRESS_SAVED_FILES"):
+        COMPRESS_SAVED_FILES = config.getboolean("SELENIUM", "COMPRESS_SAVED_FILES")
+    else:
+        COMPRESS_SAVED_FILES = False
+
+    if config.has_option("SELENIUM", "COMMAND_TIMING"):
+        COMMAND_TIMING = config.getboolean("SELENIUM", "COMMAND_TIMING")
+    else:
+        COMMAND_TIMING = False
+
+    if config.has_option("SELENIUM", "COMMAND_TIMING_FILE"):
+        COMMAND_TIMING_FILE = config.get("SELENIUM", "COMMAND_TIMING_FILE")
+
+    if config.has_option("SELENIUM", "PHASE_TIMING"):
+        PHASE_TIMING = config.getboolean("SELENIUM", "PHASE_TIMING")
+    else:
+        PHASE_TIMING = False
+
+    if config.has_option("SELENIUM", "PHASE_TIMING_FILE"):
+        PHASE_TIMING_FILE = config.get("SELENIUM", "PHASE_TIMING_FILE")
+
+    if config.has_option("SELENIUM", "SESSION_SCOPE"):
+        SESSION_SCOPE = config.get("SELENIUM", "SESSION_SCOPE")
+    else:
+        SESSION_SCOPE = 'test'
+
+    if config.has_option("SELENIUM", "SESSION_POOL_SIZE"):
+        SESSION_POOL_SIZE = config.getint("SELENIUM", "SESSION_POOL_SIZE")
+    else:
+        SESSION_POOL_SIZE = 0
+
+    if config.has_option("SELENIUM", "SESSION_MAX_USES"):
+        SESSION_MAX_USES = config.getint("SELENIUM", "SESSION_MAX_USES")
+    else:
+        SESSION_MAX_USES = 0
+
+    if config.has_option("SELENIUM", "SESSION_MAX_AGE"):
+        SESSION_MAX_AGE = config.getfloat("SELENIUM", "SESSION_MAX_AGE")
+    else:
+        SESSION_MAX_AGE = 0
+
+    if config.has_option("SELENIUM", "MAX_BROWSERS"):
+        MAX_BROWSERS = config.getint("SELENIUM", "MAX_BROWSERS")
+    else:
+        MAX_BROWSERS = 0
+
+    if config.has_option("SELENIUM", "SLOT_TIMEOUT"):
+        SLOT_TIMEOUT = config.getfloat("SELENIUM", "SLOT_TIMEOUT")
+    else:
+        SLOT_TIMEOUT = 300
+
+    if config.has_option("SELENIUM", "GRID_MAX_PENDING"):
+        GRID_MAX_PENDING = config.getint("SELENIUM", "GRID_MAX_PENDING")
+    else:
+        GRID_MAX_PENDING = 0
+
+    if config.has_option("SELENIUM", "GRID_QUEUE_TIMEOUT"):
+        GRID_QUEUE_TIMEOUT = config.getfloat("SELENIUM", "GRID_QUEUE_TIMEOUT")
+    else:
+        GRID_QUEUE_TIMEOUT = 300
+
+    if config.has_option("SELENIUM", "GROUP_BY_CAPABILITIES"):
+        GROUP_BY_CAPABILITIES = config.getboolean("SELENIUM", "GROUP_BY_CAPABILITIES")
+    else:
+        GROUP_BY_CAPABILITIES = False
+
+    if config.has_option("SELENIUM", "THREADS"):
+        THREADS = config.getint("SELENIUM", "THREADS")
+    else:
+        THREADS = 0
+
+    if config.has_option("SELENIUM", "SAUCE_BROWSERS_FILE"):
+        SAUCE_BROWSERS_FILE = config.get("SELENIUM", "SAUCE_BROWSERS_FILE")
+
+    if config.has_option("SELENIUM", "SAUCE_CACHE_TTL"):
+        SAUCE_CACHE_TTL = config.getint("SELENIUM", "SAUCE_CACHE_TTL")
+    else:
+        SAUCE_CACHE_TTL = 86400
+
+    if config.has_option("SELENIUM", "SAUCE_OFFLINE"):
+        SAUCE_OFFLINE = config.getboolean("SELENIUM", "SAUCE_OFFLINE")
+    else:
+        SAUCE_OFFLINE = False
+
+def _parse_sauce_catalogue(entries):
+    # output from sauce labs
+    # {
+    #     "api_name": "firefox",
+    #     "automation_backend": "webdriver",
+    #     "long_name": "Firefox",
+    #     "long_version": "19.0.",
+    #     "os": "Linux",
+    #     "preferred_version": "11",
+    #     "scout": "webdriver",
+    #     "short_version": "19"
+    # },
+    browser_hash = {}
+    os_hash = {}
+    combos = []
+    for entry in entries:
+        browser_hash.update({entry['api_name']: 1})
+        os_hash.update({entry['os']: 1})
+        combos.append("\t\t".join(
+            [ entry['os'], entry['api_name'], entry['short_version']]))
+    return (browser_hash.keys(), os_hash.keys(), combos)
+
+
+def _read_sauce_cache():
+    """Return (age in seconds, catalogue) of the cached catalogue, or
+    (None, None) if there is no usable cache."""
+    try:
+        infile = open(SAUCE_CACHE_PATH)
+        try:
+            cached = loads(infile.read())
+        finally:
+            infile.close()
+        catalogue = (cached['browsers'], cached['oses'], cached['combos'])
+        return (time.time() - cached['fetched'], catalogue)
+    except (IOError, ValueError, KeyError, TypeError):
+        return (None, None)
+
+
+def _write_sauce_cache(catalogue):
+    browsers, oses, combos = catalogue
+    # write then rename, so parallel workers never read half a file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(SAUCE_CACHE_PATH))
+    outfile = os.fdopen(fd, 'w')
+    try:
+        outfile.write(dumps({'fetched': time.time(), 'browsers': browsers,
+                             'oses': oses, 'combos': combos}))
+    finally:
+        outfile.close()
+    _replace_file(tmp_path, SAUCE_CACHE_PATH)
+
+
+def _replace_file(source, destination):
+    """Rename source over destination. Windows won't rename over an
+    existing file, so there the old one is removed first, which leaves a
+    moment without either; if that fails too (another process has it
+    open, or got its own file in first) source is dropped."""
+    try:
+        os.rename(source, destination)
+        return
+    except OSError:
+        pass
+    try:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+    except OSError as e:
+        logger.debug("Could not replace %s: %s" % (destination, e))
+        os.remove(source)
+
+
+def load_sauce_catalogue():
+    """Return (browsers, oses, combos) offered by Sauce Labs.
+
+    Reads SAUCE_BROWSERS_FILE when it is set. Otherwise the catalogue
+    cached at SAUCE_CACHE_PATH is used while it is younger than
+    SAUCE_CACHE_TTL seconds (at any age if SAUCE_OFFLINE is set, or if the
+    Sauce Labs API can't be reached), and refreshed from the API when not.
+    """
+    if SAUCE_BROWSERS_FILE:
+        infile = open(SAUCE_BROWSERS_FILE)
+        try:
+            return _parse_sauce_catalogue(loads(infile.read()))
+        finally:
+            infile.close()
+
+    age, catalogue = _read_sauce_cache()
+    if catalogue is not None:
+        if SAUCE_OFFLINE or (SAUCE_CACHE_TTL and age < SAUCE_CACHE_TTL):
+            return catalogue
+    if SAUCE_OFFLINE:
+        raise TypeError("--sauce-offline requires a cached Sauce Labs browser "
+                        "list in %s or --sauce-browsers-file." % SAUCE_CACHE_PATH)
+
+    uri = 'http://saucelabs.com/rest/v1/info/browsers/webdriver'
+    try:
+        resp = loads(requests.get(
+            uri, headers={ 'accepts': 'application/json'}, timeout=30).text)
+    except (requests.RequestException, ValueError) as e:
+        if catalogue is None:
+            raise
+        logger.warning("Using Sauce Labs browser list cached %d seconds ago, "
+                       "could not refresh it: %s" % (age, e))
+        return catalogue
+    catalogue = _parse_sauce_catalogue(resp)
+    try:
+        _write_sauce_cache(catalogue)
+    except (IOError, OSError) as e:
+        logger.warning("Could not cache the Sauce Labs browser list: %s" % e)
+    return catalogue
+
+
+class BrowserCombination(object):
+    """One BROWSER, OS and BROWSER_VERSION of a browser matrix."""
+
+    def __init__(self, browser, os=None, version='', name=None):
+        self.browser = browser
+        self.os = os
+        self.version = version
+        self.name = name or "-".join(
+            [part for part in [browser, os, version] if part])
+
+    @classmethod
+    def parse(cls, value, name=None):
+        """Read a 'BROWSER[, OS[, BROWSER_VERSION]]' config line."""
+        parts = _split_list(value)
+        if not parts:
+            raise TypeError("browser matrix entry %s has no browser" % name)
+        parts += [None, ''][len(parts) - 1:]
+        return cls(parts[0], parts[1], parts[2], name)
+
+    def __repr__(self):
+        return "<BrowserCombination %s>" % self.name
+
+
+def _split_list(value):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def parse_firefox_prefs(lines):
+    """Firefox preferences from name=value strings. Values are read as
+    JSON (true, 2, "text"), or else taken as plain strings."""
+    prefs = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if '=' not in line:
+            raise TypeError("Firefox preference %s is not name=value" % line)
+        name, value = line.split('=', 1)
+        try:
+            value = loads(value.strip())
+        except ValueError:
+            value = value.strip()
+        prefs[name.strip()] = value
+    return prefs
+
+
+def browser_matrix(browsers, oses=None, versions=None):
+    """Return every BrowserCombination of comma-separated lists of
+    browsers, oses and versions, or None when they only make one."""
+    combinations = [
+        BrowserCombination(browser, os_name, version)
+        for browser in _split_list(browsers)
+        for os_name in (_split_list(oses) or [oses or None])
+        for version in (_split_list(versions) or [versions or ''])]
+    if len(combinations) < 2:
+        return None
+    return combinations
+
+
+# the module globals a SeleniumConfig holds
+CONFIG_SETTINGS = [
+    'BROWSER_LOCATION', 'LOCAL_DRIVER_SERVICE', 'FIREFOX_PROFILE',
+    'FIREFOX_EXTENSIONS', 'FIREFOX_PREFS', 'LIGHTWEIGHT_BROWSER', 'BROWSER',
+    'BUILD', 'BROWSER_VERSION', 'OS',
+    'REMOTE_ADDRESS', 'REMOTE_PORT', 'TIMEOUT', 'SAUCE_USERNAME',
+    'SAUCE_APIKEY', 'SAVED_FILES_PATH', 'SESSION_SCOPE', 'SESSION_POOL_SIZE',
+    'SESSION_MAX_USES', 'SESSION_MAX_AGE', 'MAX_BROWSERS', 'SLOT_TIMEOUT',
+    'GRID_MAX_PENDING', 'GRID_QUEUE_TIMEOUT', 'GROUP_BY_CAPABILITIES', 'THREADS', 'BROWSER_MATRIX',
+    'SAUCE_BROWSERS_FILE', 'SAUCE_CACHE_TTL', 'SAUCE_OFFLINE',
+    'COMPRESS_SAVED_FILES', 'COMMAND_TIMING', 'COMMAND_TIMING_FILE',
+    'PHASE_TIMING', 'PHASE_TIMING_FILE', 'HTTP_POOL_SIZE', 'HTTP_TIMEOUT',
+    'WAIT_MODE', 'WAIT_POLL', 'WAIT_POLL_MAX', 'WAIT_BACKOFF',
+]
+
+
+class _FrozenDict(dict):
+    """A dict setting of a SeleniumConfig, which can't be changed."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("SeleniumConfig is immutable, use replace()")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _immutable
+
+
+def _frozen(value):
+    """`value` with its lists made tuples and its dicts _FrozenDicts."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(item) for item in value)
+    if isinstance(value, dict):
+        return _FrozenDict((key, _frozen(item)) for key, item in value.items())
+    return value
+
+
+def _thawed(value):
+    """A mutable copy of a _frozen() value."""
+    if isinstance(value, tuple):
+        return [_thawed(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, _thawed(item)) for key, item in value.items())
+    return value
+
+
+class SeleniumConfig(object):
+    """An immutable set of nose-selenium settings, read as attributes
+    named like the module globals (config.BROWSER, config.TIMEOUT...).
+    The executor URL and the desired capabilities for BROWSER are worked
+    out when it is made. Lists and dicts among the settings are copied
+    into tuples and read-only dicts. Give one to build_webdriver to start
+    sessions with different settings side by side in one process."""
+
+    def __init__(self, **settings):
+        unknown = set(settings) - set(CONFIG_SETTINGS)
+        if unknown:
+            raise TypeError("unknown settings: %s" % ", ".join(sorted(unknown)))
+        values = dict((name, _frozen(settings.get(name)))
+                      for name in CONFIG_SETTINGS)
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, 'executor', self._executor())
+        try:
+            capabilities = self._base_capabilities(
+                self.BROWSER, self.OS, self.BROWSER_VERSION)
+        except (AttributeError, TypeError):
+            # not valid yet; building a session will say why
+            capabilities = None
+        object.__setattr__(self, '_capabilities', capabilities)
+
+    @classmethod
+    def from_globals(cls):
+        """A SeleniumConfig holding the current module globals."""
+        module = globals()
+        return cls(**dict((name, module[name]) for name in CONFIG_SETTINGS))
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SeleniumConfig is immutable, use replace()")
+
+    __delattr__ = __setattr__
+
+    def __eq__(self, other):
+        return (isinstance(other, SeleniumConfig) and
+                self._values == other._values)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def replace(self, **changes):
+        """Return a copy with some settings changed."""
+        values = dict(self._values)
+        values.update(changes)
+        return SeleniumConfig(**values)
+
+    def as_dict(self):
+        return dict(self._values)
+
+    def _executor(self):
+        if self.BROWSER_LOCATION in ('remote', 'grid'):
+            return 'http://%s:%s/wd/hub' % (self.REMOTE_ADDRESS, self.REMOTE_PORT)
+        elif self.BROWSER_LOCATION == 'sauce':
+            return 'http://%s:%s@ondemand.saucelabs.com:80/wd/hub' % (
+                self.SAUCE_USERNAME, self.SAUCE_APIKEY)
+        return None
+
+    def _base_capabilities(self, browser, os_name, version):
+        if self.BROWSER_LOCATION == 'remote':
+            return dict(getattr(webdriver.DesiredCapabilities, browser.upper()))
+        elif self.BROWSER_LOCATION == 'grid':
+            capabilities = dict(getattr(webdriver.DesiredCapabilities,
+                                        browser.upper()))
+            capabilities['version'] = version
+            capabilities['platform'] = os_name.upper()
+            return capabilities
+        elif self.BROWSER_LOCATION == 'sauce':
+            return {
+                'build': self.BUILD,
+                'platform': os_name,
+                'browserName': browser,
+                'version': version,
+            }
+        return None
+
+    def capabilities(self, combination=None, extra=None, name="", tags=[],
+                     public=False):
+        """Desired capabilities for a new remote, grid or sauce session,
+        for BROWSER or a BrowserCombination, with `extra` on top. `name`,
+        `tags` and `public` describe the job to Sauce Labs."""
+        if combination is None:
+            capabilities = self._capabilities
+            if capabilities is None:
+                capabilities = self._base_capabilities(
+                    self.BROWSER, self.OS, self.BROWSER_VERSION)
+        else:
+            capabilities = self._base_capabilities(
+                combination.browser, combination.os, combination.version)
+        capabilities = dict(capabilities)
+        if self.BROWSER_LOCATION == 'sauce':
+            capabilities.update({
+                'name': name,
+                'tags': tags,
+                'public': public,
+                'restricted-public-info': not public,
+            })
+        capabilities.update(extra or {})
+        return capabilities
+
+
+# the SeleniumConfig the module globals were last frozen into
+CONFIG = None
+_FACTORY = None
+_CONFIG_LOCK = threading.Lock()
+
+
+def use_config(config):
+    """Make `config` the current configuration, copying its settings
+    into the module globals."""
+    global CONFIG
+    global _FACTORY
+    with _CONFIG_LOCK:
+        globals().update((name, _thawed(value))
+                         for name, value in config.as_dict().items())
+        CONFIG = config
+        _FACTORY = None
+
+
+def current_config():
+    """Return the current SeleniumConfig. Scripts that assign to the
+    module globals directly still work: a changed global makes a new
+    config."""
+    global CONFIG
+    global _FACTORY
+    module = globals()
+    config = CONFIG
+    if config is not None and all(
+            _frozen(module[name]) == value
+            for name, value in config._values.items()):
+        return config
+    with _CONFIG_LOCK:
+        CONFIG = SeleniumConfig.from_globals()
+        _FACTORY = None
+        return CONFIG
+
+
+def _config_of(wd):
+    """The SeleniumConfig `wd` was built with, current_config() for
+    sessions made some other way."""
+    return getattr(wd, '_nose_selenium_config', None) or current_config()
+
+
+def driver_factory():
+    """The WebDriverFactory for current_config()."""
+    global _FACTORY
+    config = current_config()
+    factory = _FACTORY
+    if factory is None or factory.config is not config:
+        factory = _FACTORY = WebDriverFactory(config)
+    return factory
+
+
 class NoseSelenium(Plugin):
 
     name = 'nose-selenium'
     score = 200
     status = {}
+    worker = False
+    parent_of_workers = False
+    phase_timings = None
+    # the validated SeleniumConfig of the run
+    config = None
+
+    def __init__(self):
+        super(NoseSelenium, self).__init__()
+        # {combination name: {'passed': n, 'failed': n, 'errors': n}}
+        self.matrix_results = {}
 
     def help(self):
         pass
@@ -127,10 +794,50 @@ class NoseSelenium(Plugin):
                           action='store',
                           default=env.get('SELENIUM_BROWSER', 'FIREFOX'),
                           dest='browser',
-                          help="Run this type of browser (default %default). " +
+                          help="Run this type of browser (default %default), or a " +
+                               "comma-separated list of them. " +
                                "run --browser-help for a list of what browsers are available. " +
                                "May be stored in environmental variable SELENIUM_BROWSER."
         )
+        parser.add_option('--local-driver-service',
+                          action='store_true',
+                          default=False,
+                          dest='local_driver_service',
+                          help="Start chromedriver or IEDriverServer once and run every " +
+                               "local session through it, instead of one per session."
+        )
+        parser.add_option('--lightweight-browser',
+                          action='store_true',
+                          default=False,
+                          dest='lightweight_browser',
+                          help="Start local browsers without images, GPU acceleration " +
+                               "or extensions, for faster startup and less memory."
+        )
+        parser.add_option('--firefox-profile',
+                          action='store',
+                          dest='firefox_profile',
+                          default=env.get('SELENIUM_FIREFOX_PROFILE'),
+                          metavar='DIR',
+                          help="Start local Firefox sessions from a copy of this profile " +
+                               "directory (prefs, certificates...). May be stored in " +
+                               "environmental variable SELENIUM_FIREFOX_PROFILE."
+        )
+        parser.add_option('--firefox-extension',
+                          action='append',
+                          dest='firefox_extensions',
+                          default=[],
+                          metavar='PATH',
+                          help="Install this .xpi in local Firefox sessions. May be given " +
+                               "more than once."
+        )
+        parser.add_option('--firefox-pref',
+                          action='append',
+                          dest='firefox_prefs',
+                          default=[],
+                          metavar='NAME=VALUE',
+                          help="Set this preference in local Firefox sessions, the value " +
+                               "read as JSON. May be given more than once."
+        )
         parser.add_option('--browser-help',
                           action='store_true',
                           dest='browser_help',
@@ -149,14 +856,15 @@ class NoseSelenium(Plugin):
                           type='str',
                           default="",
                           dest='browser_version',
-                          help='Run this version of the browser. ' +
-                               '(default: %default implies latest.)'
+                          help='Run this version of the browser, or a comma-separated ' +
+                               'list of versions. (default: %default implies latest.)'
         )
         parser.add_option('--os',
                           action='store',
                           dest='os',
                           default=None,
-                          help="Run the browser on this operating system. " +
+                          help="Run the browser on this operating system, or a " +
+                               "comma-separated list of them. " +
                                "(default: %default, required for grid or sauce)"
         )
         parser.add_option('--grid-address',
@@ -177,6 +885,26 @@ class NoseSelenium(Plugin):
                           help='port that selenium grid is listening on. ' +
                                '(default: %default)'
         )
+        parser.add_option('--grid-max-pending',
+                          action='store',
+                          dest='grid_max_pending',
+                          type='int',
+                          default=int(env.get('SELENIUM_GRID_MAX_PENDING', 0)),
+                          metavar='num',
+                          help='Send at most this many new session requests to the grid ' +
+                               'hub at once, queueing the rest until the hub reports free ' +
+                               'slots. (default: %default, disabled) May be stored in ' +
+                               'environmental variable SELENIUM_GRID_MAX_PENDING.'
+        )
+        parser.add_option('--grid-queue-timeout',
+                          action='store',
+                          dest='grid_queue_timeout',
+                          type='float',
+                          default=300,
+                          metavar='num',
+                          help='seconds a session request may wait for grid capacity ' +
+                               'when --grid-max-pending is set. (default: %default)'
+        )
         parser.add_option('--remote-address',
                           action='store',
                           dest='remote_address',
@@ -197,11 +925,68 @@ class NoseSelenium(Plugin):
         parser.add_option('--timeout',
                           action='store',
                           type='int',
-                          default=60,
+                          default=DEFAULT_TIMEOUT,
                           metavar='num',
                           help='timeout (in seconds) for page loads, etc. ' +
                                '(default: %default)'
         )
+        parser.add_option('--wait-mode',
+                          action='store',
+                          choices=VALID_WAIT_MODES,
+                          default='implicit',
+                          dest='wait_mode',
+                          help="'implicit' sets WebDriver's implicit wait to --timeout. " +
+                               "'explicit' sets it to 0, for tests that wait with " +
+                               "AdaptiveWait, and reports time spent waiting. " +
+                               "(default %default)"
+        )
+        parser.add_option('--wait-poll',
+                          action='store',
+                          type='float',
+                          default=DEFAULT_WAIT_POLL,
+                          dest='wait_poll',
+                          metavar='num',
+                          help='seconds AdaptiveWait waits before polling again at ' +
+                               'first. (default: %default)'
+        )
+        parser.add_option('--wait-backoff',
+                          action='store',
+                          type='float',
+                          default=DEFAULT_WAIT_BACKOFF,
+                          dest='wait_backoff',
+                          metavar='num',
+                          help='factor the AdaptiveWait poll interval grows by after ' +
+                               'every poll. (default: %default)'
+        )
+        parser.add_option('--wait-poll-max',
+                          action='store',
+                          type='float',
+                          default=DEFAULT_WAIT_POLL_MAX,
+                          dest='wait_poll_max',
+                          metavar='num',
+                          help='longest AdaptiveWait poll interval in seconds. ' +
+                               '(default: %default)'
+        )
+        parser.add_option('--http-pool-size',
+                          action='store',
+                          type='int',
+                          default=10,
+                          dest='http_pool_size',
+                          metavar='num',
+                          help='Idle keep-alive connections kept open to each remote, ' +
+                               'grid or sauce server, shared by all sessions. ' +
+                               '0 opens a new connection for every command. ' +
+                               '(default: %default)'
+        )
+        parser.add_option('--http-timeout',
+                          action='store',
+                          type='float',
+                          default=0,
+                          dest='http_timeout',
+                          metavar='num',
+                          help='socket timeout (in seconds) for commands sent to a remote, ' +
+                               'grid or sauce server, 0 for none. (default: %default)'
+        )
         parser.add_option('--sauce-username',
                           action='store',
                           default=env.get('SAUCE_USERNAME', []),
@@ -218,6 +1003,32 @@ class NoseSelenium(Plugin):
                           help='API Key for sauce labs account. ' +
                                'May be stored in environmental variable SAUCE_APIKEY.'
         )
+        parser.add_option('--sauce-browsers-file',
+                          action='store',
+                          default=env.get('SAUCE_BROWSERS_FILE', None),
+                          dest='sauce_browsers_file',
+                          metavar='PATH',
+                          help='Read the Sauce Labs browser list from this JSON file ' +
+                               'instead of the Sauce Labs REST API. ' +
+                               'May be stored in environmental variable SAUCE_BROWSERS_FILE.'
+        )
+        parser.add_option('--sauce-cache-ttl',
+                          action='store',
+                          type='int',
+                          default=int(env.get('SAUCE_CACHE_TTL', 86400)),
+                          dest='sauce_cache_ttl',
+                          metavar='num',
+                          help='Seconds to reuse the cached Sauce Labs browser list ' +
+                               'before fetching it again, 0 to always fetch. ' +
+                               '(default: %default)'
+        )
+        parser.add_option('--sauce-offline',
+                          action='store_true',
+                          default=False,
+                          dest='sauce_offline',
+                          help='Never fetch the Sauce Labs browser list, use the ' +
+                               'cached copy however old it is.'
+        )
         parser.add_option('--saved-files-storage',
                           action='store',
                           default=env.get('SAVED_FILES_PATH', ""),
@@ -226,6 +1037,121 @@ class NoseSelenium(Plugin):
                           help='Full path to place to store screenshots and html dumps. ' +
                                'May be stored in environmental variable SAVED_FILES_PATH.'
         )
+        parser.add_option('--compress-saved-files',
+                          action='store_true',
+                          default=False,
+                          dest='compress_saved_files',
+                          help='gzip the html dumps written to --saved-files-storage.'
+        )
+        parser.add_option('--command-timing',
+                          action='store_true',
+                          default=False,
+                          dest='command_timing',
+                          help='Time every WebDriver command and report latency ' +
+                               'percentiles per command and per test.'
+        )
+        parser.add_option('--command-timing-file',
+                          action='store',
+                          default=None,
+                          dest='command_timing_file',
+                          metavar='PATH',
+                          help='Also write the --command-timing statistics to ' +
+                               'this file as JSON.'
+        )
+        parser.add_option('--phase-timing',
+                          action='store_true',
+                          default=False,
+                          dest='phase_timing',
+                          help='Report how long each SeleniumTestCase spent getting ' +
+                               'a session, configuring it, running and tearing down.'
+        )
+        parser.add_option('--phase-timing-file',
+                          action='store',
+                          default=None,
+                          dest='phase_timing_file',
+                          metavar='PATH',
+                          help='Also write the --phase-timing data to this file as JSON.'
+        )
+        parser.add_option('--session-scope',
+                          action='store',
+                          choices=VALID_SESSION_SCOPES,
+                          default=env.get('SELENIUM_SESSION_SCOPE', 'test'),
+                          dest='session_scope',
+                          help="Keep one browser session alive for each " +
+                               "test, class, module or the whole run (default %default, " +
+                               "options " + self._stringify_options(VALID_SESSION_SCOPES) +
+                               "). May be stored in environmental variable SELENIUM_SESSION_SCOPE."
+        )
+        parser.add_option('--session-pool',
+                          action='store',
+                          type='int',
+                          default=int(env.get('SELENIUM_SESSION_POOL', 0)),
+                          dest='session_pool',
+                          metavar='num',
+                          help='Start this many browser sessions in the background ' +
+                               'while tests are being collected, and hand them out ' +
+                               'to tests from a pool. (default: %default, disabled) ' +
+                               'May be stored in environmental variable SELENIUM_SESSION_POOL.'
+        )
+        parser.add_option('--group-by-capabilities',
+                          action='store_true',
+                          default=False,
+                          dest='group_by_capabilities',
+                          help='Run tests that need the same desired_capabilities ' +
+                               'next to each other, so reused sessions are rebuilt ' +
+                               'as rarely as possible.'
+        )
+        parser.add_option('--threads',
+                          action='store',
+                          type='int',
+                          default=int(env.get('SELENIUM_THREADS', 0)),
+                          dest='threads',
+                          metavar='num',
+                          help='Run SeleniumTestCases on this many threads, each with ' +
+                               'its own sessions. (default: %default, disabled) May be ' +
+                               'stored in environmental variable SELENIUM_THREADS.'
+        )
+        parser.add_option('--session-max-uses',
+                          action='store',
+                          type='int',
+                          default=int(env.get('SELENIUM_SESSION_MAX_USES', 0)),
+                          dest='session_max_uses',
+                          metavar='num',
+                          help='Replace a reused or pooled session after it has ' +
+                               'served this many tests. (default: %default, unlimited) ' +
+                               'May be stored in environmental variable SELENIUM_SESSION_MAX_USES.'
+        )
+        parser.add_option('--session-max-age',
+                          action='store',
+                          type='float',
+                          default=float(env.get('SELENIUM_SESSION_MAX_AGE', 0)),
+                          dest='session_max_age',
+                          metavar='num',
+                          help='Replace a reused or pooled session once it is this ' +
+                               'many seconds old. (default: %default, unlimited) ' +
+                               'May be stored in environmental variable SELENIUM_SESSION_MAX_AGE.'
+        )
+        parser.add_option('--max-browsers',
+                          action='store',
+                          type='int',
+                          default=int(env.get('SELENIUM_MAX_BROWSERS', 0)),
+                          dest='max_browsers',
+                          metavar='num',
+                          help='Never have more than this many browsers open at once, ' +
+                               'counted across all --processes workers. ' +
+                               '(default: %default, unlimited) ' +
+                               'May be stored in environmental variable SELENIUM_MAX_BROWSERS.'
+        )
+        parser.add_option('--slot-timeout',
+                          action='store',
+                          type='float',
+                          default=300,
+                          dest='slot_timeout',
+                          metavar='num',
+                          help='seconds a new session may wait for one of the ' +
+                               '--max-browsers slots before its test fails. ' +
+                               '(default: %default)'
+        )
 
     def _check_validity(self, item, list, flag="--browser"):
         if item not in list:
@@ -235,32 +1161,7 @@ class NoseSelenium(Plugin):
             )
 
     def _get_sauce_options(self):
-        # output from sauce labs
-        # {
-        #     "api_name": "firefox",
-        #     "automation_backend": "webdriver",
-        #     "long_name": "Firefox",
-        #     "long_version": "19.0.",
-        #     "os": "Linux",
-        #     "preferred_version": "11",
-        #     "scout": "webdriver",
-        #     "short_version": "19"
-        # },
-
-        uri = 'http://saucelabs.com/rest/v1/info/browsers/webdriver'
-        resp = loads(
-            requests.get(uri, headers={ 'accepts': 'application/json'}).text)
-        browser_hash = {}
-        os_hash = {}
-        combos = []
-        for entry in resp:
-            browser_hash.update({entry['api_name']: 1})
-            os_hash.update({entry['os']: 1})
-            combos.append("\t\t".join(
-                [ entry['os'], entry['api_name'], entry['short_version']]))
-        browsers = browser_hash.keys()
-        oses = set(entry['os'] for entry in resp)
-        return (browsers, oses, combos)
+        return load_sauce_catalogue()
 
     @property
     def _valid_browsers_for_remote(self):
@@ -268,7 +1169,8 @@ class NoseSelenium(Plugin):
 
     @property
     def _valid_browsers_for_local(self):
-        return ['FIREFOX', 'INTERNETEXPLORER', 'CHROME']
+        return ['FIREFOX', 'INTERNETEXPLORER', 'CHROME', 'HEADLESS_FIREFOX',
+                'HEADLESS_CHROME', 'PHANTOMJS']
 
     def _browser_help(self):
         valid_browsers_for_sauce, valid_oses_for_sauce, combos = self._get_sauce_options()
@@ -290,6 +1192,42 @@ class NoseSelenium(Plugin):
         print("\n".join(combos))
         exit(0)
 
+    def _check_combination(self, config, browser, os_name, sauce_options=None):
+        # local
+        if config.BROWSER_LOCATION == 'local':
+            self._check_validity(browser, self._valid_browsers_for_local)
+
+        # sauce
+        elif config.BROWSER_LOCATION == 'sauce':
+            valid_browsers_for_sauce, valid_oses_for_sauce, combos = sauce_options
+
+            if not config.SAUCE_USERNAME or not config.SAUCE_APIKEY:
+                raise TypeError("'sauce' value for --browser-location "
+                                "requires --sauce-username and --sauce-apikey.")
+            self._check_validity(browser, valid_browsers_for_sauce)
+            if not os_name:
+                raise TypeError(
+                    "'sauce' value for --browser-location requires the --os option.")
+            self._check_validity(os_name, valid_oses_for_sauce, flag="--os")
+
+        # remote
+        elif config.BROWSER_LOCATION == 'remote':
+            self._check_validity(browser, self._valid_browsers_for_remote)
+            if not config.REMOTE_ADDRESS:
+                raise TypeError(
+                    "'remote' value for --browser-location requires --remote-address.")
+
+        # grid
+        elif config.BROWSER_LOCATION == 'grid':
+            self._check_validity(browser, self._valid_browsers_for_remote)
+            if not config.REMOTE_ADDRESS:
+                raise TypeError(
+                    "'grid' value for --browser-location requires --grid-address.")
+            if not os_name:
+                raise TypeError(
+                    "'grid' value for --browser-location requires the --os option.")
+            # XXX validate OS once grid API can answer the question which it supports
+
     def ingest_config_file(self, config_file):
         CONFIG = ConfigParser()
         CONFIG.read(config_file)
@@ -297,6 +1235,11 @@ class NoseSelenium(Plugin):
 
     def ingest_options(self, options):
         global BROWSER_LOCATION
+        global LOCAL_DRIVER_SERVICE
+        global FIREFOX_PROFILE
+        global FIREFOX_EXTENSIONS
+        global FIREFOX_PREFS
+        global LIGHTWEIGHT_BROWSER
         global BROWSER
         global BUILD
         global BROWSER_VERSION
@@ -307,16 +1250,76 @@ class NoseSelenium(Plugin):
         global SAUCE_USERNAME
         global SAUCE_APIKEY
         global SAVED_FILES_PATH
+        global SESSION_SCOPE
+        global SESSION_POOL_SIZE
+        global SESSION_MAX_USES
+        global SESSION_MAX_AGE
+        global MAX_BROWSERS
+        global SLOT_TIMEOUT
+        global GRID_MAX_PENDING
+        global GRID_QUEUE_TIMEOUT
+        global GROUP_BY_CAPABILITIES
+        global THREADS
+        global BROWSER_MATRIX
+        global SAUCE_BROWSERS_FILE
+        global SAUCE_CACHE_TTL
+        global SAUCE_OFFLINE
+        global COMPRESS_SAVED_FILES
+        global COMMAND_TIMING
+        global COMMAND_TIMING_FILE
+        global PHASE_TIMING
+        global PHASE_TIMING_FILE
+        global HTTP_POOL_SIZE
+        global HTTP_TIMEOUT
+        global WAIT_MODE
+        global WAIT_POLL
+        global WAIT_POLL_MAX
+        global WAIT_BACKOFF
 
         BROWSER_LOCATION = options.browser_location
+        LOCAL_DRIVER_SERVICE = options.local_driver_service
+        FIREFOX_PROFILE = options.firefox_profile
+        FIREFOX_EXTENSIONS = options.firefox_extensions
+        FIREFOX_PREFS = parse_firefox_prefs(options.firefox_prefs)
+        LIGHTWEIGHT_BROWSER = options.lightweight_browser
+        BROWSER_MATRIX = browser_matrix(options.browser, options.os,
+                                        options.browser_version)
+        if BROWSER_MATRIX:
+            first = BROWSER_MATRIX[0]
+            options.browser, options.os, options.browser_version = \
+                first.browser, first.os, first.version
         BROWSER = options.browser
         TIMEOUT = options.timeout
+        HTTP_POOL_SIZE = options.http_pool_size
+        HTTP_TIMEOUT = options.http_timeout
+        WAIT_MODE = options.wait_mode
+        WAIT_POLL = options.wait_poll
+        WAIT_POLL_MAX = options.wait_poll_max
+        WAIT_BACKOFF = options.wait_backoff
         BUILD = options.build
         BROWSER_VERSION = options.browser_version
         OS = options.os
         SAVED_FILES_PATH = options.saved_files_storage
+        COMPRESS_SAVED_FILES = options.compress_saved_files
+        COMMAND_TIMING = options.command_timing or bool(options.command_timing_file)
+        COMMAND_TIMING_FILE = options.command_timing_file
+        PHASE_TIMING = options.phase_timing or bool(options.phase_timing_file)
+        PHASE_TIMING_FILE = options.phase_timing_file
         SAUCE_USERNAME = options.sauce_username
         SAUCE_APIKEY = options.sauce_apikey
+        SESSION_SCOPE = options.session_scope
+        SESSION_POOL_SIZE = options.session_pool
+        SESSION_MAX_USES = options.session_max_uses
+        SESSION_MAX_AGE = options.session_max_age
+        MAX_BROWSERS = options.max_browsers
+        SLOT_TIMEOUT = options.slot_timeout
+        GRID_MAX_PENDING = options.grid_max_pending
+        GRID_QUEUE_TIMEOUT = options.grid_queue_timeout
+        GROUP_BY_CAPABILITIES = options.group_by_capabilities
+        THREADS = options.threads
+        SAUCE_BROWSERS_FILE = options.sauce_browsers_file
+        SAUCE_CACHE_TTL = options.sauce_cache_ttl
+        SAUCE_OFFLINE = options.sauce_offline
         if BROWSER_LOCATION == 'remote':
             REMOTE_PORT = options.remote_port
             REMOTE_ADDRESS = options.remote_address
@@ -329,10 +1332,20 @@ class NoseSelenium(Plugin):
 
         Plugin.configure(self, options, conf)
         if self.enabled:
+            global _WORKER_ID
 
-            # browser-help is a usage call
-            if getattr(options, 'browser_help'):
-                self._browser_help()
+            # under --processes, configure() runs again in every worker
+            self.worker = getattr(conf, 'worker', False)
+            try:
+                workers = int(getattr(options, 'multiprocess_workers', 0) or 0)
+            except ValueError:
+                workers = 0
+            self.parent_of_workers = bool(workers) and not self.worker
+            if self.worker:
+                _WORKER_ID = 'w%d' % os.getpid()
+            else:
+                # inherited by the workers, so they share browser slots
+                _run_id()
 
             # get options from command line or config file
             if options.config_file:
@@ -340,226 +1353,2822 @@ class NoseSelenium(Plugin):
             else:
                 self.ingest_options(options)
 
+            # browser-help is a usage call
+            if getattr(options, 'browser_help'):
+                self._browser_help()
+
             ### Validation ###
-            # local
-            if BROWSER_LOCATION == 'local':
-                self._check_validity(BROWSER, self._valid_browsers_for_local)
-
-            # sauce
-            elif BROWSER_LOCATION == 'sauce':
-                valid_browsers_for_sauce, valid_oses_for_sauce, combos = self._get_sauce_options()
-
-                if not SAUCE_USERNAME or not SAUCE_APIKEY:
-                    raise TypeError("'sauce' value for --browser-location "
-                                    "requires --sauce-username and --sauce-apikey.")
-                self._check_validity(BROWSER, valid_browsers_for_sauce)
-                if not OS:
-                    raise TypeError(
-                        "'sauce' value for --browser-location requires the --os option.")
-                self._check_validity(OS, valid_oses_for_sauce, flag="--os")
+            self._check_validity(SESSION_SCOPE, VALID_SESSION_SCOPES,
+                                 flag="--session-scope")
+            self._check_validity(WAIT_MODE, VALID_WAIT_MODES,
+                                 flag="--wait-mode")
 
-            # remote
-            elif BROWSER_LOCATION == 'remote':
-                self._check_validity(BROWSER, self._valid_browsers_for_remote)
-                if not REMOTE_ADDRESS:
-                    raise TypeError(
-                        "'remote' value for --browser-location requires --remote-address.")
+            config = SeleniumConfig.from_globals()
+            sauce_options = None
+            if config.BROWSER_LOCATION == 'sauce':
+                sauce_options = self._get_sauce_options()
+            # every combination of a browser matrix must be valid
+            for combination in (config.BROWSER_MATRIX or [BrowserCombination(
+                    config.BROWSER, config.OS, config.BROWSER_VERSION)]):
+                self._check_combination(config, combination.browser,
+                                        combination.os, sauce_options)
 
-            # grid
-            elif BROWSER_LOCATION == 'grid':
-                self._check_validity(BROWSER, self._valid_browsers_for_remote)
-                if not REMOTE_ADDRESS:
-                    raise TypeError(
-                        "'grid' value for --browser-location requires --grid-address.")
-                if not OS:
-                    raise TypeError(
-                        "'grid' value for --browser-location requires the --os option.")
-                # XXX validate OS once grid API can answer the question which it supports
+            if config.SESSION_POOL_SIZE < 0:
+                raise TypeError("--session-pool must not be negative.")
+            if config.HTTP_POOL_SIZE < 0:
+                raise TypeError("--http-pool-size must not be negative.")
+            if config.MAX_BROWSERS < 0:
+                raise TypeError("--max-browsers must not be negative.")
+            if config.SESSION_MAX_USES < 0:
+                raise TypeError("--session-max-uses must not be negative.")
+            if config.SESSION_MAX_AGE < 0:
+                raise TypeError("--session-max-age must not be negative.")
+            if config.GRID_MAX_PENDING < 0:
+                raise TypeError("--grid-max-pending must not be negative.")
+            if config.THREADS < 0:
+                raise TypeError("--threads must not be negative.")
+            if (config.FIREFOX_PROFILE and
+                    not os.path.isdir(config.FIREFOX_PROFILE)):
+                raise TypeError("--firefox-profile %s is not a directory." %
+                                config.FIREFOX_PROFILE)
+            for extension in config.FIREFOX_EXTENSIONS or []:
+                if not os.path.exists(extension):
+                    raise TypeError("--firefox-extension %s not found." %
+                                    extension)
 
+            # validated; from here on sessions are built from this config
+            use_config(config)
+            self.config = config
 
+            if config.THREADS > 1 or config.BROWSER_MATRIX:
+                _capture_per_thread(conf.plugins)
 
-class ScreenshotOnExceptionWebDriverWait(WebDriverWait):
-    def __init__(self, *args, **kwargs):
-        super(ScreenshotOnExceptionWebDriverWait, self).__init__(*args, **kwargs)
-        global SAVED_FILES_PATH
-        if SAVED_FILES_PATH:
-          if not os.path.exists(SAVED_FILES_PATH):
-            os.makedirs(SAVED_FILES_PATH)
+            if config.COMMAND_TIMING:
+                enable_command_timing()
+            if config.PHASE_TIMING:
+                self.phase_timings = PhaseTimings()
 
-    def until(self, *args, **kwargs):
-        try:
-            return super(
-                ScreenshotOnExceptionWebDriverWait, self).until(
-                *args, **kwargs)
-        except TimeoutException:
-            global SAVED_FILES_PATH
-            if SAVED_FILES_PATH:
-                timestamp = repr(time.time()).replace('.', '')
-                # save a screenshot
-                screenshot_filename = SAVED_FILES_PATH + "/" + timestamp + ".png"
-                self._driver.get_screenshot_as_file(screenshot_filename)
-                logger.error("Screenshot saved to %s" % screenshot_filename)
-                # save the html
-                html_filename = SAVED_FILES_PATH + "/" + timestamp + ".html"
-                html = self._driver.page_source
-                outfile = open(html_filename, 'w')
-                outfile.write(html.encode('utf8', 'ignore'))
-                outfile.close()
-                logger.error("HTML saved to %s" % html_filename)
-                logger.error("Page URL: %s" % self._driver.current_url)
-            raise
+            # browsers boot while nose is still collecting tests; when tests
+            # run in worker processes each worker keeps its own pool
+            if (config.SESSION_POOL_SIZE and not self.parent_of_workers and
+                    (_POOL is None or _POOL.size != config.SESSION_POOL_SIZE)):
+                start_webdriver_pool(config.SESSION_POOL_SIZE)
 
-    def until_not(self, *args, **kwargs):
-        try:
-            return super(
-                ScreenshotOnExceptionWebDriverWait, self).until_not(
-                *args, **kwargs)
-        except TimeoutException:
-            global SAVED_FILES_PATH
-            if SAVED_FILES_PATH:
-                timestamp = repr(time.time()).replace('.', '')
-                # save a screenshot
-                screenshot_filename = SAVED_FILES_PATH + "/" + timestamp + ".png"
-                self._driver.get_screenshot_as_file(screenshot_filename)
-                logger.error("Screenshot saved to %s" % screenshot_filename)
-                # save the html
-                html_filename = SAVED_FILES_PATH + "/" + timestamp + ".html"
-                html = self._driver.page_source
-                outfile = open(html_filename, 'w')
-                outfile.write(html.encode('utf8', 'ignore'))
-                outfile.close()
-                logger.error("HTML saved to %s" % html_filename)
-                logger.error("Page URL: %s" % self._driver.current_url)
-            raise
+    def prepareTest(self, test):
+        config = self.config
+        if config.BROWSER_MATRIX:
+            expand_browser_matrix(test, config.BROWSER_MATRIX)
+        if config.GROUP_BY_CAPABILITIES:
+            group_by_capabilities(test)
+        if config.THREADS > 1:
+            run_in_threads(test, start_test_threads(config.THREADS))
 
+    def startTest(self, test):
+        _test_context.test_id = test.id()
 
-class ScreenshotOnExceptionWebDriver(webdriver.Remote):
+    def stopTest(self, test):
+        _test_context.test_id = None
+        if self.phase_timings is not None:
+            phases = getattr(getattr(test, 'test', test), 'phase_timings', None)
+            if phases is not None:
+                self.phase_timings.add(test.id(), phases)
 
+    def stopContext(self, context):
+        close_webdriver_sessions(context)
 
-    def __init__(self, *args, **kwargs):
-        super(ScreenshotOnExceptionWebDriver, self).__init__(*args, **kwargs)
-        global SAVED_FILES_PATH
-        if SAVED_FILES_PATH:
-          if not os.path.exists(SAVED_FILES_PATH):
-            os.makedirs(SAVED_FILES_PATH)
+    def _discard_failed_session(self, test):
+        test = getattr(test, 'test', test)
+        if (isinstance(test, SeleniumTestCase) and
+                test.new_session_on_failure):
+            # quitting takes a round trip to the browser, don't make the
+            # other threads wait for it to report their results
+            _after_result_call(self._discard_session, test)
 
-    def execute(self, driver_command, params=None):
-        curframe = inspect.currentframe()
-        calframe = inspect.getouterframes(curframe)
-        if driver_command in [
-            Command.SCREENSHOT,
-            Command.GET_PAGE_SOURCE,
-            Command.GET_CURRENT_URL
-        ]:
-            return super(ScreenshotOnExceptionWebDriver,
-                             self).execute(driver_command, params=params)
-        elif len(calframe) > 4 and calframe[4][3] in ['until', 'until_not']:
-            return super(ScreenshotOnExceptionWebDriver,
-                             self).execute(driver_command, params=params)
-        else:
+    def _discard_session(self, test):
+        start = time.time()
+        test.discard_session()
+        phases = getattr(test, 'phase_timings', {})
+        phases['teardown'] = phases.get('teardown', 0.0) + time.time() - start
+
+    def _record_combination(self, test, outcome):
+        combination = getattr(getattr(test, 'test', test),
+                              'browser_combination', None)
+        if combination is not None:
+            counts = self.matrix_results.setdefault(
+                combination.name, {'passed': 0, 'failed': 0, 'errors': 0})
+            counts[outcome] += 1
+
+    def addSuccess(self, test):
+        self._record_combination(test, 'passed')
+
+    def addError(self, test, err):
+        self._record_combination(test, 'errors')
+        self._discard_failed_session(test)
+
+    def addFailure(self, test, err):
+        self._record_combination(test, 'failed')
+        self._discard_failed_session(test)
+
+    def report(self, stream):
+        if self.matrix_results:
+            stream.writeln("Browser matrix:")
+            for name in sorted(self.matrix_results):
+                counts = self.matrix_results[name]
+                stream.writeln("  %s: %d passed, %d failed, %d errors" % (
+                    name, counts['passed'], counts['failed'], counts['errors']))
+        if _POOL is not None:
+            _POOL.report(stream)
+        _RECYCLER.report(stream)
+        for scheduler in _grid_schedulers():
+            scheduler.report(stream)
+        if _COMMAND_STATS is not None:
+            _COMMAND_STATS.report(stream)
+            if self.config.COMMAND_TIMING_FILE:
+                _COMMAND_STATS.write(self.config.COMMAND_TIMING_FILE)
+        if self.config.WAIT_MODE == 'explicit':
+            _WAIT_STATS.report(stream)
+        if self.phase_timings is not None:
+            self.phase_timings.report(stream)
+            if self.config.PHASE_TIMING_FILE:
+                self.phase_timings.write(self.config.PHASE_TIMING_FILE)
+
+    def finalize(self, result):
+        stop_test_threads()
+        close_webdriver_sessions()
+        stop_webdriver_pool()
+        stop_local_driver_services()
+        remove_firefox_profile_clones()
+        flush_failure_artifacts()
+        close_connection_pools()
+        with _BROWSER_SLOTS_LOCK:
+            _BROWSER_SLOTS.clear()
+        if not self.worker:
+            shutil.rmtree(_run_lock_dir(), ignore_errors=True)
+
+
+# set in --processes workers, recorded with their failure artifacts
+_WORKER_ID = None
+
+# the test running on each thread, recorded with its failure artifacts
+_test_context = threading.local()
+
+
+def _record_phase(phase, seconds):
+    """Add to the running SeleniumTestCase's phase_timings, if any."""
+    phases = getattr(_test_context, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class PhaseTimings(object):
+    """Where each SeleniumTestCase's time went: 'session' (building a
+    session or taking one from the pool or scope), 'configure' (implicit
+    wait and capabilities), 'body' and 'teardown'."""
+
+    PHASES = ['session', 'configure', 'body', 'teardown']
+    OVERHEAD = ['session', 'configure', 'teardown']
+
+    def __init__(self):
+        self.tests = []
+        self._lock = threading.Lock()
+
+    def add(self, test_id, phases):
+        entry = dict((phase, phases.get(phase, 0.0)) for phase in self.PHASES)
+        entry['test'] = test_id
+        entry['total'] = sum(entry[phase] for phase in self.PHASES)
+        with self._lock:
+            self.tests.append(entry)
+
+    def as_dict(self):
+        with self._lock:
+            tests = list(self.tests)
+        totals = dict((phase, sum(entry[phase] for entry in tests))
+                      for phase in self.PHASES)
+        total = sum(totals.values())
+        overhead = sum(totals[phase] for phase in self.OVERHEAD)
+        return {
+            'tests': tests,
+            'totals': totals,
+            'total': total,
+            'session_overhead_share': total and overhead / total,
+        }
+
+    def write(self, filename):
+        outfile = open(filename, 'w')
+        try:
+            outfile.write(dumps(self.as_dict(), indent=2, sort_keys=True))
+        finally:
+            outfile.close()
+
+    def report(self, stream, slowest_tests=10):
+        timings = self.as_dict()
+        if not timings['tests']:
+            return
+        stream.writeln("")
+        stream.writeln("SeleniumTestCase phases (slowest %d tests)" % slowest_tests)
+        stream.writeln("------------------------------------------")
+        stream.writeln("%-40s %9s %9s %9s %9s %9s" % (
+            'test', 'session', 'configure', 'body', 'teardown', 'total'))
+        rows = sorted(timings['tests'], key=lambda entry: -entry['total'])
+        for entry in rows[:slowest_tests]:
+            stream.writeln("%-40s %9.2f %9.2f %9.2f %9.2f %9.2f" % (
+                entry['test'][-40:], entry['session'], entry['configure'],
+                entry['body'], entry['teardown'], entry['total']))
+        totals = timings['totals']
+        stream.writeln("%-40s %9.2f %9.2f %9.2f %9.2f %9.2f" % (
+            'all %d tests' % len(rows), totals['session'], totals['configure'],
+            totals['body'], totals['teardown'], timings['total']))
+        stream.writeln("%.0f%% of SeleniumTestCase time was session overhead." %
+                       (timings['session_overhead_share'] * 100))
+
+
+class ArtifactWriter(object):
+    """Runs file-writing jobs on a background thread. The queue is
+    bounded, so a test that produces artifacts faster than they can be
+    written waits instead of piling them up in memory."""
+
+    def __init__(self, maxsize=16):
+        self._queue = Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            job, args = self._queue.get()
+            try:
+                job(*args)
+            except Exception as e:
+                logger.error("Error saving failure artifact: %s" % e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, job, *args):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((job, args))
+
+    def flush(self):
+        """Wait until every submitted job has been run."""
+        self._queue.join()
+
+
+_ARTIFACT_WRITER = ArtifactWriter()
+
+
+class ArtifactStore(object):
+    """Failure artifacts under `path`, named by the sha1 of their
+    content so identical screenshots and html are only stored once, and
+    written through a rename so parallel writers never clobber each other.
+    manifest.jsonl has one JSON object per failure pointing at its files,
+    so tools can find them without walking the directory tree.
+    """
+
+    MANIFEST = 'manifest.jsonl'
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, self.MANIFEST)
+
+    def relative_path(self, data, suffix, compress=False):
+        """The path, relative to the store, that put() stores `data` at."""
+        digest = hashlib.sha1(data).hexdigest()
+        if compress:
+            suffix += '.gz'
+        return os.path.join(digest[:2], digest + suffix)
+
+    def put(self, data, suffix, compress=False):
+        """Store `data` (a byte string) and return its path relative to
+        the store."""
+        relative_path = self.relative_path(data, suffix, compress)
+        full_path = os.path.join(self.path, relative_path)
+        if os.path.exists(full_path):
+            return relative_path
+
+        directory = os.path.dirname(full_path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # another writer got there first
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        outfile = os.fdopen(fd, 'wb')
+        try:
+            if compress:
+                compressed = gzip.GzipFile(filename='', mode='wb',
+                                           fileobj=outfile)
+                compressed.write(data)
+                compressed.close()
+            else:
+                outfile.write(data)
+        finally:
+            outfile.close()
+        try:
+            os.rename(tmp_path, full_path)
+        except OSError:
+            # windows won't rename over a blob another writer just stored
+            os.remove(tmp_path)
+        return relative_path
+
+    def record(self, entry):
+        """Append one entry to the manifest."""
+        line = dumps(entry, sort_keys=True) + "\n"
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        outfile = open(self.manifest_path, 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(outfile.fileno(), fcntl.LOCK_EX)
+            outfile.write(line)
+        finally:
+            outfile.close()
+
+    def entries(self, **match):
+        """Yield manifest entries, optionally only those whose fields
+        equal the given keyword arguments."""
+        if not os.path.exists(self.manifest_path):
+            return
+        infile = open(self.manifest_path)
+        try:
+            for line in infile:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue  # a line still being written
+                for key, value in match.items():
+                    if entry.get(key) != value:
+                        break
+                else:
+                    yield entry
+        finally:
+            infile.close()
+
+
+def _store_failure_artifacts(store, entry, screenshot, html, compress):
+    store.put(screenshot, '.png')
+    store.put(html, '.html', compress)
+    store.record(entry)
+
+
+def save_failure_artifacts(driver, command=None):
+    """Save a screenshot and the html of the driver's current page in the
+    ArtifactStore at the SAVED_FILES_PATH of the driver's config. They
+    are fetched from the driver and their paths logged here, the files
+    are written by a background thread."""
+    config = _config_of(driver)
+    if not config.SAVED_FILES_PATH:
+        return
+    _queue_failure_artifacts(driver.get_screenshot_as_base64(),
+                             driver.page_source, driver.current_url, command,
+                             config)
+
+
+def _queue_failure_artifacts(screenshot, html, url, command, config):
+    logger.error("Page URL: %s" % url)
+    entry = {
+        'time': time.time(),
+        'test': getattr(_test_context, 'test_id', None),
+        'url': url,
+        'command': command,
+        'run': _run_id(),
+        'worker': _WORKER_ID,
+        'thread': getattr(_test_context, 'worker', None),
+    }
+    # the paths are logged here, on the test's thread, so log capture
+    # shows them with the failing test; the writer only logs errors
+    store = ArtifactStore(config.SAVED_FILES_PATH)
+    screenshot = base64.b64decode(screenshot.encode('ascii'))
+    html = html.encode('utf8', 'ignore')
+    entry['screenshot'] = store.relative_path(screenshot, '.png')
+    entry['html'] = store.relative_path(html, '.html',
+                                        config.COMPRESS_SAVED_FILES)
+    logger.error("Screenshot saved to %s" %
+                 os.path.join(store.path, entry['screenshot']))
+    logger.error("HTML saved to %s" % os.path.join(store.path, entry['html']))
+    _ARTIFACT_WRITER.submit(_store_failure_artifacts, store, entry,
+                            screenshot, html, config.COMPRESS_SAVED_FILES)
+
+
+def flush_failure_artifacts():
+    """Wait for queued screenshots and html to be written."""
+    _ARTIFACT_WRITER.flush()
+
+atexit.register(flush_failure_artifacts)
+
+
+class LatencyHistogram(object):
+    """Durations counted in buckets about 5% wide between 10us and
+    1000s, so percentiles come out within 5% without keeping every
+    sample."""
+
+    BOUNDS = [1e-5 * 1.05 ** i for i in range(379)]
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        bucket = bisect_left(self.BOUNDS, seconds)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile."""
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                if bucket >= len(self.BOUNDS):
+                    return self.max
+                return min(self.BOUNDS[bucket], self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class CommandStats(object):
+    """Latency histograms of WebDriver commands, per command name and
+    per test."""
+
+    def __init__(self):
+        # one histogram per (command, test id, thread); merged when reporting
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, command, seconds):
+        # the thread is part of the key so each histogram has one writer
+        key = (command, getattr(_test_context, 'test_id', None),
+               threading.current_thread().ident)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        histogram.record(seconds)
+
+    def _merged(self, index):
+        merged = {}
+        with self._lock:
+            items = list(self._histograms.items())
+        for key, histogram in items:
+            total = merged.get(key[index])
+            if total is None:
+                total = merged[key[index]] = LatencyHistogram()
+            total.merge(histogram)
+        return merged
+
+    def as_dict(self):
+        return {
+            'commands': dict((name, histogram.summary())
+                             for name, histogram in self._merged(0).items()),
+            'tests': dict((str(test_id), histogram.summary())
+                          for test_id, histogram in self._merged(1).items()),
+        }
+
+    def write(self, filename):
+        outfile = open(filename, 'w')
+        try:
+            outfile.write(dumps(self.as_dict(), indent=2, sort_keys=True))
+        finally:
+            outfile.close()
+
+    def _report_table(self, stream, title, rows):
+        stream.writeln("%-40s %7s %9s %9s %9s %9s %10s" %
+                       (title, 'count', 'p50 ms', 'p95 ms', 'p99 ms',
+                        'max ms', 'total s'))
+        for name, stats in rows:
+            stream.writeln("%-40s %7d %9.1f %9.1f %9.1f %9.1f %10.2f" % (
+                str(name)[-40:], stats['count'], stats['p50'] * 1000,
+                stats['p95'] * 1000, stats['p99'] * 1000,
+                stats['max'] * 1000, stats['total']))
+
+    def report(self, stream, slowest_tests=10):
+        stats = self.as_dict()
+        if not stats['commands']:
+            return
+        stream.writeln("")
+        stream.writeln("WebDriver command latency")
+        stream.writeln("-------------------------")
+        self._report_table(stream, 'command', sorted(
+            stats['commands'].items(), key=lambda item: -item[1]['total']))
+        stream.writeln("")
+        self._report_table(stream, 'test (slowest %d)' % slowest_tests, sorted(
+            stats['tests'].items(),
+            key=lambda item: -item[1]['total'])[:slowest_tests])
+
+
+_COMMAND_STATS = None
+
+
+def enable_command_timing():
+    """Start timing every ScreenshotOnExceptionWebDriver command."""
+    global _COMMAND_STATS
+    if _COMMAND_STATS is None:
+        _COMMAND_STATS = CommandStats()
+    return _COMMAND_STATS
+
+
+# set while a ScreenshotOnExceptionWebDriverWait is polling, so the
+# commands issued by its conditions don't save files on every failure
+_wait_state = threading.local()
+
+
+def _in_explicit_wait():
+    """Whether the caller runs inside an explicit wait, whose failures
+    are expected and not worth saving artifacts for."""
+    if getattr(_wait_state, 'depth', 0):
+        return True
+    # plain WebDriverWait: execute <- find_element <- find_element_by_*
+    # <- condition <- until, or query_elements [<- wd.query_elements]
+    # <- condition <- until
+    try:
+        frame = sys._getframe(2)
+    except ValueError:
+        return False
+    for i in range(4):
+        if frame is None:
+            break
+        if frame.f_code.co_name in ('until', 'until_not'):
+            return True
+        frame = frame.f_back
+    return False
+
+
+class WaitStats(object):
+    """How long explicit waits took, split into waits whose condition
+    was met and waits that timed out."""
+
+    def __init__(self):
+        self.satisfied = LatencyHistogram()
+        self.timed_out = LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timed_out.record(seconds)
+            else:
+                self.satisfied.record(seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {'satisfied': self.satisfied.summary(),
+                    'timed_out': self.timed_out.summary()}
+
+    def report(self, stream):
+        stats = self.as_dict()
+        satisfied, timed_out = stats['satisfied'], stats['timed_out']
+        if not satisfied['count'] and not timed_out['count']:
+            return
+        stream.writeln("")
+        stream.writeln("Explicit waits: %.2fs total" %
+                       (satisfied['total'] + timed_out['total']))
+        stream.writeln("  %d satisfied, %.2fs total, p50 %.2fs, p95 %.2fs, "
+                       "p99 %.2fs, max %.2fs" % (
+                           satisfied['count'], satisfied['total'],
+                           satisfied['p50'], satisfied['p95'],
+                           satisfied['p99'], satisfied['max']))
+        stream.writeln("  %d timed out, %.2fs total" %
+                       (timed_out['count'], timed_out['total']))
+
+
+_WAIT_STATS = WaitStats()
+
+
+class ScreenshotOnExceptionWebDriverWait(WebDriverWait):
+    def __init__(self, *args, **kwargs):
+        super(ScreenshotOnExceptionWebDriverWait, self).__init__(*args, **kwargs)
+        path = _config_of(self._driver).SAVED_FILES_PATH
+        if path:
+          if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _capture_timeout(self, command, wait, *args, **kwargs):
+        _wait_state.depth = getattr(_wait_state, 'depth', 0) + 1
+        start = time.time()
+        try:
+            value = wait(*args, **kwargs)
+        except TimeoutException:
+            _WAIT_STATS.record(time.time() - start, timed_out=True)
+            save_failure_artifacts(self._driver, command)
+            raise
+        finally:
+            _wait_state.depth -= 1
+        _WAIT_STATS.record(time.time() - start)
+        return value
+
+    def until(self, *args, **kwargs):
+        return self._capture_timeout('until', super(
+            ScreenshotOnExceptionWebDriverWait, self).until, *args, **kwargs)
+
+    def until_not(self, *args, **kwargs):
+        return self._capture_timeout('until_not', super(
+            ScreenshotOnExceptionWebDriverWait, self).until_not, *args, **kwargs)
+
+
+class AdaptiveWait(ScreenshotOnExceptionWebDriverWait):
+    """Explicit wait that polls quickly at first and backs off: the
+    interval starts at `poll_frequency` and is multiplied by `backoff`
+    after every poll, up to `max_poll_frequency`. Defaults come from
+    TIMEOUT, WAIT_POLL, WAIT_BACKOFF and WAIT_POLL_MAX in the config the
+    driver was built with.
+
+    Meant for --wait-mode=explicit, where the implicit wait is zero so a
+    missing element is reported straight away instead of after TIMEOUT.
+    """
+
+    def __init__(self, driver, timeout=None, poll_frequency=None,
+                 ignored_exceptions=None, backoff=None,
+                 max_poll_frequency=None):
+        config = _config_of(driver)
+        if timeout is None:
+            timeout = config.TIMEOUT
+            if timeout is None:
+                timeout = DEFAULT_TIMEOUT
+        super(AdaptiveWait, self).__init__(
+            driver, timeout,
+            poll_frequency or config.WAIT_POLL or DEFAULT_WAIT_POLL,
+            ignored_exceptions)
+        self._backoff = (backoff or config.WAIT_BACKOFF
+                         or DEFAULT_WAIT_BACKOFF)
+        self._max_poll = (max_poll_frequency or config.WAIT_POLL_MAX
+                          or DEFAULT_WAIT_POLL_MAX)
+
+    def _wait(self, method, message, until, timeout=None):
+        screen = None
+        stacktrace = None
+        interval = self._poll
+        if timeout is None:
+            timeout = self._timeout
+        end_time = time.time() + timeout
+        while True:
+            try:
+                value = method(self._driver)
+                if bool(value) == until:
+                    return value
+            except self._ignored_exceptions as exc:
+                if not until:
+                    return True
+                screen = getattr(exc, 'screen', None)
+                stacktrace = getattr(exc, 'stacktrace', None)
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            interval = min(interval * self._backoff, self._max_poll)
+        raise TimeoutException(message, screen, stacktrace)
+
+    def until(self, method, message=''):
+        return self._capture_timeout('until', self._wait, method, message, True)
+
+    def until_not(self, method, message=''):
+        return self._capture_timeout('until_not', self._wait, method, message,
+                                     False)
+
+    def until_scripts(self, conditions, require_all=True, message=''):
+        """Wait for JavaScript conditions, evaluating all of them in one
+        execute_script per poll. `conditions` is a list of expressions,
+        e.g. "document.readyState == 'complete'"; an expression that
+        throws counts as false. Returns the list of their values once all
+        of them (or any, with require_all=False) are truthy."""
+        script = "return [%s];" % ", ".join(
+            "(function() { try { return (%s); } catch (e) { return false; } })()"
+            % condition for condition in conditions)
+
+        def condition(driver):
+            values = driver.execute_script(script)
+            met = [bool(value) for value in values]
+            if all(met) if require_all else any(met):
+                return values
+            return False
+        return self.until(condition, message)
+
+
+_OBSERVER_WAIT_SCRIPT = """
+var done = arguments[arguments.length - 1], timeout = arguments[0];
+function check() {
+  try { return {value: (%s)}; } catch (e) { return {error: e.name + ': ' + e.message}; }
+}
+var first = check();
+if (first.value || first.error) { done(first); return; }
+if (!window.MutationObserver) { done({unsupported: true}); return; }
+var finished = false, observer, timer, interval;
+function finish(result) {
+  if (finished) { return; }
+  finished = true;
+  observer.disconnect();
+  clearTimeout(timer);
+  clearInterval(interval);
+  done(result);
+}
+function recheck() {
+  var result = check();
+  if (result.value || result.error) { finish(result); }
+}
+observer = new MutationObserver(recheck);
+observer.observe(document, {childList: true, subtree: true,
+                            attributes: true, characterData: true});
+// conditions on script state change without touching the DOM
+interval = setInterval(recheck, 250);
+timer = setTimeout(function () { finish({timeout: true}); }, timeout);
+"""
+
+
+class ObserverWait(AdaptiveWait):
+    """Explicit wait for a JavaScript condition that blocks in the browser
+    instead of polling over the wire: until_script installs a
+    MutationObserver and returns as soon as a DOM change makes the
+    condition true. Each execute_async_script blocks for at most
+    `max_block` seconds, under a script timeout that is put back when the
+    wait ends. If the page navigates away it polls until the next page
+    answers and then observes that one; without a MutationObserver it
+    falls back to AdaptiveWait's polling for the rest of the timeout.
+    An error in the condition itself, a syntax error or one it throws,
+    is raised straight away rather than waited out.
+    """
+
+    def __init__(self, driver, timeout=None, max_block=10, **kwargs):
+        super(ObserverWait, self).__init__(driver, timeout, **kwargs)
+        self._max_block = max_block
+
+    def _condition_value(self, result, condition):
+        if result.get('error'):
+            raise WebDriverException("wait condition %s failed: %s" %
+                                     (condition, result['error']))
+        return result['value']
+
+    def _navigating(self, e):
+        # a condition that doesn't parse fails the whole script, which
+        # must not be taken for the page going away
+        return 'SyntaxError' not in (e.msg or '')
+
+    def _poll_once(self, poll_script, end_time, message):
+        # the condition's result on the first poll the page answers
+        while True:
             try:
-                return super(ScreenshotOnExceptionWebDriver,
+                return self._driver.execute_script(poll_script)
+            except WebDriverException as e:
+                if not self._navigating(e):
+                    raise
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    raise TimeoutException(message)
+                time.sleep(min(self._poll, remaining))
+
+    def _observe(self, condition, message):
+        script = _OBSERVER_WAIT_SCRIPT % condition
+        poll_script = ("try { return {value: (%s)}; } "
+                       "catch (e) { return {error: e.name + ': ' + e.message}; }"
+                       % condition)
+        end_time = time.time() + self._timeout
+        # unknown for sessions nose-selenium hasn't seen set it; those keep
+        # the wait's timeout rather than get a guessed one
+        previous = getattr(self._driver, '_nose_selenium_script_timeout',
+                           None)
+        self._driver.set_script_timeout(self._max_block + 5)
+        try:
+            while True:
+                block = int(min(end_time - time.time(), self._max_block) * 1000)
+                if block <= 0:
+                    raise TimeoutException(message)
+                try:
+                    result = self._driver.execute_async_script(script, block)
+                except WebDriverException as e:
+                    if not self._navigating(e):
+                        raise
+                    logger.debug("Polling for %s until the page answers: %s" %
+                                 (condition, e))
+                    value = self._condition_value(
+                        self._poll_once(poll_script, end_time, message),
+                        condition)
+                    if value:
+                        return value
+                    continue
+                if result is None or result.get('unsupported'):
+                    break
+                if not result.get('timeout'):
+                    return self._condition_value(result, condition)
+        finally:
+            if previous is not None:
+                self._driver.set_script_timeout(previous)
+
+        return self._wait(
+            lambda driver: self._condition_value(
+                driver.execute_script(poll_script), condition),
+            message, True, max(end_time - time.time(), 0))
+
+    def until_script(self, condition, message=''):
+        """Wait until the JavaScript expression `condition` is truthy in
+        the page, and return its value."""
+        return self._capture_timeout('until_script', self._observe,
+                                     condition, message)
+
+
+# commands used to capture failure artifacts, which must not recurse
+_UNCAPTURED_COMMANDS = frozenset([
+    Command.SCREENSHOT,
+    Command.GET_PAGE_SOURCE,
+    Command.GET_CURRENT_URL,
+])
+
+
+_QUERY_ELEMENTS_SCRIPT = """
+var specs = arguments[0], results = [];
+function trim(text) { return (text || '').replace(/^\\s+|\\s+$/g, ''); }
+function find(by, value) {
+  switch (by) {
+    case 'id': return document.getElementById(value);
+    case 'name': return document.getElementsByName(value)[0] || null;
+    case 'class name': return document.getElementsByClassName(value)[0] || null;
+    case 'tag name': return document.getElementsByTagName(value)[0] || null;
+    case 'css selector': return document.querySelector(value);
+    case 'xpath':
+      return document.evaluate(value, document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    default:
+      var links = document.getElementsByTagName('a');
+      for (var i = 0; i < links.length; i++) {
+        var text = trim(links[i].innerText || links[i].textContent);
+        if (by == 'link text' ? text == value : text.indexOf(value) != -1) {
+          return links[i];
+        }
+      }
+      return null;
+  }
+}
+function visible(el) {
+  for (var node = el; node && node.nodeType == 1; node = node.parentNode) {
+    var style = window.getComputedStyle(node, null);
+    if (style.display == 'none') { return false; }
+  }
+  var style = window.getComputedStyle(el, null);
+  return style.visibility != 'hidden' && style.visibility != 'collapse' &&
+    (el.offsetWidth > 0 || el.offsetHeight > 0);
+}
+function property(el, name) {
+  if (name == 'text') {
+    return visible(el) ? trim(el.innerText !== undefined ? el.innerText : el.textContent) : '';
+  }
+  if (name == 'visible') { return visible(el); }
+  if (name == 'tag_name') { return el.tagName.toLowerCase(); }
+  var value = el[name];
+  if (value === undefined || value === null ||
+      typeof value == 'object' || typeof value == 'function') {
+    return el.getAttribute(name);
+  }
+  return value;
+}
+for (var i = 0; i < specs.length; i++) {
+  var el = find(specs[i][0], specs[i][1]);
+  if (!el) { results.push(null); continue; }
+  var values = {};
+  for (var j = 0; j < specs[i][2].length; j++) {
+    values[specs[i][2][j]] = property(el, specs[i][2][j]);
+  }
+  results.push(values);
+}
+return results;
+"""
+
+# locator strategies query_elements can find elements by
+_QUERY_STRATEGIES = ['id', 'name', 'class name', 'tag name', 'css selector',
+                     'xpath', 'link text', 'partial link text']
+
+
+def query_elements(wd, queries):
+    """Read properties of many elements in a single round trip.
+
+    `queries` maps (by, value) locators, as passed to find_element, to
+    a list of the properties wanted from the first matching element:
+    'text', 'visible', 'tag_name', or the name of any attribute or DOM
+    property (e.g. 'value', 'href'). Returns a dict with the same keys
+    mapping to {property: value} dicts. If any element is missing,
+    NoSuchElementException is raised, after saving failure artifacts
+    like any other command of a ScreenshotOnExceptionWebDriver.
+    """
+    locators = list(queries.keys())
+    specs = []
+    for by, value in locators:
+        if by not in _QUERY_STRATEGIES:
+            raise TypeError(
+                "%s not in available options for query_elements: %s" %
+                (by, ", ".join(_QUERY_STRATEGIES)))
+        specs.append([by, value, list(queries[(by, value)])])
+    results = wd.execute_script(_QUERY_ELEMENTS_SCRIPT, specs)
+
+    missing = [locator for locator, result in zip(locators, results)
+               if result is None]
+    if missing:
+        if (isinstance(wd, ScreenshotOnExceptionWebDriver) and
+                not _in_explicit_wait()):
+            save_failure_artifacts(wd, 'query_elements')
+        raise NoSuchElementException(
+            "Unable to locate element: %s" % ", ".join(
+                '{"method":"%s","selector":"%s"}' % locator
+                for locator in missing))
+    return dict(zip(locators, results))
+
+
+class ScreenshotOnExceptionWebDriver(webdriver.Remote):
+
+
+    def __init__(self, *args, **kwargs):
+        # failure artifacts go where `config` says, by default
+        # current_config()
+        self._nose_selenium_config = kwargs.pop('config', None)
+        super(ScreenshotOnExceptionWebDriver, self).__init__(*args, **kwargs)
+        path = _config_of(self).SAVED_FILES_PATH
+        if path:
+          if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _execute(self, driver_command, params):
+        stats = _COMMAND_STATS
+        if stats is None:
+            return super(ScreenshotOnExceptionWebDriver,
+                             self).execute(driver_command, params=params)
+        start = time.time()
+        try:
+            return super(ScreenshotOnExceptionWebDriver,
                              self).execute(driver_command, params=params)
-            except WebDriverException:
-                global SAVED_FILES_PATH
-                if SAVED_FILES_PATH:
-                    timestamp = repr(time.time()).replace('.', '')
-                    # save a screenshot
-                    screenshot_filename = SAVED_FILES_PATH + "/" + timestamp + ".png"
-                    self.get_screenshot_as_file(screenshot_filename)
-                    logger.error("Screenshot saved to %s" % screenshot_filename)
-                    # save the html
-                    html_filename = SAVED_FILES_PATH + "/" + timestamp + ".html"
-                    html = self.page_source
-                    outfile = open(html_filename, 'w')
-                    outfile.write(html.encode('utf8', 'ignore'))
-                    outfile.close()
-                    logger.error("HTML saved to %s" % html_filename)
-                    logger.error("Page URL: %s" % self.current_url)
+        finally:
+            stats.record(driver_command, time.time() - start)
+
+    def execute(self, driver_command, params=None):
+        if driver_command in _UNCAPTURED_COMMANDS:
+            return self._execute(driver_command, params)
+        try:
+            return self._execute(driver_command, params)
+        except WebDriverException:
+            # only failing commands pay for looking for an explicit wait
+            if not _in_explicit_wait():
+                save_failure_artifacts(self, driver_command)
+            raise
+
+    def set_script_timeout(self, time_to_wait):
+        super(ScreenshotOnExceptionWebDriver,
+              self).set_script_timeout(time_to_wait)
+        # for ObserverWait to put back
+        self._nose_selenium_script_timeout = time_to_wait
+
+    def query_elements(self, queries):
+        """See nose_selenium.query_elements."""
+        return query_elements(self, queries)
+
+
+
+class _CountingConnection:
+    """Mixin for httplib connections counting the bytes of the current
+    request handed to the socket, so that a failed request can tell
+    whether any of it may have reached the server. Old-style, like the
+    httplib classes it is mixed into."""
+
+    bytes_sent = 0
+
+    def putrequest(self, *args, **kwargs):
+        self.bytes_sent = 0
+        return self._base.putrequest(self, *args, **kwargs)
+
+    def send(self, data):
+        if self.sock is None:
+            # a connect that fails has sent nothing
+            self.connect()
+        if hasattr(data, 'read'):
+            # a file body, sent in blocks: count it as sent up front
+            self.bytes_sent += 1
+            return self._base.send(self, data)
+        offset = 0
+        while offset < len(data):
+            sent = self.sock.send(data[offset:])
+            offset += sent
+            self.bytes_sent += sent
+
+
+class _HTTPConnection(_CountingConnection, httplib.HTTPConnection):
+    _base = httplib.HTTPConnection
+
+
+class _HTTPSConnection(_CountingConnection, httplib.HTTPSConnection):
+    _base = httplib.HTTPSConnection
+
+
+# requests that may be sent again when the first try failed part way
+_IDEMPOTENT_METHODS = ('GET', 'DELETE')
+
+
+class HTTPConnectionPool(object):
+    """Keep-alive connections to one WebDriver server. Connections are
+    borrowed for one request at a time; up to `maxsize` idle ones are kept
+    for the next request, from any session."""
+
+    def __init__(self, scheme, host, port, maxsize=10, timeout=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.created = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            cls = _HTTPSConnection
+        else:
+            cls = _HTTPConnection
+        if self.timeout:
+            conn = cls(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = cls(self.host, self.port)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def get(self):
+        """Return (connection, reused) for one request. Idle connections
+        the server has closed meanwhile are dropped."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            if not self._closed_by_server(conn):
+                return (conn, True)
+            conn.close()
+        return (self._new_connection(), False)
+
+    @staticmethod
+    def _closed_by_server(conn):
+        # an idle connection has nothing to read until the server closes it
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class PooledRemoteConnection(RemoteConnection):
+    """RemoteConnection that sends its requests over connections borrowed
+    from an HTTPConnectionPool instead of opening one per command."""
+
+    def __init__(self, remote_server_addr, pool):
+        RemoteConnection.__init__(self, remote_server_addr, resolve_ip=False)
+        # RemoteConnection's keep-alive code path talks to self._conn
+        self.keep_alive = True
+        self._pool = pool
+        self._borrowed = threading.local()
+
+    @property
+    def _conn(self):
+        return self._borrowed.conn
+
+    def _request(self, method, url, body=None):
+        conn, reused = self._pool.get()
+        retried = False
+        while True:
+            self._borrowed.conn = conn
+            try:
+                result = RemoteConnection._request(self, method, url, body)
+            except socket.timeout:
+                conn.close()
                 raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                # try once more on a fresh connection, but only when the
+                # server can't have acted on the request already: nothing
+                # of it was sent, or sending it twice does no harm
+                if retried or not (conn.bytes_sent == 0 or
+                                   method in _IDEMPOTENT_METHODS):
+                    raise
+                logger.debug("%s %s failed on a %s connection, retrying",
+                             method, url, reused and 'reused' or 'new')
+                conn, reused = self._pool._new_connection(), False
+                retried = True
+                continue
+            finally:
+                self._borrowed.conn = None
+            self._pool.put(conn)
+            return result
+
+
+_CONNECTION_POOLS = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+
+def connection_pool_for(url, maxsize=None, timeout=None):
+    """Return the HTTPConnectionPool shared by everything talking to the
+    server at `url`. A new pool keeps `maxsize` idle connections
+    (default HTTP_POOL_SIZE of current_config()) with a `timeout` (default
+    its HTTP_TIMEOUT)."""
+    parsed_url = urlparse.urlparse(url)
+    scheme = parsed_url.scheme or 'http'
+    port = parsed_url.port or (scheme == 'https' and 443 or 80)
+    key = (scheme, parsed_url.hostname, port)
+    with _CONNECTION_POOLS_LOCK:
+        pool = _CONNECTION_POOLS.get(key)
+        if pool is None:
+            if maxsize is None:
+                maxsize = current_config().HTTP_POOL_SIZE
+            if timeout is None:
+                timeout = current_config().HTTP_TIMEOUT
+            pool = _CONNECTION_POOLS[key] = HTTPConnectionPool(
+                scheme, parsed_url.hostname, port,
+                maxsize=maxsize, timeout=timeout or None)
+        return pool
+
+
+def close_connection_pools():
+    with _CONNECTION_POOLS_LOCK:
+        pools = list(_CONNECTION_POOLS.values())
+        _CONNECTION_POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _command_executor(url, config=None):
+    if config is None:
+        config = current_config()
+    pool_size, timeout = config.HTTP_POOL_SIZE, config.HTTP_TIMEOUT
+    if not pool_size:
+        return url
+    return PooledRemoteConnection(url, connection_pool_for(url, pool_size,
+                                                           timeout))
+
+
+def _run_id():
+    """Identify this nose run; worker processes inherit it from the
+    parent through the environment."""
+    return os.environ.setdefault(
+        'NOSE_SELENIUM_RUN_ID', '%d-%d' % (os.getpid(), time.time()))
+
+
+def _run_lock_dir():
+    return os.path.join(tempfile.gettempdir(), 'nose-selenium-' + _run_id())
+
+
+class _BrowserSlot(object):
+    """A browser slot held until release(); releasing it again does
+    nothing."""
+
+    def __init__(self, release):
+        self._release = release
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class BrowserSlots(object):
+    """Caps the number of open browsers. Each slot is a file in
+    `lock_dir` that is flock()ed while a browser is open, so every process
+    using the same directory shares the cap and a crashed process gives
+    its slots back. Without fcntl the cap only applies to this process."""
+
+    def __init__(self, limit, lock_dir, poll_frequency=0.1):
+        self.limit = limit
+        self.lock_dir = lock_dir
+        self.poll_frequency = poll_frequency
+        self._semaphore = threading.BoundedSemaphore(limit)
+        if fcntl is None:
+            logger.warning("fcntl is not available, --max-browsers only "
+                           "applies within each process")
+        elif not os.path.exists(lock_dir):
+            try:
+                os.makedirs(lock_dir)
+            except OSError:
+                pass  # another worker got there first
+
+    def _try_slot(self, index):
+        fd = os.open(os.path.join(self.lock_dir, 'slot-%d' % index),
+                     os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(fd)
+            return None
+
+        def release():
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        return _BrowserSlot(release)
+
+    def acquire(self, timeout=None):
+        """Wait for a free slot and return it; call its release() when
+        the browser has been quit."""
+        start = time.time()
+        while True:
+            if fcntl is None:
+                if self._semaphore.acquire(False):
+                    return _BrowserSlot(self._semaphore.release)
+            else:
+                for index in range(self.limit):
+                    slot = self._try_slot(index)
+                    if slot is not None:
+                        return slot
+            if timeout is not None and time.time() - start > timeout:
+                raise WebDriverException(
+                    "Timed out after %s seconds waiting for one of %d browser "
+                    "slots (lock files in %s); every slot is held by an open "
+                    "browser of this run, see --max-browsers and --slot-timeout."
+                    % (timeout, self.limit, self.lock_dir))
+            time.sleep(self.poll_frequency)
+
+
+# BrowserSlots by limit
+_BROWSER_SLOTS = {}
+_BROWSER_SLOTS_LOCK = threading.Lock()
+
+
+def _browser_slots(config):
+    """The BrowserSlots for config.MAX_BROWSERS, None if it is 0. Each
+    limit has its own lock files, shared with the other processes of this
+    run."""
+    limit = config.MAX_BROWSERS
+    if not limit:
+        return None
+    with _BROWSER_SLOTS_LOCK:
+        slots = _BROWSER_SLOTS.get(limit)
+        if slots is None:
+            slots = _BROWSER_SLOTS[limit] = BrowserSlots(
+                limit, os.path.join(_run_lock_dir(), 'max-browsers-%d' % limit))
+        return slots
+
+
+def _release_slot_on_quit(wd, slot):
+    quit = wd.quit
+
+    def quit_and_release():
+        # quitting again goes straight to the driver
+        wd.quit = quit
+        try:
+            quit()
+        finally:
+            slot.release()
+    wd.quit = quit_and_release
+
+
+class GridHubProbe(object):
+    """Asks a Selenium Grid hub how many more sessions it can start
+    right now. Returns the free slots less the new session requests the
+    hub already has queued, or None when the hub doesn't say."""
+
+    def __init__(self, address, port, timeout=5):
+        self.hub_url = 'http://%s:%s/grid/api/hub' % (address, port)
+        self.status_url = 'http://%s:%s/wd/hub/status' % (address, port)
+        self.timeout = timeout
+
+    def __call__(self):
+        try:
+            resp = requests.get(self.hub_url, timeout=self.timeout)
+            if resp.status_code == 200:
+                hub = resp.json()
+                return (hub['slotCounts']['free'] -
+                        hub.get('newSessionRequestCount', 0))
+            # hubs without the grid API can still say whether they are ready
+            resp = requests.get(self.status_url, timeout=self.timeout)
+            if resp.json().get('value', {}).get('ready') is False:
+                return 0
+        except (requests.RequestException, ValueError, KeyError,
+                TypeError, AttributeError) as e:
+            logger.debug("Could not read grid capacity: %s" % e)
+        return None
+
+
+class GridScheduler(object):
+    """Admission control for new grid sessions. At most `max_pending`
+    session requests are sent to the hub at once; the rest wait here,
+    lowest `priority` first, and are only admitted while `probe()` (by
+    default a GridHubProbe) reports free capacity. While the hub is full
+    the scheduler backs off, polling every `poll_frequency` seconds at
+    first and twice as long each time up to `max_poll_frequency`."""
+
+    # a test is waiting for the session
+    PRIORITY_TEST = 0
+    # the session is being booted ahead of time, e.g. for WebDriverPool
+    PRIORITY_BACKGROUND = 10
+
+    def __init__(self, max_pending, probe=None, timeout=300,
+                 poll_frequency=0.5, max_poll_frequency=10):
+        self.max_pending = max_pending
+        if probe is None:
+            config = current_config()
+            probe = GridHubProbe(config.REMOTE_ADDRESS, config.REMOTE_PORT)
+        self.probe = probe
+        self.timeout = timeout
+        self.poll_frequency = poll_frequency
+        self.max_poll_frequency = max_poll_frequency
+        self.pending = 0
+        # how long each request waited, updated under the lock
+        self.waits = LatencyHistogram()
+        self.backoffs = 0
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _has_capacity(self):
+        # called with the lock held; drop it while the hub answers
+        self._cond.release()
+        try:
+            free = self.probe()
+        finally:
+            self._cond.acquire()
+        return free is None or free > self.pending
+
+    def acquire(self, priority=PRIORITY_TEST):
+        """Wait until a new session may be requested from the hub; call
+        release() once the request has been answered."""
+        start = time.time()
+        entry = (priority, next(self._counter))
+        interval = self.poll_frequency
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    if (self._queue[0] == entry and
+                            self.pending < self.max_pending):
+                        if self._has_capacity():
+                            heapq.heappop(self._queue)
+                            self.pending += 1
+                            return
+                        self.backoffs += 1
+                        wait = interval
+                        interval = min(interval * 2, self.max_poll_frequency)
+                    else:
+                        wait = self.poll_frequency
+                    remaining = start + self.timeout - time.time()
+                    if remaining <= 0:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        raise WebDriverException(
+                            "Timed out after %s seconds waiting for grid capacity."
+                            % self.timeout)
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self.waits.record(time.time() - start)
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.pending -= 1
+            self._cond.notify_all()
+
+    def report(self, stream):
+        with self._cond:
+            waits = self.waits.summary()
+            backoffs = self.backoffs
+        if not waits['count']:
+            return
+        stream.writeln("nose-selenium grid scheduler (max pending %d): %d "
+                       "session requests, waited %.2fs total, %.2fs p95, "
+                       "%.2fs max, backed off %d times" %
+                       (self.max_pending, waits['count'], waits['total'],
+                        waits['p95'], waits['max'], backoffs))
+
+
+# GridSchedulers by hub executor URL
+_GRID_SCHEDULERS = {}
+_GRID_SCHEDULERS_LOCK = threading.Lock()
+
+
+def start_grid_scheduler(max_pending, probe=None, config=None):
+    """Put new sessions on the hub of `config` (default current_config())
+    through a GridScheduler, checking capacity with `probe` instead of the
+    hub's status page if one is given."""
+    if config is None:
+        config = current_config()
+    scheduler = _new_grid_scheduler(max_pending, probe, config)
+    with _GRID_SCHEDULERS_LOCK:
+        _GRID_SCHEDULERS[config.executor] = scheduler
+    return scheduler
+
+
+def _new_grid_scheduler(max_pending, probe, config):
+    return GridScheduler(
+        max_pending,
+        probe=probe or GridHubProbe(config.REMOTE_ADDRESS, config.REMOTE_PORT),
+        timeout=config.GRID_QUEUE_TIMEOUT or 300)
+
+
+def _grid_scheduler(config):
+    """The GridScheduler for the hub of `config`, None if there is none.
+    Sessions on one hub share a scheduler, started with the
+    GRID_MAX_PENDING of the first config to use it."""
+    if config.BROWSER_LOCATION != 'grid':
+        return None
+    with _GRID_SCHEDULERS_LOCK:
+        scheduler = _GRID_SCHEDULERS.get(config.executor)
+        if scheduler is None and config.GRID_MAX_PENDING:
+            scheduler = _GRID_SCHEDULERS[config.executor] = \
+                _new_grid_scheduler(config.GRID_MAX_PENDING, None, config)
+        return scheduler
+
+
+def _grid_schedulers():
+    with _GRID_SCHEDULERS_LOCK:
+        return list(_GRID_SCHEDULERS.values())
+
 
+def _session_priority():
+    """GridScheduler priority of a session started on this thread now."""
+    if getattr(_test_context, 'test_id', None) is None:
+        return GridScheduler.PRIORITY_BACKGROUND
+    return GridScheduler.PRIORITY_TEST
 
 
-def build_webdriver(name="", tags=[], public=False):
+def _new_grid_session(executor, capabilities, config):
+    scheduler = _grid_scheduler(config)
+    if scheduler is None:
+        return ScreenshotOnExceptionWebDriver(
+            command_executor=_command_executor(executor, config),
+            desired_capabilities=capabilities, config=config)
+    scheduler.acquire(_session_priority())
+    try:
+        return ScreenshotOnExceptionWebDriver(
+            command_executor=_command_executor(executor, config),
+            desired_capabilities=capabilities, config=config)
+    finally:
+        scheduler.release()
+
+
+def build_webdriver(name="", tags=[], public=False, capabilities=None,
+                    combination=None, config=None):
+    """Create and return the desired WebDriver instance, waiting up to
+    SLOT_TIMEOUT seconds for a browser slot first if MAX_BROWSERS is set. `capabilities` are added
+    to (and override) the desired capabilities for BROWSER. A
+    BrowserCombination replaces BROWSER, OS and BROWSER_VERSION. Settings
+    come from `config` if given, else from current_config()."""
+    if config is None:
+        config = current_config()
+    slots = _browser_slots(config)
+    if slots is None:
+        return _build_webdriver(name, tags, public, capabilities, combination,
+                                config)
+    slot = slots.acquire(timeout=config.SLOT_TIMEOUT or 300)
+    try:
+        wd = _build_webdriver(name, tags, public, capabilities, combination,
+                                config)
+    except:
+        slot.release()
+        raise
+    _release_slot_on_quit(wd, slot)
+    return wd
+
+
+def _clone_tree(source, target, link):
+    """Copy the directory tree at source to target, hardlinking the files
+    for which link(relative path) is true where the filesystem allows."""
+    for root, dirs, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        target_root = os.path.normpath(os.path.join(target, relative_root))
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+        for name in files:
+            relative = os.path.normpath(os.path.join(relative_root, name))
+            if link(relative):
+                try:
+                    os.link(os.path.join(root, name),
+                            os.path.join(target_root, name))
+                    continue
+                except (OSError, AttributeError):
+                    # another filesystem, or no hardlinks on this platform
+                    pass
+            shutil.copy2(os.path.join(root, name),
+                         os.path.join(target_root, name))
+
+
+class ClonedFirefoxProfile(FirefoxProfile):
+    """A FirefoxProfile used in place, in a clone made by
+    FirefoxProfileTemplate, rather than copied once more. The WebDriver
+    extension is already installed in it."""
+
+    def __init__(self, path, preferences):
+        if not FirefoxProfile.DEFAULT_PREFERENCES:
+            with open(os.path.join(os.path.dirname(firefox_profile.__file__),
+                                   firefox_profile.WEBDRIVER_PREFERENCES)) as f:
+                FirefoxProfile.DEFAULT_PREFERENCES = loads(f.read())
+        self.default_preferences = dict(preferences)
+        self.native_events_enabled = True
+        self.profile_dir = path
+        # webdriver.Firefox.quit() removes the clone
+        self.tempfolder = None
+        self.extensionsDir = os.path.join(path, "extensions")
+        self.userPrefs = os.path.join(path, "user.js")
+
+    def add_extension(self, extension=firefox_profile.WEBDRIVER_EXT):
+        if (extension == firefox_profile.WEBDRIVER_EXT and os.path.isdir(
+                os.path.join(self.extensionsDir, firefox_profile.EXTENSION_NAME))):
+            return
+        FirefoxProfile.add_extension(self, extension)
+
+
+class FirefoxProfileTemplate(object):
+    """A Firefox profile with preferences, extensions (and the WebDriver
+    extension) installed, built once and cached under `cache_path` by the
+    sha1 of everything that goes into it. Each session gets a clone in
+    which the unpacked extensions are hardlinked and the files Firefox
+    writes to are copied."""
+
+    PREFS_FILE = 'nose-selenium-prefs.json'
+
+    def __init__(self, profile_directory=None, extensions=(), preferences=None,
+                 cache_path=None):
+        self.profile_directory = profile_directory
+        self.extensions = list(extensions)
+        self.preferences = dict(preferences or {})
+        self.cache_path = cache_path or FIREFOX_PROFILE_CACHE_PATH
+        self.builds = 0
+        self._lock = threading.Lock()
+        self._path = None
+        self._preferences = None
+        self._clones = None
+
+    def key(self):
+        """sha1 of the selenium version, profile directory, extensions
+        and preferences."""
+        digest = hashlib.sha1(selenium.__version__)
+        digest.update(dumps(self.preferences, sort_keys=True))
+        for extension in self.extensions:
+            digest.update(os.path.basename(extension))
+            _hash_file(digest, extension)
+        if self.profile_directory:
+            for root, dirs, files in sorted(os.walk(self.profile_directory)):
+                for name in sorted(files):
+                    if name in ('lock', '.parentlock', 'parent.lock'):
+                        continue
+                    path = os.path.join(root, name)
+                    digest.update(os.path.relpath(path, self.profile_directory))
+                    _hash_file(digest, path)
+        return digest.hexdigest()
+
+    def path(self):
+        """The built template, building it if it isn't in the cache."""
+        with self._lock:
+            if self._path is None:
+                path = os.path.join(self.cache_path, self.key())
+                if not os.path.isdir(path):
+                    self._build(path)
+                with open(os.path.join(path, self.PREFS_FILE)) as f:
+                    self._preferences = loads(f.read())
+                self._path = path
+            return self._path
+
+    def _build(self, path):
+        start = time.time()
+        profile = FirefoxProfile(self.profile_directory)
+        for name, value in self.preferences.items():
+            profile.set_preference(name, value)
+        profile.add_extension()
+        for extension in self.extensions:
+            profile.add_extension(extension)
+        profile.update_preferences()
+        with open(os.path.join(profile.path, self.PREFS_FILE), 'w') as f:
+            f.write(dumps(profile.default_preferences))
+        if not os.path.isdir(self.cache_path):
+            try:
+                os.makedirs(self.cache_path)
+            except OSError:
+                # made by another worker meanwhile
+                pass
+        building = tempfile.mkdtemp(prefix='build-', dir=self.cache_path)
+        os.rmdir(building)
+        shutil.copytree(profile.path, building)
+        shutil.rmtree(profile.tempfolder or profile.path, ignore_errors=True)
+        try:
+            os.rename(building, path)
+        except OSError:
+            # another worker built the same template first
+            shutil.rmtree(building, ignore_errors=True)
+        self.builds += 1
+        logger.info("Built Firefox profile template %s in %.2fs" % (
+            path, time.time() - start))
+
+    def clone(self):
+        """A ClonedFirefoxProfile for one session."""
+        path = self.path()
+        with self._lock:
+            if self._clones is None:
+                self._clones = tempfile.mkdtemp(
+                    prefix='clones-%d-' % os.getpid(), dir=self.cache_path)
+        clone = tempfile.mkdtemp(dir=self._clones)
+        os.rmdir(clone)
+        _clone_tree(path, clone,
+                    link=lambda relative: relative.startswith(
+                        'extensions' + os.sep))
+        return ClonedFirefoxProfile(clone, self._preferences)
+
+    def remove_clones(self):
+        """Remove the clones left behind by sessions that were never
+        quit."""
+        with self._lock:
+            clones, self._clones = self._clones, None
+        if clones is not None:
+            shutil.rmtree(clones, ignore_errors=True)
+
+
+def _hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), ''):
+            digest.update(block)
+
+
+_PROFILE_TEMPLATES = {}
+_PROFILE_TEMPLATES_LOCK = threading.Lock()
+
+
+def firefox_profile_template(config=None):
+    """The FirefoxProfileTemplate for the FIREFOX_PROFILE,
+    FIREFOX_EXTENSIONS and FIREFOX_PREFS (and LIGHTWEIGHT_BROWSER) of
+    `config` (default current_config()), or None when none of them are
+    set."""
+    if config is None:
+        config = current_config()
+    extensions = tuple(config.FIREFOX_EXTENSIONS or ())
+    preferences = {}
+    if config.LIGHTWEIGHT_BROWSER:
+        preferences.update(LIGHTWEIGHT_FIREFOX_PREFS)
+    preferences.update(config.FIREFOX_PREFS or {})
+    if not (config.FIREFOX_PROFILE or extensions or preferences):
+        return None
+    key = (config.FIREFOX_PROFILE, extensions,
+           dumps(preferences, sort_keys=True))
+    with _PROFILE_TEMPLATES_LOCK:
+        template = _PROFILE_TEMPLATES.get(key)
+        if template is None:
+            template = _PROFILE_TEMPLATES[key] = FirefoxProfileTemplate(
+                config.FIREFOX_PROFILE, extensions, preferences)
+        return template
+
+
+def remove_firefox_profile_clones():
+    with _PROFILE_TEMPLATES_LOCK:
+        templates = list(_PROFILE_TEMPLATES.values())
+    for template in templates:
+        template.remove_clones()
+
+
+class LocalDriverService(object):
+    """A chromedriver or IEDriverServer process started once and shared
+    by every local session of the run (or of a --processes worker), which
+    talk to it like to a remote server. Firefox has no driver process of
+    its own here, so FIREFOX sessions are still started directly."""
+
+    # BROWSER: (selenium service class, default executable)
+    SERVICES = {
+        'CHROME': (ChromeService, 'chromedriver'),
+        'INTERNETEXPLORER': (IeService, 'IEDriverServer.exe'),
+    }
+
+    def __init__(self, service):
+        self.service = service
+        self.starts = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_browser(cls, browser, executable_path=None):
+        service_class, executable = cls.SERVICES[browser]
+        return cls(service_class(executable_path or executable))
+
+    def running(self):
+        process = getattr(self.service, 'process', None)
+        return process is not None and process.poll() is None
+
+    def url(self):
+        """URL of the driver process, (re)starting it if it isn't running."""
+        with self._lock:
+            if not self.running():
+                start = time.time()
+                self.service.start()
+                self.starts += 1
+                logger.info("Started %s in %.2fs" % (
+                    self.service.path, time.time() - start))
+            return self.service.service_url
+
+    def stop(self):
+        with self._lock:
+            if self.running():
+                self.service.stop()
+
+
+_DRIVER_SERVICES = {}
+_DRIVER_SERVICES_LOCK = threading.Lock()
+
+
+def local_driver_service(browser):
+    """The LocalDriverService for BROWSER, made on first use."""
+    with _DRIVER_SERVICES_LOCK:
+        service = _DRIVER_SERVICES.get(browser)
+        if service is None:
+            service = _DRIVER_SERVICES[browser] = \
+                LocalDriverService.for_browser(browser)
+        return service
+
+
+def stop_local_driver_services():
+    with _DRIVER_SERVICES_LOCK:
+        services = list(_DRIVER_SERVICES.values())
+        _DRIVER_SERVICES.clear()
+    for service in services:
+        service.stop()
+
+
+def local_capabilities(browser, capabilities=None, lightweight=False):
+    """Desired capabilities for a local BROWSER, with the Chrome options
+    for HEADLESS_CHROME and lightweight mode added, or None when the
+    driver's defaults will do."""
+    base = HEADLESS_BROWSERS.get(browser, browser)
+    args = []
+    prefs = {}
+    if browser == 'HEADLESS_CHROME':
+        args.extend(HEADLESS_CHROME_ARGS)
+    if base == 'CHROME' and lightweight:
+        args.extend(arg for arg in LIGHTWEIGHT_CHROME_ARGS if arg not in args)
+        prefs.update(LIGHTWEIGHT_CHROME_PREFS)
+    if not (capabilities or args or prefs):
+        return None
+    desired = dict(getattr(webdriver.DesiredCapabilities, base))
+    desired.update(capabilities or {})
+    if args or prefs:
+        options = dict(desired.get('chromeOptions') or {})
+        options['args'] = args + list(options.get('args', []))
+        options['prefs'] = dict(prefs, **options.get('prefs', {}))
+        desired['chromeOptions'] = options
+    return desired
+
+
+def _headless_firefox_binary():
+    # Firefox runs headless from 56 (55 on Linux), and the legacy
+    # FirefoxDriver extension selenium 2.53 starts it with stops loading
+    # in 57, so this only works with Firefox 56 (55-56 on Linux)
+    binary = FirefoxBinary()
+    binary.add_command_line_options('-headless')
+    return binary
+
+
+class WebDriverFactory(object):
+    """Builds sessions for one SeleniumConfig. What kind of driver to
+    start is worked out once, when the factory is made, rather than on
+    every call."""
+
+    # BROWSER: (selenium.webdriver class, its capabilities argument)
+    LOCAL_DRIVERS = {
+        'FIREFOX': ('Firefox', 'capabilities'),
+        'HEADLESS_FIREFOX': ('Firefox', 'capabilities'),
+        'CHROME': ('Chrome', 'desired_capabilities'),
+        'HEADLESS_CHROME': ('Chrome', 'desired_capabilities'),
+        'INTERNETEXPLORER': ('Ie', 'capabilities'),
+        'PHANTOMJS': ('PhantomJS', 'desired_capabilities'),
+    }
+
+    def __init__(self, config):
+        self.config = config
+        self._start = getattr(self, '_start_%s' % config.BROWSER_LOCATION, None)
+        if self._start is None:
+            raise TypeError("browser location %s not found" %
+                            config.BROWSER_LOCATION)
+
+    def _start_local(self, capabilities, combination):
+        browser = combination.browser if combination else self.config.BROWSER
+        if browser not in self.LOCAL_DRIVERS:
+            raise TypeError(
+                'WebDriver does not have a driver for local %s' % browser)
+        base = HEADLESS_BROWSERS.get(browser, browser)
+        desired = local_capabilities(browser, capabilities,
+                                     self.config.LIGHTWEIGHT_BROWSER)
+        if (self.config.LOCAL_DRIVER_SERVICE and
+                base in LocalDriverService.SERVICES):
+            url = local_driver_service(base).url()
+            return ScreenshotOnExceptionWebDriver(
+                command_executor=_command_executor(url, self.config),
+                desired_capabilities=desired or dict(
+                    getattr(webdriver.DesiredCapabilities, base)),
+                config=self.config)
+        driver, argument = self.LOCAL_DRIVERS[browser]
+        kwargs = {}
+        if base == 'FIREFOX':
+            template = firefox_profile_template(self.config)
+            if template is not None:
+                kwargs['firefox_profile'] = template.clone()
+            if browser == 'HEADLESS_FIREFOX':
+                if (desired or {}).get('marionette'):
+                    raise TypeError(
+                        'HEADLESS_FIREFOX needs the legacy FirefoxDriver, '
+                        'marionette starts Firefox without -headless')
+                kwargs['firefox_binary'] = _headless_firefox_binary()
+        if browser == 'PHANTOMJS' and self.config.LIGHTWEIGHT_BROWSER:
+            kwargs['service_args'] = list(LIGHTWEIGHT_PHANTOMJS_ARGS)
+        if desired:
+            kwargs[argument] = desired
+        return getattr(webdriver, driver)(**kwargs)
+
+    def _start_remote(self, capabilities, combination):
+        return ScreenshotOnExceptionWebDriver(
+            command_executor=_command_executor(self.config.executor, self.config),
+            desired_capabilities=capabilities, config=self.config)
+
+    def _start_grid(self, capabilities, combination):
+        return _new_grid_session(self.config.executor, capabilities, self.config)
+
+    _start_sauce = _start_remote
+
+    def __call__(self, name="", tags=[], public=False, capabilities=None,
+                 combination=None):
+        """Create and return a WebDriver, see build_webdriver."""
+        config = self.config
+        if config.BROWSER_LOCATION == 'local':
+            desired = capabilities
+        else:
+            desired = config.capabilities(combination, capabilities,
+                                          name, tags, public)
+        wd = self._start(desired, combination)
+
+        wd._nose_selenium_config = config
+        wd._nose_selenium_born = time.time()
+        wd._nose_selenium_capabilities = capability_key(capabilities)
+        wd._nose_selenium_combination = combination
+        start = time.time()
+        if config.WAIT_MODE == 'explicit':
+            wd.implicitly_wait(0)
+        else:
+            wd.implicitly_wait(config.TIMEOUT)
+        # sometimes what goes out != what goes in, so log it
+        logger.info("actual capabilities: %s" % wd.capabilities)
+        _record_phase('configure', time.time() - start)
+        return wd
+
+
+def _build_webdriver(name="", tags=[], public=False, capabilities=None,
+                     combination=None, config=None):
     """Create and return the desired WebDriver instance."""
-    global BROWSER_LOCATION
-    global BROWSER
-    global BUILD
-    global BROWSER_VERSION
-    global OS
-    global REMOTE_ADDRESS
-    global REMOTE_PORT
-    global TIMEOUT
-    global SAUCE_USERNAME
-    global SAUCE_APIKEY
+    if config is None:
+        factory = driver_factory()
+    else:
+        factory = WebDriverFactory(config)
+    return factory(name, tags, public, capabilities, combination)
+
+
+class WebDriverPool(object):
+    """Sessions created by build_webdriver in background threads and
+    handed out to tests. At most `size` sessions exist at once, whether
+    booting, idle or checked out; discarded sessions are replaced in the
+    background."""
 
-    wd = None
+    def __init__(self, size, factory=None, timeout=300):
+        self.size = size
+        self.factory = factory or build_webdriver
+        self.timeout = timeout
+        self.wait_times = []
+        self._idle = Queue()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._closed = False
 
-    if BROWSER_LOCATION == 'local':
-        if BROWSER == 'FIREFOX':
-            wd = webdriver.Firefox()
-        elif BROWSER == 'CHROME':
-            wd = webdriver.Chrome()
-        elif BROWSER == 'INTERNETEXPLORER':
-            wd = webdriver.Ie()
+    def start(self):
+        for i in range(self.size):
+            self._spawn()
+
+    def _spawn(self):
+        with self._lock:
+            if self._closed or self._in_flight >= self.size:
+                return
+            self._in_flight += 1
+        thread = threading.Thread(target=self._boot)
+        thread.daemon = True
+        thread.start()
+
+    def _boot(self):
+        try:
+            wd = self.factory()
+        except Exception as e:
+            logger.error("Error starting pooled WebDriver session: %s" % e)
+            with self._lock:
+                self._in_flight -= 1
+            # wake up a waiting checkout so it can report the error
+            self._idle.put(e)
+            return
+        if self._closed:
+            self._retire(wd)
         else:
-            raise TypeError(
-                'WebDriver does not have a driver for local %s' % BROWSER)
-
-    elif BROWSER_LOCATION == 'remote':
-        capabilities = getattr(webdriver.DesiredCapabilities, BROWSER.upper())
-        executor = 'http://%s:%s/wd/hub' % (REMOTE_ADDRESS, REMOTE_PORT)
-        # try:
-        wd = ScreenshotOnExceptionWebDriver(command_executor=executor,
-                              desired_capabilities=capabilities)
-        # except URLError:
-        #     # print(" caught URLError ",)
-        #     raise Exception(
-        #         "Remote selenium server at %s:%s is not responding."
-        #         % (REMOTE_ADDRESS, REMOTE_PORT))
-
-    elif BROWSER_LOCATION == 'grid':
-        capabilities = getattr(webdriver.DesiredCapabilities, BROWSER.upper())
-        capabilities['version'] = BROWSER_VERSION
-        capabilities['platform'] = OS.upper()
-        executor = 'http://%s:%s/wd/hub' % (REMOTE_ADDRESS, REMOTE_PORT)
-        # try:
-        wd = ScreenshotOnExceptionWebDriver(command_executor=executor,
-                              desired_capabilities=capabilities)
-        # except URLError:
-        #     # print(" caught URLError ",)
-        #     raise Exception(
-        #         "Selenium grid server at %s:%s is not responding."
-        #         % (REMOTE_ADDRESS, REMOTE_PORT))
-
-    elif BROWSER_LOCATION == 'sauce':
-        capabilities = {
-            'build': BUILD,
-            'name': name,
-            'tags': tags,
-            'public': public,
-            'restricted-public-info': not public,
-            'platform': OS,
-            'browserName': BROWSER,
-            'version': BROWSER_VERSION,
-        }
-        executor = 'http://%s:%s@ondemand.saucelabs.com:80/wd/hub' % (SAUCE_USERNAME, SAUCE_APIKEY)
-        wd = ScreenshotOnExceptionWebDriver(command_executor=executor,
-                              desired_capabilities=capabilities)
+            self._idle.put(wd)
+
+    def _retire(self, wd):
+        with self._lock:
+            self._in_flight -= 1
+        _quit_webdriver(wd)
+
+    def checkout(self):
+        """Return an idle session, waiting for one to boot if needed.
+        Idle sessions that are too old or no longer respond are replaced
+        in the background and the next one is tried."""
+        self._spawn()
+        start = time.time()
+        try:
+            while True:
+                remaining = start + self.timeout - time.time()
+                try:
+                    wd = self._idle.get(True, max(remaining, 0))
+                except Empty:
+                    raise WebDriverException(
+                        "Timed out after %s seconds waiting for a pooled session."
+                        % self.timeout)
+                if isinstance(wd, Exception):
+                    raise wd
+                reason = _RECYCLER.retire_reason(wd)
+                if reason is None:
+                    return wd
+                _RECYCLER.record(reason)
+                self.discard(wd)
+        finally:
+            self.wait_times.append(time.time() - start)
+
+    def checkin(self, wd):
+        """Reset a session and make it available to the next test."""
+        if self._closed:
+            self._retire(wd)
+            return
+        reason = _RECYCLER.retire_reason(wd, probe=False)
+        if reason is not None:
+            # not worth resetting a session nobody will get
+            _RECYCLER.record(reason)
+            self.discard(wd)
+            return
+        try:
+            reset_webdriver(wd)
+        except WebDriverException as e:
+            logger.warning("Discarding unusable pooled session: %s" % e)
+            _RECYCLER.record('reset-failed')
+            self.discard(wd)
+            return
+        self._idle.put(wd)
+
+    def discard(self, wd):
+        """Quit a session and start a replacement in the background."""
+        self._retire(wd)
+        self._spawn()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                wd = self._idle.get_nowait()
+            except Empty:
+                break
+            if not isinstance(wd, Exception):
+                self._retire(wd)
+
+    def report(self, stream):
+        waits = self.wait_times
+        if not waits:
+            return
+        stream.writeln("nose-selenium session pool (size %d): %d checkouts, "
+                       "waited %.2fs total, %.2fs mean, %.2fs max" %
+                       (self.size, len(waits), sum(waits),
+                        sum(waits) / len(waits), max(waits)))
+
+
+_POOL = None
+
+
+def start_webdriver_pool(size):
+    """Start booting `size` sessions in the background. acquire_webdriver
+    takes sessions from this pool until stop_webdriver_pool is called."""
+    global _POOL
+    stop_webdriver_pool()
+    _POOL = WebDriverPool(size)
+    _POOL.start()
+    return _POOL
+
+
+def stop_webdriver_pool():
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+        _POOL = None
+
+
+def capability_key(capabilities):
+    """A hashable, order-independent key for a dict of desired
+    capabilities; '' for none."""
+    if not capabilities:
+        return ''
+    return dumps(capabilities, sort_keys=True)
+
+
+def _test_capabilities(test):
+    """The desired_capabilities a test (or a nose wrapper of one) asks
+    for, or None."""
+    test = getattr(test, 'test', test)
+    return getattr(test, 'desired_capabilities', None)
+
+
+def group_by_capabilities(suite):
+    """Reorder a test suite in place so tests asking for the same
+    desired_capabilities run next to each other. Groups are ordered by
+    where they first appear, and tests keep their order within a group.
+    Only whole classes and modules move, so their fixtures still run
+    around their own tests."""
+    first_seen = {}
+
+    def collect(test):
+        if isinstance(test, unittest.TestSuite):
+            # nose suites are generators, which can only be read once
+            children = list(test)
+            test._tests = children
+            for child in children:
+                collect(child)
+        else:
+            first_seen.setdefault(capability_key(_test_capabilities(test)),
+                                  len(first_seen))
+
+    def order(test):
+        if not isinstance(test, unittest.TestSuite):
+            return first_seen[capability_key(_test_capabilities(test))]
+        ranked = [(order(child), index, child)
+                  for index, child in enumerate(test._tests)]
+        if not ranked:
+            return len(first_seen)
+        ranked.sort()
+        test._tests = [child for rank, index, child in ranked]
+        return ranked[0][0]
+
+    collect(suite)
+    order(suite)
+
+
+class _LockedResult(object):
+    """Serialises the calls tests running on several threads make to
+    one test result."""
+
+    _METHODS = ['startTest', 'stopTest', 'addSuccess', 'addError',
+                'addFailure', 'addSkip', 'addExpectedFailure',
+                'addUnexpectedSuccess']
+
+    def __init__(self, result, lock):
+        self._result = result
+        self._lock = lock
+
+    def __getattr__(self, attr):
+        value = getattr(self._result, attr)
+        if attr not in self._METHODS:
+            return value
+
+        def locked(*args, **kwargs):
+            outermost = getattr(_result_calls, 'pending', None) is None
+            if outermost:
+                _result_calls.pending = []
+            try:
+                with self._lock:
+                    return value(*args, **kwargs)
+            finally:
+                if outermost:
+                    pending, _result_calls.pending = _result_calls.pending, None
+                    for function, args in pending:
+                        function(*args)
+        return locked
+
+
+# taken by every test running off the main thread to report its result
+_RESULT_LOCK = threading.RLock()
+
+# work put off until this thread's _LockedResult call has let go of the lock
+_result_calls = threading.local()
+
+
+def _after_result_call(function, *args):
+    """Call function(*args) once the _LockedResult call this thread is in
+    has released its lock, or now outside of one."""
+    pending = getattr(_result_calls, 'pending', None)
+    if pending is None:
+        function(*args)
     else:
-        raise TypeError("browser location %s not found" % BROWSER_LOCATION)
+        pending.append((function, args))
+
+
+class _ThreadStdout(object):
+    """sys.stdout while _PerThreadCapture is capturing: each thread writes
+    to the buffer its own test started, or to the real stdout."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def push(self):
+        self._stack().append(StringIO())
+
+    def pop(self):
+        stack = self._stack()
+        if stack:
+            stack.pop()
+
+    @property
+    def current(self):
+        stack = self._stack()
+        return stack and stack[-1] or None
 
-    wd.implicitly_wait(TIMEOUT)
-    # sometimes what goes out != what goes in, so log it
-    logger.info("actual capabilities: %s" % wd.capabilities)
+    def write(self, data):
+        (self.current or self.stream).write(data)
+
+    def writelines(self, lines):
+        (self.current or self.stream).writelines(lines)
+
+    def flush(self):
+        (self.current or self.stream).flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+
+class _PerThreadCapture(Capture):
+    """nose's Capture, keeping the stdout of tests running at the same
+    time on different threads apart. Capture swaps sys.stdout itself in
+    beforeTest and afterTest, which interleave across threads."""
+
+    def start(self):
+        if not isinstance(sys.stdout, _ThreadStdout):
+            self.stdout.append(sys.stdout)
+            sys.stdout = _ThreadStdout(sys.stdout)
+        sys.stdout.push()
+
+    def end(self):
+        if isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout.pop()
+
+    def finalize(self, result):
+        if isinstance(sys.stdout, _ThreadStdout) and self.stdout:
+            sys.stdout = self.stdout.pop()
+
+    def _get_buffer(self):
+        if isinstance(sys.stdout, _ThreadStdout):
+            current = sys.stdout.current
+            if current is not None:
+                return current.getvalue()
+
+    buffer = property(_get_buffer, None, None,
+                      """This thread's captured stdout output.""")
+
+
+class _PerThreadMemoryHandler(MyMemoryHandler):
+    """MyMemoryHandler keeping each thread's log records apart."""
+
+    def __init__(self, *args):
+        self._local = threading.local()
+        MyMemoryHandler.__init__(self, *args)
+
+    def _get_buffer(self):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = []
+        return buffer
+
+    def _set_buffer(self, buffer):
+        self._local.buffer = buffer
+
+    buffer = property(_get_buffer, _set_buffer)
+
+    def __getstate__(self):
+        state = MyMemoryHandler.__getstate__(self)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        MyMemoryHandler.__setstate__(self, state)
+        self._local = threading.local()
+
+
+class _PerThreadLogCapture(LogCapture):
+    """nose's LogCapture, keeping the log records of tests running at the
+    same time on different threads apart."""
+
+    _setup_lock = threading.Lock()
+
+    def start(self):
+        self.handler = _PerThreadMemoryHandler(self.logformat,
+                                               self.logdatefmt, self.filters)
+        self.setupLoghandler()
+
+    def beforeTest(self, test):
+        # setupLoghandler takes the handler off the root logger for a
+        # moment, losing the records of the tests already running
+        with self._setup_lock:
+            if self.handler not in logging.getLogger().handlers:
+                self.setupLoghandler()
+        self.handler.truncate()
+
+
+def _capture_per_thread(plugins):
+    """Switch nose's output and log capture plugins among `plugins` to
+    their per-thread versions, for runs with tests on several threads."""
+    # nose's NoPlugins (no plugin manager) is not iterable
+    for plugin in getattr(plugins, 'plugins', ()):
+        if type(plugin) is Capture:
+            plugin.__class__ = _PerThreadCapture
+        elif type(plugin) is LogCapture:
+            plugin.__class__ = _PerThreadLogCapture
+
+
+def _locked_result_proxy(factory, lock):
+    def proxy(result, test):
+        if factory is not None:
+            result = factory(result, test)
+        return _LockedResult(result, lock)
+    return proxy
+
+
+class BrowserMatrixSuite(unittest.TestSuite):
+    """Copies of one test, one per BrowserCombination, run concurrently
+    on up to `max_threads` threads (default the MAX_BROWSERS of
+    current_config(), or one per copy if that is 0)."""
+
+    def __init__(self, tests=(), lock=None, max_threads=None):
+        unittest.TestSuite.__init__(self, tests)
+        self.lock = lock or _RESULT_LOCK
+        self.max_threads = max_threads
+
+    def _run_test(self, test, result, worker):
+        # copies share the sessions of the --threads worker running them
+        _test_context.worker = worker
+        if isinstance(test, NoseTest):
+            # its result proxy takes the lock
+            test(result)
+        else:
+            test(_LockedResult(result, self.lock))
+
+    def _run_tests(self, tests, result, worker):
+        while True:
+            try:
+                test = tests.get_nowait()
+            except Empty:
+                return
+            self._run_test(test, result, worker)
+
+    def run(self, result):
+        tests = Queue()
+        for test in self:
+            tests.put(test)
+        size = min(tests.qsize(), self.max_threads or
+                   current_config().MAX_BROWSERS or tests.qsize())
+        threads = []
+        worker = getattr(_test_context, 'worker', '')
+        for number in range(size):
+            thread = threading.Thread(target=self._run_tests,
+                                      args=(tests, result, worker))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return result
+
+
+def _matrix_copy(test, combination, lock):
+    case = getattr(test, 'test', test)
+    copy = case.__class__(case._testMethodName)
+    copy.browser_combination = combination
+    if isinstance(test, NoseTest):
+        return NoseTest(copy, config=test.config, resultProxy=_locked_result_proxy(
+            test.resultProxy, lock))
+    return copy
+
+
+def expand_browser_matrix(suite, combinations):
+    """Replace every SeleniumTestCase in a test suite, in place, by a
+    BrowserMatrixSuite running it once per BrowserCombination."""
+    if not isinstance(suite, unittest.TestSuite):
+        return
+    expanded = []
+    for test in list(suite):
+        if isinstance(getattr(test, 'test', test), SeleniumTestCase):
+            test = BrowserMatrixSuite(
+                [_matrix_copy(test, combination, _RESULT_LOCK)
+                 for combination in combinations], _RESULT_LOCK)
+        else:
+            expand_browser_matrix(test, combinations)
+        expanded.append(test)
+    suite._tests = expanded
+
+
+class TestThreads(object):
+    """A fixed set of worker threads running tests handed to them by
+    ThreadedSuites. Each worker keeps its own reused sessions (see
+    acquire_webdriver), so no session is used by two tests at once."""
+
+    def __init__(self, size):
+        self.size = size
+        self._queue = Queue()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.size):
+            thread = threading.Thread(target=self._work, args=(number + 1,),
+                                      name='selenium-worker-%d' % (number + 1))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self, number):
+        _test_context.worker = 'worker-%d' % number
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            test, result, done = job
+            try:
+                test(result)
+            except Exception as e:
+                # tests report their own errors, this is a bug in a wrapper
+                logger.error("Error running %s: %s" % (test, e))
+            finally:
+                done.set()
+
+    def run(self, tests, result):
+        """Run tests on the workers and wait for all of them."""
+        jobs = []
+        for test in tests:
+            done = threading.Event()
+            self._queue.put((test, result, done))
+            jobs.append(done)
+        for done in jobs:
+            done.wait()
+
+    def stop(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+_TEST_THREADS = None
+
+
+def start_test_threads(size):
+    """Start the workers --threads runs SeleniumTestCases on."""
+    global _TEST_THREADS
+    if _TEST_THREADS is None or _TEST_THREADS.size != size:
+        stop_test_threads()
+        _TEST_THREADS = TestThreads(size)
+        _TEST_THREADS.start()
+    return _TEST_THREADS
+
+
+def stop_test_threads():
+    global _TEST_THREADS
+    if _TEST_THREADS is not None:
+        _TEST_THREADS.stop()
+        _TEST_THREADS = None
+
+
+class ThreadedSuite(unittest.TestSuite):
+    """Tests run concurrently by TestThreads, reporting their results
+    under a lock."""
+
+    def __init__(self, tests=(), threads=None, lock=None):
+        unittest.TestSuite.__init__(self, tests)
+        self.threads = threads
+        self.lock = lock or _RESULT_LOCK
+
+    def run(self, result):
+        if not isinstance(result, _LockedResult):
+            result = _LockedResult(result, self.lock)
+        self.threads.run(list(self), result)
+        return result
+
+
+def _threaded(test, lock):
+    if isinstance(test, NoseTest):
+        test.resultProxy = _locked_result_proxy(test.resultProxy, lock)
+    return test
+
+
+def run_in_threads(suite, threads):
+    """Rearrange a test suite, in place, so that SeleniumTestCases next
+    to each other run at the same time on TestThreads. Other tests, and
+    the setup and teardown of classes and modules, still run in order
+    on the main thread."""
+    if (not isinstance(suite, unittest.TestSuite) or
+            isinstance(suite, ThreadedSuite)):
+        return
+    tests = []
+    batch = []
+    for test in list(suite):
+        if (isinstance(test, BrowserMatrixSuite) or
+                isinstance(getattr(test, 'test', test), SeleniumTestCase)):
+            batch.append(_threaded(test, _RESULT_LOCK))
+            continue
+        if batch:
+            tests.append(ThreadedSuite(batch, threads))
+            batch = []
+        run_in_threads(test, threads)
+        tests.append(test)
+    if batch:
+        tests.append(ThreadedSuite(batch, threads))
+    suite._tests = tests
+
+
+def _new_webdriver(capabilities=None, combination=None):
+    if combination is not None:
+        return build_webdriver(capabilities=capabilities,
+                               combination=combination)
+    if capabilities:
+        # the pool only holds sessions with the default capabilities
+        return build_webdriver(capabilities=capabilities)
+    if _POOL is not None:
+        return _POOL.checkout()
+    return build_webdriver()
+
+
+def _pooled(wd):
+    return (_POOL is not None and
+            not getattr(wd, '_nose_selenium_capabilities', '') and
+            getattr(wd, '_nose_selenium_combination', None) is None)
+
+
+# sessions kept alive between tests, keyed by
+# (scope, owner, capabilities, browser combination)
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.RLock()
+
+
+def _session_key(scope, test_class, capabilities=None, combination=None):
+    if scope == 'class':
+        owner = ('class', test_class)
+    elif scope == 'module':
+        owner = ('module', test_class.__module__)
+    elif scope == 'run':
+        owner = ('run', None)
+    else:
+        raise TypeError("session scope %s not found" % scope)
+    return owner + (capability_key(capabilities),
+                    combination and combination.name or '',
+                    getattr(_test_context, 'worker', ''))
+
+
+def reset_webdriver(wd):
+    """Return a reused session to a clean state: drop cookies and
+    web storage, close extra windows and load about:blank."""
+    wd.delete_all_cookies()
+    wd.execute_script(
+        "try { window.localStorage.clear(); } catch (e) {}"
+        "try { window.sessionStorage.clear(); } catch (e) {}")
+    handles = wd.window_handles
+    if len(handles) > 1:
+        for handle in handles[1:]:
+            wd.switch_to_window(handle)
+            wd.close()
+        wd.switch_to_window(handles[0])
+    wd.get('about:blank')
+
+
+def _quit_webdriver(wd):
+    try:
+        wd.quit()
+    except Exception as e:
+        logger.warning("Error quitting WebDriver session: %s" % e)
+
+
+def session_alive(wd):
+    """Cheap liveness probe: one round trip asking for the current URL."""
+    try:
+        if isinstance(wd, ScreenshotOnExceptionWebDriver):
+            # a dead session has no failure artifacts to save
+            wd._execute(Command.GET_CURRENT_URL, None)
+        else:
+            wd.current_url
+        return True
+    except Exception as e:
+        logger.warning("WebDriver session failed liveness probe: %s" % e)
+        return False
+
+
+class SessionRecycler(object):
+    """Lifecycle policy for sessions that serve more than one test. A
+    session is retired once it has served the SESSION_MAX_USES tests, or
+    is older than the SESSION_MAX_AGE seconds, of the config it was built
+    with, or fails session_alive; the reasons are counted for the plugin
+    report."""
+
+    def __init__(self):
+        self.reasons = {}
+        self._lock = threading.Lock()
+
+    def handed_out(self, wd):
+        """Count one more test served by `wd` and return it."""
+        if getattr(wd, '_nose_selenium_born', None) is None:
+            wd._nose_selenium_born = time.time()
+        wd._nose_selenium_uses = getattr(wd, '_nose_selenium_uses', 0) + 1
+        return wd
+
+    def retire_reason(self, wd, probe=True):
+        """Return why `wd` must not serve another test, or None."""
+        config = _config_of(wd)
+        uses = getattr(wd, '_nose_selenium_uses', 0)
+        if config.SESSION_MAX_USES and uses >= config.SESSION_MAX_USES:
+            return 'max-uses'
+        born = getattr(wd, '_nose_selenium_born', None)
+        if (config.SESSION_MAX_AGE and born is not None and
+                time.time() - born >= config.SESSION_MAX_AGE):
+            return 'max-age'
+        # sessions fresh from build_webdriver are known to be alive
+        if probe and uses and not session_alive(wd):
+            return 'dead'
+        return None
+
+    def record(self, reason):
+        with self._lock:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def report(self, stream):
+        with self._lock:
+            reasons = sorted(self.reasons.items())
+        if not reasons:
+            return
+        stream.writeln("nose-selenium recycled %d sessions: %s" % (
+            sum(count for reason, count in reasons),
+            ", ".join("%d %s" % (count, reason) for reason, count in reasons)))
+
+
+_RECYCLER = SessionRecycler()
+
+
+class _SessionReplacement(object):
+    """A session booting on a background thread, to take over from a
+    reused session that has served its last test."""
+
+    def __init__(self, capabilities, combination):
+        self.wd = None
+        self.error = None
+        self._done = threading.Event()
+        thread = threading.Thread(target=self._boot,
+                                  args=(capabilities, combination))
+        thread.daemon = True
+        thread.start()
+
+    def _boot(self, capabilities, combination):
+        try:
+            self.wd = _new_webdriver(capabilities, combination)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def result(self):
+        """Wait for the session and return it, or None if it failed to
+        start."""
+        self._done.wait()
+        if self.error is not None:
+            logger.warning("Error starting replacement WebDriver session: %s"
+                           % self.error)
+        return self.wd
+
+
+# replacements booting for the sessions in _SESSIONS under the same key
+_REPLACEMENTS = {}
+
+
+def _close_replacement(replacement):
+    wd = replacement.result()
+    if wd is not None:
+        _return_webdriver(wd)
+
+
+def acquire_webdriver(scope='test', test_class=None, combination=None):
+    """Return a WebDriver for a test, with the desired_capabilities of
+    test_class if it has any, for a BrowserCombination if one is given.
+    For any scope other than 'test' the session is reused (after
+    reset_webdriver) until its class, module or the run is finished, or
+    SessionRecycler retires it. A session handed out for the last of its
+    SESSION_MAX_USES has its replacement boot in the background."""
+    capabilities = getattr(test_class, 'desired_capabilities', None)
+    if scope == 'test':
+        return _RECYCLER.handed_out(_new_webdriver(capabilities, combination))
+
+    key = _session_key(scope, test_class, capabilities, combination)
+    with _SESSIONS_LOCK:
+        if scope == 'run' and current_config().GROUP_BY_CAPABILITIES:
+            # grouped tests never come back to an earlier capability set
+            for other in list(_SESSIONS):
+                if (other[0] == 'run' and other[2] != key[2] and
+                        other[3:] == key[3:]):
+                    _return_webdriver(_SESSIONS.pop(other))
+                    if other in _REPLACEMENTS:
+                        _close_replacement(_REPLACEMENTS.pop(other))
+        wd = _SESSIONS.get(key)
+    # only the thread a key belongs to uses its session, so talking to
+    # the browser happens outside the lock
+    if wd is not None:
+        reason = _RECYCLER.retire_reason(wd)
+        if reason is None:
+            try:
+                reset_webdriver(wd)
+                return _handed_out(key, wd, capabilities, combination)
+            except WebDriverException as e:
+                logger.warning("Discarding unusable session: %s" % e)
+                reason = 'reset-failed'
+        _RECYCLER.record(reason)
+        with _SESSIONS_LOCK:
+            _SESSIONS.pop(key, None)
+        _dispose_webdriver(wd, wait=False)
+    with _SESSIONS_LOCK:
+        replacement = _REPLACEMENTS.pop(key, None)
+    wd = replacement and replacement.result()
+    if wd is None:
+        wd = _new_webdriver(capabilities, combination)
+    with _SESSIONS_LOCK:
+        _SESSIONS[key] = wd
+    return _handed_out(key, wd, capabilities, combination)
+
+
+def _handed_out(key, wd, capabilities, combination):
+    _RECYCLER.handed_out(wd)
+    if _RECYCLER.retire_reason(wd, probe=False) == 'max-uses':
+        # served its last test: have the next session ready by the time
+        # this test is over
+        with _SESSIONS_LOCK:
+            if key not in _REPLACEMENTS:
+                _REPLACEMENTS[key] = _SessionReplacement(capabilities,
+                                                         combination)
     return wd
 
 
+def _dispose_webdriver(wd, wait=True):
+    if _pooled(wd):
+        # the pool boots the replacement in the background
+        _POOL.discard(wd)
+    elif wait:
+        _quit_webdriver(wd)
+    else:
+        # don't hold up the next test while a stale session shuts down
+        thread = threading.Thread(target=_quit_webdriver, args=(wd,))
+        thread.daemon = True
+        thread.start()
+
+
+def _return_webdriver(wd):
+    if _pooled(wd):
+        _POOL.checkin(wd)
+    else:
+        _quit_webdriver(wd)
+
+
+def release_webdriver(wd):
+    """Hand a WebDriver back after a test. Sessions that are not being
+    reused go back to the pool, or are quit when there is no pool."""
+    with _SESSIONS_LOCK:
+        if wd in _SESSIONS.values():
+            return
+    if _pooled(wd):
+        _POOL.checkin(wd)
+    else:
+        wd.quit()
+
+
+def discard_webdriver(wd):
+    """Quit a WebDriver and make sure it is never handed out again."""
+    _RECYCLER.record('discarded')
+    with _SESSIONS_LOCK:
+        for key, session in list(_SESSIONS.items()):
+            if session is wd:
+                del _SESSIONS[key]
+    _dispose_webdriver(wd)
+
+
+def close_webdriver_sessions(context=None):
+    """Quit reused sessions belonging to a test class or module, or all
+    of them when no context is given."""
+    if context is None:
+        owner = None
+    elif inspect.isclass(context):
+        owner = ('class', context)
+    elif inspect.ismodule(context):
+        owner = ('module', context.__name__)
+    else:
+        return
+    with _SESSIONS_LOCK:
+        for key, wd in list(_SESSIONS.items()):
+            if owner is None or key[:2] == owner:
+                del _SESSIONS[key]
+                _return_webdriver(wd)
+        replacements = []
+        for key in list(_REPLACEMENTS):
+            if owner is None or key[:2] == owner:
+                replacements.append(_REPLACEMENTS.pop(key))
+    for replacement in replacements:
+        _close_replacement(replacement)
+
+# atexit runs these last first, so sessions quit before their service stops
+# and profile clones are removed
+atexit.register(remove_firefox_profile_clones)
+atexit.register(stop_local_driver_services)
+atexit.register(stop_webdriver_pool)
+atexit.register(close_webdriver_sessions)
+
+
 class SeleniumTestCase(TestCase):
 
+    # one of VALID_SESSION_SCOPES, defaults to SESSION_SCOPE
+    session_scope = None
+    # quit a reused session when a test using it fails or errors
+    new_session_on_failure = True
+    # added to (and overriding) the desired capabilities for BROWSER
+    desired_capabilities = None
+    # set on the copies of each test made for a browser matrix
+    browser_combination = None
+
+    @classmethod
+    def tearDownClass(cls):
+        close_webdriver_sessions(cls)
+
+    def _get_session_scope(self):
+        return (self.session_scope or current_config().SESSION_SCOPE or
+                'test')
+
     def setUp(self):
-        self.wd = build_webdriver()
+        # seconds spent in each of PhaseTimings.PHASES
+        self.phase_timings = {}
+        _test_context.phases = self.phase_timings
+        start = time.time()
+        self.wd = acquire_webdriver(self._get_session_scope(), self.__class__,
+                                    self.browser_combination)
+        self._body_start = time.time()
+        self.phase_timings['session'] = (
+            self._body_start - start - self.phase_timings.get('configure', 0.0))
 
     def tearDown(self):
-        self.wd.quit()
+        start = time.time()
+        self.phase_timings['body'] = start - self._body_start
+        if self.wd is not None and self._get_session_scope() == 'test':
+            release_webdriver(self.wd)
+            self.wd = None
+        self.phase_timings['teardown'] = time.time() - start
+        _test_context.phases = None
+
+    def query_elements(self, queries):
+        """Read properties of many elements of self.wd in a single round
+        trip, see nose_selenium.query_elements."""
+        return query_elements(self.wd, queries)
+
+    def id(self):
+        test_id = super(SeleniumTestCase, self).id()
+        if self.browser_combination is not None:
+            test_id += '[%s]' % self.browser_combination.name
+        return test_id
+
+    def __str__(self):
+        text = super(SeleniumTestCase, self).__str__()
+        if self.browser_combination is not None:
+            text += ' [%s]' % self.browser_combination.name
+        return text
 
+    def discard_session(self):
+        """Quit this test's session so the next test gets a fresh one."""
+        if getattr(self, 'wd', None) is not None:
+            discard_webdriver(self.wd)
+            self.wd = None
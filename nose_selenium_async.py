@@ -0,0 +1,748 @@
+"""Driving many WebDriver sessions from one thread.
+
+AsyncWebDriver runs sessions on the remote, grid or sauce executor from an
+EventLoop. Its commands are coroutines: generators that yield a command
+(or another coroutine, or a list of them to run side by side) and get its
+result back, and finish with `raise Return(value)`.
+"""
+import base64
+import errno
+import heapq
+import itertools
+import os
+import select
+import socket
+import string
+import sys
+import threading
+import time
+import types
+import urlparse
+from collections import deque
+from json import dumps, loads
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.errorhandler import ErrorHandler
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+from unittest2 import TestCase
+import nose_selenium
+from nose_selenium import _IDEMPOTENT_METHODS, _UNCAPTURED_COMMANDS, \
+    _browser_slots, _command_executor, _config_of, _grid_scheduler, \
+    _queue_failure_artifacts, _session_priority, current_config, logger
+
+
+class Return(Exception):
+    """Raised by a coroutine to hand back its result, since generators
+    can't return a value."""
+
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+
+class Future(object):
+    """The result of something an EventLoop is waiting for: a value, or
+    the sys.exc_info() of an error."""
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.error = None
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def set_result(self, value):
+        self.done = True
+        self.value = value
+        self._run_callbacks()
+
+    def set_error(self, error):
+        self.done = True
+        self.error = error
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def result(self):
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+
+class Task(Future):
+    """Runs a coroutine: a generator that yields a Future, another
+    coroutine or a list of them, is sent back their result (or has their
+    error thrown into it), and finishes with `raise Return(value)`. A bare
+    `yield` lets other tasks run."""
+
+    def __init__(self, loop, coroutine):
+        Future.__init__(self)
+        self.loop = loop
+        self._stack = [coroutine]
+        loop.call_soon(self._step, None, None)
+
+    def _step(self, value, error):
+        while self._stack:
+            coroutine = self._stack[-1]
+            try:
+                if error is not None:
+                    yielded = coroutine.throw(*error)
+                else:
+                    yielded = coroutine.send(value)
+            except Return as e:
+                self._stack.pop()
+                value, error = e.value, None
+                continue
+            except StopIteration:
+                self._stack.pop()
+                value, error = None, None
+                continue
+            except Exception:
+                self._stack.pop()
+                value, error = None, sys.exc_info()
+                continue
+            value = error = None
+            if yielded is None:
+                # let the other tasks have a turn
+                self.loop.call_soon(self._step, None, None)
+                return
+            if isinstance(yielded, types.GeneratorType):
+                self._stack.append(yielded)
+                continue
+            if isinstance(yielded, (list, tuple)):
+                yielded = gather(self.loop, yielded)
+            if not isinstance(yielded, Future):
+                try:
+                    raise TypeError("coroutines yield a Future, a coroutine "
+                                    "or a list of them, not %r" % (yielded,))
+                except TypeError:
+                    error = sys.exc_info()
+                continue
+            yielded.add_done_callback(self._resume)
+            return
+        if error is not None:
+            self.set_error(error)
+        else:
+            self.set_result(value)
+
+    def _resume(self, future):
+        self.loop.call_soon(self._step, future.value, future.error)
+
+
+def gather(loop, items):
+    """A Future for the list of results of Futures and coroutines,
+    finished once all of them are. If any of them failed it has the
+    error of the first one."""
+    futures = [isinstance(item, types.GeneratorType) and Task(loop, item)
+               or item for item in items]
+    gathered = Future()
+    remaining = [len(futures)]
+
+    def finished(future):
+        remaining[0] -= 1
+        if remaining[0]:
+            return
+        for future in futures:
+            if future.error is not None:
+                gathered.set_error(future.error)
+                return
+        gathered.set_result([future.value for future in futures])
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(finished)
+    return gathered
+
+
+class EventLoop(object):
+    """Runs Tasks and waits on sockets with select(), so one thread can
+    keep many WebDriver commands in flight."""
+
+    # seconds between checks for calls finished by run_in_thread
+    THREAD_POLL = 0.01
+
+    def __init__(self):
+        self._ready = deque()
+        self._timers = []
+        self._counter = itertools.count()
+        self._readers = {}
+        self._writers = {}
+        self._threads = 0
+        self._finished = deque()
+
+    def call_soon(self, callback, *args):
+        self._ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """Call back after `delay` seconds; returns a handle for
+        cancel_timer()."""
+        timer = [time.time() + delay, next(self._counter), callback, args]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def cancel_timer(self, timer):
+        timer[2] = None
+
+    def sleep(self, seconds):
+        future = Future()
+        self.call_later(seconds, future.set_result, None)
+        return future
+
+    def add_reader(self, sock, callback):
+        self._readers[sock.fileno()] = callback
+
+    def remove_reader(self, sock):
+        self._readers.pop(sock.fileno(), None)
+
+    def add_writer(self, sock, callback):
+        self._writers[sock.fileno()] = callback
+
+    def remove_writer(self, sock):
+        self._writers.pop(sock.fileno(), None)
+
+    def spawn(self, coroutine):
+        return Task(self, coroutine)
+
+    def run_in_thread(self, function, *args):
+        """A Future for function(*args), called on a thread of its own,
+        for the blocking calls a coroutine can't avoid."""
+        future = Future()
+
+        def run():
+            try:
+                result = (function(*args), None)
+            except Exception:
+                result = (None, sys.exc_info())
+            self._finished.append((future, result))
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        self._threads += 1
+        thread.start()
+        return future
+
+    def _run_once(self):
+        timeout = None
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, self._timers[0][0] - time.time())
+        if self._threads and (timeout is None or timeout > self.THREAD_POLL):
+            timeout = self.THREAD_POLL
+        if self._readers or self._writers:
+            readable, writable, _ = select.select(
+                list(self._readers), list(self._writers), [], timeout)
+            for fd in readable:
+                self._ready.append((self._readers[fd], ()))
+            for fd in writable:
+                self._ready.append((self._writers[fd], ()))
+        elif timeout:
+            time.sleep(timeout)
+        while self._finished:
+            future, (value, error) = self._finished.popleft()
+            self._threads -= 1
+            if error is not None:
+                self._ready.append((future.set_error, (error,)))
+            else:
+                self._ready.append((future.set_result, (value,)))
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)
+            if timer[2] is not None:
+                self._ready.append((timer[2], timer[3]))
+        for i in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            callback(*args)
+
+    def run(self, coroutine):
+        """Run a coroutine (or a Future, or a list of them) and everything
+        it waits for, and return its result."""
+        if isinstance(coroutine, types.GeneratorType):
+            future = self.spawn(coroutine)
+        elif isinstance(coroutine, (list, tuple)):
+            future = gather(self, coroutine)
+        else:
+            future = coroutine
+        while not future.done:
+            if not (self._ready or self._timers or self._readers or
+                    self._writers or self._threads):
+                raise RuntimeError("nothing left to run, the Future "
+                                   "can never finish")
+            self._run_once()
+        return future.result()
+
+
+class AsyncHTTPConnection(object):
+    """A keep-alive HTTP/1.1 connection to a WebDriver server, driven by
+    an EventLoop and used for one request at a time."""
+
+    def __init__(self, loop, url, timeout=None):
+        parsed_url = urlparse.urlparse(url)
+        if parsed_url.scheme not in ('', 'http'):
+            raise TypeError("asynchronous sessions only speak http, not %s" %
+                            parsed_url.scheme)
+        self.loop = loop
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+        self.path = parsed_url.path.rstrip('/')
+        self.timeout = timeout
+        self.authorization = None
+        if parsed_url.username:
+            self.authorization = 'Basic ' + base64.b64encode('%s:%s' % (
+                parsed_url.username, parsed_url.password))
+        self.connects = 0
+        self._sock = None
+        self._future = None
+
+    def request(self, method, path, body=''):
+        """Send a request for `path` (below the url's own path) and return
+        a Future for (status, headers, body)."""
+        if self._future is not None:
+            raise TypeError("AsyncHTTPConnection sends one request at a time")
+        lines = ['%s %s HTTP/1.1' % (method, self.path + path),
+                 'Host: %s:%d' % (self.host, self.port),
+                 'Connection: keep-alive',
+                 'Accept: application/json',
+                 'Content-Type: application/json;charset=UTF-8',
+                 'Content-Length: %d' % len(body)]
+        if self.authorization:
+            lines.append('Authorization: %s' % self.authorization)
+        self._request = '\r\n'.join(lines) + '\r\n\r\n' + body
+        self._method = method
+        self._future = future = Future()
+        self._timer = None
+        if self.timeout:
+            self._timer = self.loop.call_later(self.timeout, self._timed_out)
+        if self._sock is not None and self._closed_by_server():
+            self.close()
+        self._retried = False
+        self._send()
+        return future
+
+    def _closed_by_server(self):
+        # an idle connection has nothing to read until the server closes it
+        try:
+            return bool(select.select([self._sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _send(self):
+        self._out = self._request
+        self._sent = 0
+        self._in = ''
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setblocking(0)
+            self.connects += 1
+            code = self._sock.connect_ex((self.host, self.port))
+            if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                return self._failed(socket.error(code, os.strerror(code)))
+        self.loop.add_writer(self._sock, self._writable)
+
+    def _writable(self):
+        try:
+            code = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if code:
+                raise socket.error(code, os.strerror(code))
+            sent = self._sock.send(self._out)
+        except socket.error as e:
+            return self._failed(e)
+        self._sent += sent
+        self._out = self._out[sent:]
+        if not self._out:
+            self.loop.remove_writer(self._sock)
+            self.loop.add_reader(self._sock, self._readable)
+
+    def _readable(self):
+        try:
+            data = self._sock.recv(65536)
+        except socket.error as e:
+            return self._failed(e)
+        if not data:
+            response = self._parse(eof=True)
+            if response is None:
+                return self._failed(socket.error(
+                    errno.ECONNRESET, "connection closed by the server"))
+        else:
+            self._in += data
+            response = self._parse()
+            if response is None:
+                return
+        self._stop_waiting()
+        if self._timer is not None:
+            self.loop.cancel_timer(self._timer)
+        if not data or response[1].get('connection', '').lower() == 'close':
+            self.close()
+        self._future, future = None, self._future
+        future.set_result(response)
+
+    def _parse(self, eof=False):
+        head_end = self._in.find('\r\n\r\n')
+        if head_end < 0:
+            return None
+        head = self._in[:head_end].split('\r\n')
+        status = int(head[0].split()[1])
+        headers = {}
+        for line in head[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = self._in[head_end + 4:]
+        if 'content-length' in headers:
+            length = int(headers['content-length'])
+            if len(body) < length:
+                return None
+            return status, headers, body[:length]
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = _dechunk(body)
+            if body is None:
+                return None
+            return status, headers, body
+        # no length given, the body ends with the connection
+        if not eof:
+            return None
+        return status, headers, body
+
+    def _stop_waiting(self):
+        if self._sock is not None:
+            self.loop.remove_reader(self._sock)
+            self.loop.remove_writer(self._sock)
+
+    def _failed(self, error):
+        self._stop_waiting()
+        self.close()
+        # try once more on a fresh connection, but only when the server
+        # can't have acted on the request already: nothing of it was sent,
+        # or sending it twice does no harm
+        if not self._retried and (self._sent == 0 or
+                                  self._method in _IDEMPOTENT_METHODS):
+            self._retried = True
+            return self._send()
+        if self._timer is not None:
+            self.loop.cancel_timer(self._timer)
+        self._future, future = None, self._future
+        try:
+            raise error
+        except socket.error:
+            future.set_error(sys.exc_info())
+
+    def _timed_out(self):
+        self._timer = None
+        self._retried = True
+        self._failed(socket.timeout("timed out"))
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _dechunk(body):
+    """The body of a chunked response, or None until all of it is in."""
+    chunks = []
+    while True:
+        line_end = body.find('\r\n')
+        if line_end < 0:
+            return None
+        size = int(body[:line_end].split(';')[0], 16)
+        if size == 0:
+            if body.find('\r\n', line_end + 2) < 0:
+                return None
+            return ''.join(chunks)
+        start = line_end + 2
+        if len(body) < start + size + 2:
+            return None
+        chunks.append(body[start:start + size])
+        body = body[start + size + 2:]
+
+
+def _wire_response(status, headers, body):
+    """Turn an HTTP response into the dictionary selenium's
+    RemoteConnection would return for it."""
+    body = body.decode('utf-8').replace('\x00', '').strip()
+    if 399 < status <= 500:
+        return {'status': status, 'value': body}
+    try:
+        return loads(body)
+    except ValueError:
+        if 199 < status < 300:
+            return {'status': 0, 'value': body}
+        return {'status': 13, 'value': body}
+
+
+class AsyncWebElement(object):
+    """An element found by an AsyncWebDriver; its methods are
+    coroutines."""
+
+    def __init__(self, parent, id_):
+        self.parent = parent
+        self.id = id_
+
+    def click(self):
+        return self.parent.execute(Command.CLICK_ELEMENT, {'id': self.id})
+
+    def send_keys(self, *value):
+        return self.parent.execute(Command.SEND_KEYS_TO_ELEMENT, {
+            'id': self.id, 'value': list(''.join(value))})
+
+    def text(self):
+        return self.parent.execute(Command.GET_ELEMENT_TEXT, {'id': self.id})
+
+    def get_attribute(self, name):
+        return self.parent.execute(Command.GET_ELEMENT_ATTRIBUTE,
+                                   {'id': self.id, 'name': name})
+
+    def is_displayed(self):
+        return self.parent.execute(Command.IS_ELEMENT_DISPLAYED,
+                                   {'id': self.id})
+
+
+class AsyncWebDriver(object):
+    """A session on a remote, grid or sauce server driven from an
+    EventLoop, so one thread can run commands on many sessions at once.
+    It speaks the same JSON wire protocol as ScreenshotOnExceptionWebDriver
+    (through the command table of its RemoteConnection, and selenium's
+    error handler) and, like it, saves a screenshot and the html when a
+    command fails. Its methods are coroutines: `title = yield wd.title()`.
+    `command_executor` is a URL or a RemoteConnection, whose URL the
+    session's own keep-alive connection goes to.
+    """
+
+    def __init__(self, loop, command_executor, timeout=None):
+        if isinstance(command_executor, basestring):
+            command_executor = RemoteConnection(command_executor,
+                                                resolve_ip=False)
+        self.loop = loop
+        self.command_executor = command_executor
+        self.executor = command_executor._url
+        self.session_id = None
+        self.capabilities = None
+        self.error_handler = ErrorHandler()
+        self._connection = AsyncHTTPConnection(loop, self.executor, timeout)
+        # released when the session is quit
+        self._slot = None
+
+    def start_session(self, desired_capabilities):
+        response = yield self._request(Command.NEW_SESSION, {
+            'desiredCapabilities': desired_capabilities})
+        self.session_id = response['sessionId']
+        self.capabilities = response['value']
+        # sometimes what goes out != what goes in, so log it
+        logger.info("actual capabilities: %s" % self.capabilities)
+
+    def _wrap(self, value):
+        if isinstance(value, AsyncWebElement):
+            return {'ELEMENT': value.id}
+        if isinstance(value, (list, tuple)):
+            return [self._wrap(item) for item in value]
+        if isinstance(value, dict):
+            return dict((key, self._wrap(item)) for key, item in value.items())
+        return value
+
+    def _unwrap(self, value):
+        if isinstance(value, dict):
+            if 'ELEMENT' in value:
+                return AsyncWebElement(self, value['ELEMENT'])
+            return dict((key, self._unwrap(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [self._unwrap(item) for item in value]
+        return value
+
+    def _request(self, command, params=None):
+        params = self._wrap(dict(params or {}))
+        if self.session_id is not None:
+            params['sessionId'] = self.session_id
+        method, path = self.command_executor._commands[command]
+        path = string.Template(path).substitute(params)
+        body = dumps(params) if method in ('POST', 'PUT') else ''
+        status, headers, body = yield self._connection.request(method, path, body)
+        response = _wire_response(status, headers, body)
+        self.error_handler.check_response(response)
+        raise Return(response)
+
+    def execute(self, command, params=None):
+        """Run a command and return its unwrapped value."""
+        start = time.time()
+        try:
+            response = yield self._request(command, params)
+        except WebDriverException:
+            error = sys.exc_info()
+        else:
+            error = None
+        stats = nose_selenium._COMMAND_STATS
+        if stats is not None:
+            stats.record(command, time.time() - start)
+        if error is not None:
+            if command not in _UNCAPTURED_COMMANDS:
+                yield self.save_failure_artifacts(command)
+            raise error[0], error[1], error[2]
+        raise Return(self._unwrap(response.get('value')))
+
+    def save_failure_artifacts(self, command=None):
+        """See nose_selenium.save_failure_artifacts."""
+        config = _config_of(self)
+        if not config.SAVED_FILES_PATH:
+            return
+        try:
+            screenshot = yield self.execute(Command.SCREENSHOT)
+            html = yield self.execute(Command.GET_PAGE_SOURCE)
+            url = yield self.execute(Command.GET_CURRENT_URL)
+        except WebDriverException as e:
+            logger.error("Could not save failure artifacts: %s" % e)
+            return
+        _queue_failure_artifacts(screenshot, html, url, command, config)
+
+    def implicitly_wait(self, seconds):
+        return self.execute(Command.IMPLICIT_WAIT, {'ms': float(seconds) * 1000})
+
+    def get(self, url):
+        return self.execute(Command.GET, {'url': url})
+
+    def title(self):
+        return self.execute(Command.GET_TITLE)
+
+    def current_url(self):
+        return self.execute(Command.GET_CURRENT_URL)
+
+    def page_source(self):
+        return self.execute(Command.GET_PAGE_SOURCE)
+
+    def get_screenshot_as_base64(self):
+        return self.execute(Command.SCREENSHOT)
+
+    def execute_script(self, script, *args):
+        return self.execute(Command.EXECUTE_SCRIPT,
+                            {'script': script, 'args': list(args)})
+
+    def find_element(self, by, value):
+        return self.execute(Command.FIND_ELEMENT, {'using': by, 'value': value})
+
+    def find_elements(self, by, value):
+        return self.execute(Command.FIND_ELEMENTS, {'using': by, 'value': value})
+
+    def quit(self):
+        try:
+            yield self.execute(Command.QUIT)
+        finally:
+            self.session_id = None
+            self._connection.close()
+            self._release_slot()
+
+    def _release_slot(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            slot.release()
+
+
+def start_async_session(loop, capabilities=None, config=None, name="",
+                        tags=[], public=False):
+    """Coroutine starting an AsyncWebDriver on the remote, grid or sauce
+    executor of `config` (default current_config()), with the desired
+    capabilities build_webdriver would ask for. Like build_webdriver it
+    waits for a browser slot if MAX_BROWSERS is set and goes through the
+    grid scheduler if GRID_MAX_PENDING is; the waiting is done on other
+    threads, so the loop's other sessions carry on meanwhile."""
+    if config is None:
+        config = current_config()
+    if config.BROWSER_LOCATION == 'local':
+        raise TypeError("asynchronous sessions need a remote, grid or "
+                        "sauce browser location")
+    wd = AsyncWebDriver(loop, _command_executor(config.executor, config),
+                        config.HTTP_TIMEOUT or None)
+    wd._nose_selenium_config = config
+    slots = _browser_slots(config)
+    if slots is not None:
+        wd._slot = yield loop.run_in_thread(slots.acquire)
+    try:
+        scheduler = _grid_scheduler(config)
+        if scheduler is not None:
+            yield loop.run_in_thread(scheduler.acquire, _session_priority())
+        try:
+            yield wd.start_session(config.capabilities(None, capabilities,
+                                                       name, tags, public))
+        finally:
+            if scheduler is not None:
+                scheduler.release()
+    except:
+        wd._release_slot()
+        raise
+    wd._nose_selenium_born = time.time()
+    if config.WAIT_MODE == 'explicit':
+        yield wd.implicitly_wait(0)
+    else:
+        yield wd.implicitly_wait(config.TIMEOUT)
+    raise Return(wd)
+
+
+def run_coroutines(coroutines, concurrency=None, loop=None):
+    """Run coroutines on one EventLoop, at most `concurrency` of them at
+    once, and return their results in order. If any of them raised, the
+    first error is raised again once all of them have finished."""
+    if loop is None:
+        loop = EventLoop()
+    coroutines = list(coroutines)
+    results = [None] * len(coroutines)
+    errors = []
+    pending = iter(enumerate(coroutines))
+
+    def worker():
+        for index, coroutine in pending:
+            try:
+                results[index] = yield coroutine
+            except Exception as e:
+                logger.error("Coroutine %d failed: %s" % (index, e))
+                errors.append(sys.exc_info())
+
+    workers = min(concurrency or len(coroutines), len(coroutines))
+    loop.run([worker() for i in range(workers)])
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+
+class AsyncSeleniumTestCase(TestCase):
+    """A TestCase that drives many sessions from one thread. Its test
+    methods hand coroutines to self.run_coroutines(), which start their
+    sessions with `wd = yield self.new_session()`. Sessions still open
+    when the test ends are quit."""
+
+    # how many coroutines self.run_coroutines() runs at once
+    concurrency = 10
+    # added to (and overriding) the desired capabilities for BROWSER
+    desired_capabilities = None
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.sessions = []
+
+    def tearDown(self):
+        open_sessions = [wd for wd in self.sessions if wd.session_id]
+        self.sessions = []
+        if open_sessions:
+            try:
+                run_coroutines([wd.quit() for wd in open_sessions],
+                               loop=self.loop)
+            except WebDriverException as e:
+                logger.warning("Could not quit session: %s" % e)
+
+    def new_session(self, capabilities=None):
+        """Coroutine starting an AsyncWebDriver, quit at tearDown."""
+        if capabilities is None:
+            capabilities = self.desired_capabilities
+        wd = yield start_async_session(self.loop, capabilities,
+                                       name=self.id())
+        self.sessions.append(wd)
+        raise Return(wd)
+
+    def run_coroutines(self, coroutines, concurrency=None):
+        """See nose_selenium_async.run_coroutines."""
+        return run_coroutines(coroutines, concurrency or self.concurrency,
+                              self.loop)
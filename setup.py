@@ -13,7 +13,7 @@ setup(
     author='Leah Klearman',
     author_email = 'lklrmn@gmail.com',
     description = 'Control the WebDriver instance in your scripts with command-line options',
-    py_modules = ['nose_selenium'],
+    py_modules = ['nose_selenium', 'nose_selenium_async'],
     entry_points = {
         'nose.plugins.0.10': [
             'nose-selenium = nose_selenium:NoseSelenium'
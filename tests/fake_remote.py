@@ -0,0 +1,338 @@
+"""A stand-in for a remote WebDriver server, speaking just enough of the
+JSON wire protocol to create sessions and run a few commands against them
+without a browser. Every command can be made to take a while, to stand in
+for a real browser; run it on its own like webserver.py to point a test
+run or a benchmark at it:
+
+    $ python tests/fake_remote.py --port 4444 --latency 0.005
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FakeRemoteHandler(BaseHTTPRequestHandler):
+    """JSON wire protocol handler, one instance per connection."""
+
+    protocol_version = 'HTTP/1.1'
+    # send each reply in one write: headers and body in separate small
+    # writes wait out the client's delayed ACK on a keep-alive connection
+    wbufsize = -1
+
+    routes = [
+        ('POST', r'^/wd/hub/session$', 'new_session'),
+        ('DELETE', r'^/wd/hub/session/(?P<session>[^/]+)$', 'quit'),
+        ('POST', r'^/wd/hub/session/(?P<session>[^/]+)/url$', 'get'),
+        ('GET', r'^/wd/hub/session/(?P<session>[^/]+)/url$', 'current_url'),
+        ('GET', r'^/wd/hub/session/(?P<session>[^/]+)/title$', 'title'),
+        ('GET', r'^/wd/hub/session/(?P<session>[^/]+)/source$', 'source'),
+        ('GET', r'^/wd/hub/session/(?P<session>[^/]+)/screenshot$',
+         'screenshot'),
+        ('POST', r'^/wd/hub/session/(?P<session>[^/]+)/element$', 'element'),
+        ('POST', r'^/wd/hub/session/(?P<session>[^/]+)/elements$', 'elements'),
+        ('GET', r'^/wd/hub/session/(?P<session>[^/]+)/element/(?P<element>[^/]+)/text$',
+         'text'),
+        ('POST', r'^/wd/hub/session/(?P<session>[^/]+)/element/(?P<element>[^/]+)/click$',
+         'ok'),
+        ('POST', r'^/wd/hub/session/(?P<session>[^/]+)/execute$', 'execute'),
+        ('DELETE', r'^/wd/hub/session/(?P<session>[^/]+)/cookie$', 'ok'),
+        ('GET', r'^/wd/hub/session/(?P<session>[^/]+)/window_handles$',
+         'window_handles'),
+        ('POST', r'^/wd/hub/session/(?P<session>[^/]+)/timeouts/implicit_wait$',
+         'ok'),
+    ]
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _reply(self, value, status=0, code=200, session=None):
+        body = json.dumps({'sessionId': session, 'status': status,
+                           'value': value})
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        params = json.loads(body) if body.strip() else {}
+        with self.server.lock:
+            self.server.requests += 1
+        for route_method, pattern, name in self.routes:
+            match = re.match(pattern, self.path)
+            if route_method == method and match:
+                session = match.groupdict().get('session')
+                if session is not None and session not in self.server.sessions:
+                    return self._reply({'message': 'no such session'},
+                                       status=6, code=404)
+                latency = self.server.latencies.get(name, self.server.latency)
+                if latency:
+                    time.sleep(latency)
+                self.element = match.groupdict().get('element')
+                return getattr(self, 'do_' + name)(params, session)
+        self._reply({'message': 'unknown command %s %s' % (method, self.path)},
+                    status=9, code=404)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_new_session(self, params, session):
+        session = uuid.uuid4().hex
+        capabilities = dict(params.get('desiredCapabilities', {}))
+        with self.server.lock:
+            self.server.sessions[session] = {'url': 'about:blank'}
+        self._reply(capabilities, session=session)
+
+    def do_quit(self, params, session):
+        with self.server.lock:
+            del self.server.sessions[session]
+        self._reply(None, session=session)
+
+    def do_get(self, params, session):
+        # page loads take server.delay seconds
+        with self.server.lock:
+            self.server.loading += 1
+            self.server.peak_loading = max(self.server.peak_loading,
+                                           self.server.loading)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.loading -= 1
+        self.server.sessions[session]['url'] = params['url']
+        self._reply(None, session=session)
+
+    def do_current_url(self, params, session):
+        self._reply(self.server.sessions[session]['url'], session=session)
+
+    def do_title(self, params, session):
+        self._reply('Fake page', session=session)
+
+    def do_source(self, params, session):
+        self._reply(self.server.page_source, session=session)
+
+    def do_screenshot(self, params, session):
+        self._reply(self.server.screenshot, session=session)
+
+    def do_element(self, params, session):
+        # the page has the elements in server.elements, selector -> text
+        if params.get('value') in self.server.elements:
+            return self._reply({'ELEMENT': self._element_id(params['value'])},
+                               session=session)
+        self._reply({'message': 'Unable to locate element: %s' %
+                     params.get('value')}, status=7, code=500,
+                    session=session)
+
+    def do_elements(self, params, session):
+        found = []
+        if params.get('value') in self.server.elements:
+            found.append({'ELEMENT': self._element_id(params['value'])})
+        self._reply(found, session=session)
+
+    def _element_id(self, selector):
+        element = hashlib.sha1(selector).hexdigest()
+        with self.server.lock:
+            self.server.element_ids[element] = selector
+        return element
+
+    def do_text(self, params, session):
+        selector = self.server.element_ids.get(self.element)
+        if selector not in self.server.elements:
+            return self._reply({'message': 'stale element reference'},
+                               status=10, code=500, session=session)
+        self._reply(self.server.elements[selector], session=session)
+
+    def do_execute(self, params, session):
+        self._reply(None, session=session)
+
+    def do_window_handles(self, params, session):
+        self._reply(['main'], session=session)
+
+    def do_ok(self, params, session):
+        self._reply(None, session=session)
+
+    def log_message(self, format, *args):
+        """Override default to avoid trashing stderr"""
+        pass
+
+
+class FakeHubHandler(FakeRemoteHandler):
+    """A grid hub with `server.slots` browser slots. Like a Selenium Grid
+    2 hub it reports its capacity on /grid/api/hub and holds new session
+    requests until a slot is free."""
+
+    routes = FakeRemoteHandler.routes + [
+        ('GET', r'^/grid/api/hub$', 'hub'),
+    ]
+
+    def do_hub(self, params, session):
+        with self.server.lock:
+            hub = {'success': True,
+                   'slotCounts': {'free': self.server.slots - len(self.server.sessions),
+                                  'total': self.server.slots},
+                   'newSessionRequestCount': self.server.queued}
+        body = json.dumps(hub)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_new_session(self, params, session):
+        with self.server.lock:
+            self.server.queued += 1
+            self.server.peak_queued = max(self.server.peak_queued,
+                                          self.server.queued)
+        while True:
+            with self.server.lock:
+                if len(self.server.sessions) < self.server.slots:
+                    self.server.queued -= 1
+                    # reserve the slot before the session id is sent
+                    session = uuid.uuid4().hex
+                    self.server.sessions[session] = {'url': 'about:blank'}
+                    break
+            time.sleep(0.01)
+        capabilities = dict(params.get('desiredCapabilities', {}))
+        self._reply(capabilities, session=session)
+
+
+class HangUpHandler(FakeRemoteHandler):
+    """Hangs up without answering, after reading the request, the first
+    `server.hang_ups[name]` times a route is called, and after answering
+    the routes in `server.closes`."""
+
+    def _hang_up(self, name):
+        with self.server.lock:
+            self.server.calls[name] = self.server.calls.get(name, 0) + 1
+            if name in self.server.closes:
+                self.close_connection = 1
+            if not self.server.hang_ups.get(name):
+                return False
+            self.server.hang_ups[name] -= 1
+        self.close_connection = 1
+        return True
+
+    def do_get(self, params, session):
+        if not self._hang_up('get'):
+            FakeRemoteHandler.do_get(self, params, session)
+
+    def do_title(self, params, session):
+        if not self._hang_up('title'):
+            FakeRemoteHandler.do_title(self, params, session)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # many sessions connect at once; the default backlog of 5 drops some
+    request_queue_size = 128
+
+
+class FakeRemoteServer(object):
+    """Serves FakeRemoteHandler on `port` (a free one by default) of
+    127.0.0.1. Every command takes `latency` seconds, or what `latencies`
+    gives for its route name ('new_session', 'screenshot'...); page loads
+    take `delay` seconds on top."""
+
+    def __init__(self, handler=FakeRemoteHandler, slots=None, port=0,
+                 latency=0, latencies=None, delay=0):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.lock = threading.Lock()
+        self.server.sessions = {}
+        # for FakeHubHandler
+        self.server.slots = slots
+        self.server.queued = 0
+        self.server.peak_queued = 0
+        self.server.connections = 0
+        self.server.delay = delay
+        self.server.latency = latency
+        self.server.latencies = dict(latencies or {})
+        self.server.elements = {}
+        self.server.element_ids = {}
+        self.server.page_source = '<html><title>Fake page</title></html>'
+        # base64 of a PNG signature, enough to be stored as a screenshot
+        self.server.screenshot = 'iVBORw0KGgo='
+        self.server.loading = 0
+        self.server.peak_loading = 0
+        self.server.requests = 0
+        # for HangUpHandler
+        self.server.hang_ups = {}
+        self.server.calls = {}
+        self.server.closes = []
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d/wd/hub' % self.port
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def sessions(self):
+        return self.server.sessions
+
+    def start(self):
+        self.thread.start()
+        LOGGER.debug("fake remote started on port %d" % self.port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+def main(argv=None):
+    from optparse import OptionParser
+
+    if argv is None:
+        import sys
+        argv = sys.argv
+
+    parser = OptionParser("%prog [options]")
+    parser.add_option("-p", "--port", dest="port", type="int",
+            help="port to listen (default: 4444)", default=4444)
+    parser.add_option("--latency", dest="latency", type="float",
+            help="seconds every command takes (default: 0)", default=0)
+    parser.add_option("--page-load", dest="delay", type="float",
+            help="seconds page loads take on top (default: 0)", default=0)
+
+    opts, args = parser.parse_args(argv[1:])
+    if args:
+        parser.error("wrong number of arguments")  # Will exit
+
+    remote = FakeRemoteServer(port=opts.port, latency=opts.latency,
+                              delay=opts.delay)
+    remote.start()
+    print("Fake remote at %s, hit CTRL-C to quit" % remote.url)
+    try:
+        while 1:
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    remote.stop()
+
+
+if __name__ == "__main__":
+    main()
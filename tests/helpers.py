@@ -0,0 +1,81 @@
+"""Fakes and fixtures shared by the tests."""
+
+import threading
+from selenium.common.exceptions import WebDriverException
+import nose_selenium
+
+
+class FakeWebDriver(object):
+    """Just enough of a WebDriver to be handed to tests, reset between
+    them and quit. It remembers what it was built for, which threads used
+    it, and can be made to stop answering."""
+
+    def __init__(self, capabilities=None, combination=None):
+        self.capabilities = capabilities
+        self.combination = combination
+        self.alive = True
+        self.quit_called = False
+        self.threads = set()
+        self.window_handles = ['main']
+        self.url = 'about:blank'
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise WebDriverException("session deleted because of page crash")
+        return self.url
+
+    def delete_all_cookies(self):
+        pass
+
+    def execute_script(self, script, *args):
+        pass
+
+    def get(self, url):
+        self.url = url
+
+    def quit(self):
+        self.quit_called = True
+
+
+class SavedGlobals(object):
+    """TestCase mixin putting back the nose_selenium module globals named
+    in `saved_globals` after each test."""
+
+    saved_globals = ()
+
+    def setUp(self):
+        self._saved_globals = dict((name, getattr(nose_selenium, name))
+                                   for name in self.saved_globals)
+        super(SavedGlobals, self).setUp()
+
+    def tearDown(self):
+        super(SavedGlobals, self).tearDown()
+        for name, value in self._saved_globals.items():
+            setattr(nose_selenium, name, value)
+
+
+class FakeSessions(SavedGlobals):
+    """TestCase mixin replacing nose_selenium.build_webdriver by one that
+    builds FakeWebDrivers, collected in self.built. Reused sessions are
+    closed after each test."""
+
+    def setUp(self):
+        # before PluginTester.setUp, which runs the tests
+        self.built = []
+        self._built_lock = threading.Lock()
+        self._saved_build_webdriver = nose_selenium.build_webdriver
+        nose_selenium.build_webdriver = self.build_webdriver
+        super(FakeSessions, self).setUp()
+
+    def tearDown(self):
+        nose_selenium.close_webdriver_sessions()
+        nose_selenium.build_webdriver = self._saved_build_webdriver
+        super(FakeSessions, self).tearDown()
+
+    def build_webdriver(self, name="", tags=[], public=False, capabilities=None,
+                        combination=None, config=None):
+        wd = FakeWebDriver(capabilities, combination)
+        with self._built_lock:
+            self.built.append(wd)
+        return wd
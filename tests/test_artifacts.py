@@ -0,0 +1,101 @@
+import base64
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from unittest2 import TestCase
+import nose_selenium
+
+
+class FakeFailingPage(object):
+    """The parts of a WebDriver that failure artifacts are taken from."""
+    current_url = 'http://localhost/broken'
+    page_source = u'<html><body>broken \u2603</body></html>'
+
+    def get_screenshot_as_base64(self):
+        return base64.b64encode(b'not really a png').decode('ascii')
+
+
+class ArtifactTestBase(TestCase):
+
+    def setUp(self):
+        self.saved = (nose_selenium.SAVED_FILES_PATH,
+                      nose_selenium.COMPRESS_SAVED_FILES)
+        self.tmpdir = tempfile.mkdtemp()
+        nose_selenium.SAVED_FILES_PATH = self.tmpdir
+        nose_selenium.COMPRESS_SAVED_FILES = False
+
+    def tearDown(self):
+        (nose_selenium.SAVED_FILES_PATH,
+         nose_selenium.COMPRESS_SAVED_FILES) = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def saved_files(self, suffix):
+        return [os.path.join(dirpath, name)
+                for dirpath, dirnames, names in os.walk(self.tmpdir)
+                for name in names if name.endswith(suffix)]
+
+
+class TestSaveFailureArtifacts(ArtifactTestBase):
+
+    def test_files_written_after_flush(self):
+        nose_selenium.save_failure_artifacts(FakeFailingPage())
+        nose_selenium.flush_failure_artifacts()
+        screenshot, = self.saved_files('.png')
+        html, = self.saved_files('.html')
+        self.assertEqual(open(screenshot, 'rb').read(), b'not really a png')
+        self.assertIn(b'broken', open(html, 'rb').read())
+
+    def test_compressed_html(self):
+        nose_selenium.COMPRESS_SAVED_FILES = True
+        nose_selenium.save_failure_artifacts(FakeFailingPage())
+        nose_selenium.flush_failure_artifacts()
+        html, = self.saved_files('.html.gz')
+        self.assertIn(b'broken', gzip.open(html).read())
+
+    def test_identical_artifacts_stored_once(self):
+        for i in range(3):
+            nose_selenium.save_failure_artifacts(FakeFailingPage(), 'click')
+        nose_selenium.flush_failure_artifacts()
+        self.assertEqual(len(self.saved_files('.png')), 1)
+        self.assertEqual(len(self.saved_files('.html')), 1)
+        entries = list(nose_selenium.ArtifactStore(self.tmpdir).entries())
+        self.assertEqual(len(entries), 3)
+
+    def test_manifest_entry(self):
+        nose_selenium._test_context.test_id = 'tests.test_artifacts.Broken'
+        try:
+            nose_selenium.save_failure_artifacts(FakeFailingPage(), 'click')
+        finally:
+            nose_selenium._test_context.test_id = None
+        nose_selenium.flush_failure_artifacts()
+        store = nose_selenium.ArtifactStore(self.tmpdir)
+        entry, = store.entries(test='tests.test_artifacts.Broken')
+        self.assertEqual(entry['url'], 'http://localhost/broken')
+        self.assertEqual(entry['command'], 'click')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmpdir, entry['screenshot'])))
+        self.assertEqual(list(store.entries(test='another test')), [])
+
+    def test_paths_logged_on_the_test_thread(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        nose_selenium.logger.addHandler(handler)
+        self.addCleanup(nose_selenium.logger.removeHandler, handler)
+        nose_selenium.save_failure_artifacts(FakeFailingPage())
+        saved = [record for record in records
+                 if ' saved to ' in record.getMessage()]
+        nose_selenium.flush_failure_artifacts()
+        self.assertEqual(len(saved), 2)
+        for record in saved:
+            self.assertEqual(record.thread, threading.current_thread().ident)
+            self.assertTrue(os.path.exists(record.getMessage().split()[-1]))
+
+    def test_nothing_saved_without_path(self):
+        nose_selenium.SAVED_FILES_PATH = ''
+        nose_selenium.save_failure_artifacts(FakeFailingPage())
+        nose_selenium.flush_failure_artifacts()
+        self.assertEqual(os.listdir(self.tmpdir), [])
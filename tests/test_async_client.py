@@ -0,0 +1,238 @@
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest2 import TestCase
+from selenium.common.exceptions import NoSuchElementException
+import nose_selenium
+from nose_selenium import ArtifactStore, SeleniumConfig, \
+    flush_failure_artifacts, start_grid_scheduler, use_config
+from nose_selenium_async import AsyncSeleniumTestCase, EventLoop, Return, \
+    run_coroutines, start_async_session
+from fake_remote import FakeRemoteServer, HangUpHandler
+
+
+class TestEventLoop(TestCase):
+
+    def test_nested_coroutines_return_values(self):
+        loop = EventLoop()
+
+        def double(value):
+            yield loop.sleep(0)
+            raise Return(value * 2)
+
+        def main():
+            first = yield double(1)
+            rest = yield [double(2), double(3)]
+            raise Return([first] + rest)
+        self.assertEqual(loop.run(main()), [2, 4, 6])
+
+    def test_errors_are_thrown_into_the_caller(self):
+        loop = EventLoop()
+
+        def fails():
+            yield loop.sleep(0)
+            raise ValueError("boom")
+
+        def main():
+            try:
+                yield fails()
+            except ValueError as e:
+                raise Return(str(e))
+        self.assertEqual(loop.run(main()), "boom")
+
+    def test_sleeps_overlap(self):
+        loop = EventLoop()
+        order = []
+
+        def sleeper(seconds):
+            yield loop.sleep(seconds)
+            order.append(seconds)
+        loop.run([sleeper(0.05), sleeper(0.01)])
+        self.assertEqual(order, [0.01, 0.05])
+
+    def test_run_coroutines_limits_concurrency(self):
+        loop = EventLoop()
+        running = [0, 0]
+
+        def job(index):
+            running[0] += 1
+            running[1] = max(running)
+            yield loop.sleep(0.01)
+            running[0] -= 1
+            raise Return(index)
+        results = run_coroutines([job(i) for i in range(10)], 3, loop)
+        self.assertEqual(results, list(range(10)))
+        self.assertEqual(running[1], 3)
+
+    def test_run_coroutines_raises_after_all_finish(self):
+        finished = []
+
+        def job(index):
+            if index == 1:
+                raise ValueError("job 1")
+            finished.append(index)
+            yield
+        self.assertRaises(ValueError, run_coroutines,
+                          [job(i) for i in range(4)])
+        self.assertEqual(finished, [0, 2, 3])
+
+
+class AsyncRemoteBase(TestCase):
+    handler = None
+
+    def setUp(self):
+        self.saved = nose_selenium.CONFIG.as_dict() \
+            if nose_selenium.CONFIG is not None else None
+        if self.handler is None:
+            self.remote = FakeRemoteServer()
+        else:
+            self.remote = FakeRemoteServer(handler=self.handler)
+        self.remote.start()
+        self.config = SeleniumConfig(
+            BROWSER_LOCATION='remote', BROWSER='FIREFOX', TIMEOUT=0,
+            REMOTE_ADDRESS='127.0.0.1', REMOTE_PORT=self.remote.port,
+            HTTP_TIMEOUT=10)
+
+    def tearDown(self):
+        self.remote.stop()
+        if self.saved is not None:
+            use_config(SeleniumConfig(**self.saved))
+
+
+class TestAsyncWebDriver(AsyncRemoteBase):
+
+    def test_page_checks_overlap(self):
+        self.remote.server.delay = 0.2
+        loop = EventLoop()
+
+        def check(url):
+            wd = yield start_async_session(loop, config=self.config)
+            try:
+                yield wd.get(url)
+                title = yield wd.title()
+                current_url = yield wd.current_url()
+            finally:
+                yield wd.quit()
+            raise Return((current_url, title))
+
+        urls = ['http://localhost/page/%d' % i for i in range(8)]
+        results = run_coroutines([check(url) for url in urls], 8, loop)
+        self.assertEqual(results, [(url, 'Fake page') for url in urls])
+        self.assertEqual(self.remote.server.peak_loading, 8)
+        self.assertEqual(self.remote.sessions, {})
+        # one keep-alive connection per session
+        self.assertEqual(self.remote.connections, 8)
+
+    def test_failure_saves_screenshot_and_html(self):
+        path = tempfile.mkdtemp()
+        config = self.config.replace(SAVED_FILES_PATH=path)
+        loop = EventLoop()
+
+        def check():
+            wd = yield start_async_session(loop, config=config)
+            try:
+                yield wd.get('http://localhost/broken')
+                yield wd.find_element('css selector', '#missing')
+            finally:
+                yield wd.quit()
+        try:
+            self.assertRaises(NoSuchElementException, loop.run, check())
+            flush_failure_artifacts()
+            entries = list(ArtifactStore(path).entries())
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]['url'], 'http://localhost/broken')
+            self.assertEqual(entries[0]['command'], 'findElement')
+        finally:
+            shutil.rmtree(path)
+
+
+    def test_sessions_wait_for_a_browser_slot(self):
+        config = self.config.replace(MAX_BROWSERS=1)
+        loop = EventLoop()
+        events = []
+        ticks = [0]
+
+        def check(index):
+            wd = yield start_async_session(loop, config=config)
+            events.append('start')
+            yield loop.sleep(0.1)
+            events.append('quit')
+            yield wd.quit()
+
+        def ticker():
+            while len(events) < 4:
+                ticks[0] += 1
+                yield loop.sleep(0.01)
+        loop.run([check(0), check(1), ticker()])
+        self.assertEqual(events, ['start', 'quit', 'start', 'quit'])
+        # the loop kept running while the second session waited
+        self.assertTrue(ticks[0] > 5)
+
+    def test_grid_sessions_go_through_the_scheduler(self):
+        config = self.config.replace(BROWSER_LOCATION='grid', OS='linux',
+                                     BROWSER_VERSION='')
+        probes = []
+        scheduler = start_grid_scheduler(
+            1, probe=lambda: probes.append(1) or None, config=config)
+        self.addCleanup(nose_selenium._GRID_SCHEDULERS.pop, config.executor)
+        loop = EventLoop()
+
+        def check():
+            wd = yield start_async_session(loop, config=config)
+            yield wd.quit()
+        run_coroutines([check(), check()], 2, loop)
+        self.assertEqual(scheduler.waits.count, 2)
+        self.assertEqual(len(probes), 2)
+        self.assertEqual(scheduler.pending, 0)
+
+
+class PageChecks(AsyncSeleniumTestCase):
+    __test__ = False
+
+    def test_pages(self):
+        def check(url):
+            wd = yield self.new_session()
+            yield wd.get(url)
+            raise Return((yield wd.title()))
+        titles = self.run_coroutines(
+            [check('http://localhost/%d' % i) for i in range(4)])
+        self.assertEqual(titles, ['Fake page'] * 4)
+
+
+class TestAsyncSeleniumTestCase(AsyncRemoteBase):
+
+    def test_sessions_quit_after_test(self):
+        use_config(self.config)
+        result = unittest.TestResult()
+        PageChecks('test_pages').run(result)
+        self.assertEqual(result.errors + result.failures, [])
+        self.assertEqual(result.testsRun, 1)
+        self.assertEqual(self.remote.sessions, {})
+
+
+class TestAsyncRetries(AsyncRemoteBase):
+    handler = HangUpHandler
+
+    def run_session(self, hang_up, command):
+        loop = EventLoop()
+
+        def check():
+            wd = yield start_async_session(loop, config=self.config)
+            self.remote.server.hang_ups[hang_up] = 1
+            try:
+                result = yield command(wd)
+            finally:
+                yield wd.quit()
+            raise Return(result)
+        return loop.run(check())
+
+    def test_post_not_sent_twice(self):
+        self.assertRaises(socket.error, self.run_session, 'get',
+                          lambda wd: wd.get('http://localhost/'))
+        self.assertEqual(self.remote.server.calls['get'], 1)
+
+    def test_get_retried_on_a_new_connection(self):
+        self.assertEqual(self.run_session('title', lambda wd: wd.title()),
+                         'Fake page')
+        self.assertEqual(self.remote.server.calls['title'], 2)
@@ -0,0 +1,158 @@
+import threading
+import time
+from ConfigParser import ConfigParser
+from StringIO import StringIO
+from nose.plugins import PluginTester
+from unittest2 import TestCase, TestSuite
+import nose_selenium
+from nose_selenium import BrowserCombination, NoseSelenium, \
+    SeleniumTestCase, browser_matrix, close_connection_pools, \
+    expand_browser_matrix, setup_selenium_from_config
+from fake_remote import FakeRemoteServer
+from helpers import FakeSessions, SavedGlobals
+
+
+class TestBrowserMatrix(TestCase):
+
+    def test_lists_make_every_combination(self):
+        matrix = browser_matrix('FIREFOX, CHROME', 'linux,windows', '')
+        self.assertEqual([combination.name for combination in matrix],
+                         ['FIREFOX-linux', 'FIREFOX-windows',
+                          'CHROME-linux', 'CHROME-windows'])
+
+    def test_single_combination_is_not_a_matrix(self):
+        self.assertEqual(browser_matrix('FIREFOX', None, ''), None)
+
+    def test_parse_config_line(self):
+        combination = BrowserCombination.parse('CHROME, Windows 10', 'chrome-win')
+        self.assertEqual((combination.browser, combination.os,
+                          combination.version, combination.name),
+                         ('CHROME', 'Windows 10', '', 'chrome-win'))
+
+    def test_matrix_section(self):
+        saved = (nose_selenium.BROWSER_MATRIX, nose_selenium.BROWSER,
+                 nose_selenium.OS, nose_selenium.BROWSER_VERSION)
+        config = ConfigParser()
+        config.readfp(StringIO("[SELENIUM]\n"
+                               "BROWSER_LOCATION: grid\n"
+                               "[MATRIX]\n"
+                               "old-ie: INTERNETEXPLORER, windows, 8\n"
+                               "chrome: CHROME, linux\n"))
+        try:
+            setup_selenium_from_config(config)
+            self.assertEqual(
+                sorted(combination.name
+                       for combination in nose_selenium.BROWSER_MATRIX),
+                ['chrome', 'old-ie'])
+        finally:
+            (nose_selenium.BROWSER_MATRIX, nose_selenium.BROWSER,
+             nose_selenium.OS, nose_selenium.BROWSER_VERSION) = saved
+
+
+class MatrixCase(SeleniumTestCase):
+    __test__ = False
+    # every combination must be running at the same time to get past this
+    arrived = None
+
+    def test_concurrently(self):
+        self.arrived.wait(5)
+        self.assertEqual(self.wd.combination, self.browser_combination)
+
+
+class TestMatrixSuite(FakeSessions, TestCase):
+    saved_globals = ['MAX_BROWSERS']
+
+    def test_runs_each_combination_concurrently(self):
+        matrix = browser_matrix('FIREFOX,CHROME,INTERNETEXPLORER')
+        barrier = threading.Semaphore(0)
+        count = [0]
+        lock = threading.Lock()
+
+        class Arrived(object):
+            def wait(self, timeout):
+                with lock:
+                    count[0] += 1
+                    if count[0] == len(matrix):
+                        for i in range(len(matrix)):
+                            barrier.release()
+                barrier.acquire()
+        MatrixCase.arrived = Arrived()
+        suite = TestSuite([MatrixCase('test_concurrently')])
+        expand_browser_matrix(suite, matrix)
+        result = self.defaultTestResult()
+        suite.run(result)
+        self.assertEqual(result.testsRun, 3)
+        self.assertEqual(result.failures + result.errors, [])
+
+
+    def test_no_more_threads_than_browsers(self):
+        matrix = browser_matrix('FIREFOX,CHROME,INTERNETEXPLORER,OPERA')
+        running = [0, 0]
+        lock = threading.Lock()
+
+        class Arrived(object):
+            def wait(self, timeout):
+                with lock:
+                    running[0] += 1
+                    running[1] = max(running)
+                time.sleep(0.05)
+                with lock:
+                    running[0] -= 1
+        MatrixCase.arrived = Arrived()
+        nose_selenium.MAX_BROWSERS = 2
+        suite = TestSuite([MatrixCase('test_concurrently')])
+        expand_browser_matrix(suite, matrix)
+        result = self.defaultTestResult()
+        suite.run(result)
+        self.assertEqual(result.testsRun, 4)
+        self.assertEqual(result.failures + result.errors, [])
+        self.assertEqual(running[1], 2)
+
+
+class MatrixPluginCase(SeleniumTestCase):
+
+    def test_title(self):
+        self.wd.get('http://localhost/')
+        self.assertEqual(self.wd.title, 'Fake page')
+
+    def test_chrome_only(self):
+        self.assertEqual(self.browser_combination.browser, 'CHROME')
+
+
+MatrixPluginCase.__test__ = False
+
+
+class TestMatrixRun(SavedGlobals, PluginTester, TestCase):
+    activate = '--with-nose-selenium'
+    plugins = [NoseSelenium()]
+
+    saved_globals = ['BROWSER_LOCATION', 'BROWSER', 'BROWSER_MATRIX', 'OS',
+                     'BROWSER_VERSION', 'REMOTE_ADDRESS', 'REMOTE_PORT',
+                     'HTTP_POOL_SIZE', 'HTTP_TIMEOUT']
+
+    def setUp(self):
+        self.remote = FakeRemoteServer()
+        self.remote.start()
+        self.args = ['--browser-location=remote', '--browser=FIREFOX,CHROME',
+                     '--remote-address=127.0.0.1',
+                     '--remote-port=%d' % self.remote.port]
+        super(TestMatrixRun, self).setUp()
+
+    def tearDown(self):
+        close_connection_pools()
+        self.remote.stop()
+        super(TestMatrixRun, self).tearDown()
+
+    def makeSuite(self):
+        # a list, so nose wraps each test and plugins see its results
+        return [MatrixPluginCase('test_title'),
+                MatrixPluginCase('test_chrome_only')]
+
+    def test_results_per_combination(self):
+        output = str(self.output)
+        self.assertIn("Ran 4 tests", output)
+        self.assertIn("test_chrome_only (test_browser_matrix.MatrixPluginCase) "
+                      "[FIREFOX]", output)
+        self.assertIn("CHROME: 2 passed, 0 failed, 0 errors", output)
+        self.assertIn("FIREFOX: 1 passed, 1 failed, 0 errors", output)
+        self.assertEqual(self.remote.sessions, {})
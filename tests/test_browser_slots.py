@@ -0,0 +1,62 @@
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest2 import TestCase, skipIf
+from selenium.common.exceptions import WebDriverException
+import nose_selenium
+from nose_selenium import BrowserSlots, _release_slot_on_quit
+from helpers import FakeWebDriver
+
+
+class TestBrowserSlots(TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir, ignore_errors=True)
+
+    def test_limit_is_enforced(self):
+        slots = BrowserSlots(2, self.lock_dir, poll_frequency=0.01)
+        first = slots.acquire()
+        slots.acquire()
+        self.assertRaises(WebDriverException, slots.acquire, timeout=0.05)
+        first.release()
+        slots.acquire(timeout=0.05)
+
+    def test_release_is_idempotent(self):
+        slots = BrowserSlots(1, self.lock_dir, poll_frequency=0.01)
+        first = slots.acquire()
+        first.release()
+        second = slots.acquire(timeout=0.05)
+        # must not unlock (or close the file of) the slot `second` holds
+        first.release()
+        self.assertRaises(WebDriverException, slots.acquire, timeout=0.05)
+        second.release()
+        slots.acquire(timeout=0.05)
+
+    def test_slot_released_once_on_quit(self):
+        slots = BrowserSlots(1, self.lock_dir, poll_frequency=0.01)
+        wd = FakeWebDriver()
+        _release_slot_on_quit(wd, slots.acquire())
+        wd.quit()
+        second = slots.acquire(timeout=0.05)
+        wd.quit()
+        self.assertTrue(wd.quit_called)
+        self.assertRaises(WebDriverException, slots.acquire, timeout=0.05)
+        second.release()
+
+    @skipIf(nose_selenium.fcntl is None, "needs fcntl")
+    def test_limit_is_shared_between_processes(self):
+        held = BrowserSlots(1, self.lock_dir).acquire()
+        script = (
+            "import sys\n"
+            "from nose_selenium import BrowserSlots\n"
+            "try:\n"
+            "    BrowserSlots(1, %r, 0.01).acquire(timeout=0.05)\n"
+            "except Exception:\n"
+            "    sys.exit(3)\n" % self.lock_dir)
+        self.assertEqual(subprocess.call([sys.executable, '-c', script]), 3)
+        held.release()
+        self.assertEqual(subprocess.call([sys.executable, '-c', script]), 0)
@@ -0,0 +1,102 @@
+import unittest
+from unittest2 import TestCase
+from nose.suite import LazySuite
+import nose_selenium
+from nose_selenium import acquire_webdriver, capability_key, \
+    group_by_capabilities
+from helpers import FakeSessions
+
+
+class Cases(unittest.TestCase):
+    __test__ = False
+    desired_capabilities = None
+
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        pass
+
+
+class Plain(Cases):
+    pass
+
+
+class Mobile(Cases):
+    desired_capabilities = {'deviceName': 'iPhone', 'platformName': 'iOS'}
+
+
+class MobileAgain(Cases):
+    desired_capabilities = {'platformName': 'iOS', 'deviceName': 'iPhone'}
+
+
+class Legacy(Cases):
+    desired_capabilities = {'version': '8'}
+
+
+def names_of(suite):
+    names = []
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            names.extend(names_of(test))
+        else:
+            test = getattr(test, 'test', test)
+            names.append('%s.%s' % (test.__class__.__name__,
+                                    test._testMethodName))
+    return names
+
+
+class TestGroupByCapabilities(TestCase):
+
+    def test_capability_key_ignores_order(self):
+        self.assertEqual(capability_key(Mobile.desired_capabilities),
+                         capability_key(MobileAgain.desired_capabilities))
+        self.assertEqual(capability_key(None), '')
+
+    def test_groups_in_order_of_first_appearance(self):
+        loader = unittest.TestLoader()
+        suite = unittest.TestSuite(
+            [loader.loadTestsFromTestCase(cls)
+             for cls in [Mobile, Plain, Legacy, MobileAgain, Plain]])
+        group_by_capabilities(suite)
+        self.assertEqual(names_of(suite), [
+            'Mobile.test_a', 'Mobile.test_b',
+            'MobileAgain.test_a', 'MobileAgain.test_b',
+            'Plain.test_a', 'Plain.test_b', 'Plain.test_a', 'Plain.test_b',
+            'Legacy.test_a', 'Legacy.test_b'])
+
+    def test_lazy_suites_are_read_once(self):
+        loader = unittest.TestLoader()
+        suite = LazySuite(lambda: (loader.loadTestsFromTestCase(cls)
+                                   for cls in [Plain, Mobile, Plain]))
+        group_by_capabilities(suite)
+        expected = ['Plain.test_a', 'Plain.test_b', 'Plain.test_a',
+                    'Plain.test_b', 'Mobile.test_a', 'Mobile.test_b']
+        self.assertEqual(names_of(suite), expected)
+        self.assertEqual(names_of(suite), expected)
+
+    def test_already_grouped_suite_is_unchanged(self):
+        suite = unittest.TestSuite(
+            [unittest.TestLoader().loadTestsFromTestCase(cls)
+             for cls in [Plain, Mobile, Legacy]])
+        before = names_of(suite)
+        group_by_capabilities(suite)
+        self.assertEqual(names_of(suite), before)
+
+
+class TestCapabilitySessions(FakeSessions, TestCase):
+    saved_globals = ['GROUP_BY_CAPABILITIES']
+
+    def test_sessions_are_kept_per_capability_set(self):
+        nose_selenium.GROUP_BY_CAPABILITIES = False
+        mobile = acquire_webdriver('run', Mobile)
+        plain = acquire_webdriver('run', Plain)
+        self.assertEqual(mobile.capabilities, Mobile.desired_capabilities)
+        self.assertEqual(plain.capabilities, None)
+        self.assertTrue(acquire_webdriver('run', MobileAgain) is mobile)
+
+    def test_grouped_run_closes_finished_group(self):
+        nose_selenium.GROUP_BY_CAPABILITIES = True
+        mobile = acquire_webdriver('run', Mobile)
+        acquire_webdriver('run', Plain)
+        self.assertTrue(mobile.quit_called)
@@ -1,6 +1,7 @@
 from nose.plugins import PluginTester
 from nose.plugins.logcapture import LogCapture
 from unittest2 import TestCase, TestSuite
+import nose_selenium
 from nose_selenium import NoseSelenium
 from exceptions import TypeError
 
@@ -54,6 +55,29 @@ class TestLocalInvalidBrowser(ConfigurationErrorBase):
         return "HTMLUNIT not in available options for --browser:"
 
 
+class TestLocalHeadlessBrowser(NoseSeleniumBase):
+    args = [
+        '--browser-location=local',
+        '--browser=HEADLESS_CHROME',
+        '--lightweight-browser',
+        ]
+
+    def test_accepted(self):
+        self.assertEqual(nose_selenium.BROWSER, 'HEADLESS_CHROME')
+        self.assertTrue(nose_selenium.LIGHTWEIGHT_BROWSER)
+
+
+class TestLocalMatrixInvalidBrowser(ConfigurationErrorBase):
+    args = [
+        '--browser-location=local',
+        '--browser=FIREFOX,HTMLUNIT',
+        ]
+
+    @property
+    def expected_error(self):
+        return "HTMLUNIT not in available options for --browser:"
+
+
 ################################ grid ############################
 
 # cannot usefully test for browser version
@@ -138,6 +162,7 @@ class TestSauceInvalidBrowser(ConfigurationErrorBase):
         '--os=Linux',
         '--sauce-username=foo',
         '--sauce-apikey=bar',
+        '--sauce-browsers-file=tests/sauce_browsers.json',
     ]
 
     @property
@@ -152,6 +177,7 @@ class TestSauceRequiresOS(ConfigurationErrorBase):
         '--browser-version=10',
         '--sauce-username=foo',
         '--sauce-apikey=bar',
+        '--sauce-browsers-file=tests/sauce_browsers.json',
         ]
 
     @property
@@ -165,6 +191,7 @@ class TestSauceRequiresUsername(ConfigurationErrorBase):
         '--browser-version=10',
         '--os=windows',
         '--sauce-apikey=bar',
+        '--sauce-browsers-file=tests/sauce_browsers.json',
     ]
 
     @property
@@ -179,6 +206,7 @@ class TestSauceRequiresApikey(ConfigurationErrorBase):
         '--browser-version=10',
         '--os=windows',
         '--sauce-username=foo',
+        '--sauce-browsers-file=tests/sauce_browsers.json',
     ]
 
     @property
@@ -197,9 +225,42 @@ class TestSauceConfigFileRequiresUsername(ConfigurationErrorBase):
         return ("'sauce' value for --browser-location " +
                 "requires --sauce-username and --sauce-apikey.")
 
+class TestSauceOfflineRequiresCache(ConfigurationErrorBase):
+    args = [
+        '--browser-location=sauce',
+        '--browser=firefox',
+        '--os=Linux',
+        '--sauce-username=foo',
+        '--sauce-apikey=bar',
+        '--sauce-offline',
+    ]
+
+    def setUp(self):
+        self.cache_path = nose_selenium.SAUCE_CACHE_PATH
+        nose_selenium.SAUCE_CACHE_PATH = 'tests/does-not-exist.json'
+        super(TestSauceOfflineRequiresCache, self).setUp()
+
+    def tearDown(self):
+        nose_selenium.SAUCE_CACHE_PATH = self.cache_path
+
+    @property
+    def expected_error(self):
+        return "--sauce-offline requires a cached Sauce Labs browser list"
+
 #################### General ##########################
 
 
+class TestConfigFileInvalidSessionScope(ConfigurationErrorBase):
+    args = [
+        '--config-file=tests/invalid_scope_config.conf'
+    ]
+
+    @property
+    def expected_error(self):
+        return "forever not in available options for --session-scope:"
+
+
+
 # class TestBrowserHelp(NoseSeleniumBase):
 #     """ this test just doesn't want to work. when the SystemExit message
 #     is thrown, it means that self.output doesn't get populated,
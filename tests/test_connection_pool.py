@@ -0,0 +1,114 @@
+import httplib
+import time
+from unittest2 import TestCase
+import nose_selenium
+from nose_selenium import build_webdriver, close_connection_pools
+from fake_remote import FakeRemoteHandler, FakeRemoteServer, HangUpHandler
+from helpers import SavedGlobals
+
+
+class RemoteSessionBase(SavedGlobals, TestCase):
+    """Points build_webdriver at a FakeRemoteServer."""
+    http_pool_size = 10
+    handler = FakeRemoteHandler
+
+    saved_globals = ['BROWSER_LOCATION', 'BROWSER', 'REMOTE_ADDRESS',
+                     'REMOTE_PORT', 'TIMEOUT', 'HTTP_POOL_SIZE', 'HTTP_TIMEOUT',
+                     'MAX_BROWSERS']
+
+    def setUp(self):
+        super(RemoteSessionBase, self).setUp()
+        self.remote = FakeRemoteServer(handler=self.handler)
+        self.remote.start()
+        nose_selenium.BROWSER_LOCATION = 'remote'
+        nose_selenium.BROWSER = 'FIREFOX'
+        nose_selenium.REMOTE_ADDRESS = '127.0.0.1'
+        nose_selenium.REMOTE_PORT = self.remote.port
+        nose_selenium.TIMEOUT = 0
+        nose_selenium.HTTP_POOL_SIZE = self.http_pool_size
+        nose_selenium.HTTP_TIMEOUT = 10
+        nose_selenium.MAX_BROWSERS = 0
+
+    def tearDown(self):
+        close_connection_pools()
+        self.remote.stop()
+        super(RemoteSessionBase, self).tearDown()
+
+
+class TestPooledConnections(RemoteSessionBase):
+
+    def test_commands_share_one_connection(self):
+        wd = build_webdriver()
+        wd.get('http://localhost/')
+        for i in range(10):
+            self.assertEqual(wd.title, 'Fake page')
+        self.assertEqual(wd.current_url, 'http://localhost/')
+        wd.quit()
+        self.assertEqual(self.remote.requests, 15)
+        self.assertEqual(self.remote.connections, 1)
+
+    def test_sessions_share_the_pool(self):
+        first = build_webdriver()
+        second = build_webdriver()
+        first.title
+        second.title
+        first.quit()
+        second.quit()
+        self.assertEqual(self.remote.connections, 1)
+        self.assertEqual(self.remote.sessions, {})
+
+    def test_reconnects_when_server_drops_idle_connection(self):
+        wd = build_webdriver()
+        pool = nose_selenium.connection_pool_for(self.remote.url)
+        for conn in pool._idle:
+            conn.sock.close()
+        self.assertEqual(wd.title, 'Fake page')
+        wd.quit()
+        self.assertEqual(self.remote.connections, 2)
+
+
+class TestRetries(RemoteSessionBase):
+    handler = HangUpHandler
+
+    def test_post_not_sent_twice(self):
+        wd = build_webdriver()
+        self.remote.server.hang_ups['get'] = 1
+        self.assertRaises(httplib.HTTPException, wd.get, 'http://localhost/')
+        self.assertEqual(self.remote.server.calls['get'], 1)
+        self.assertEqual(wd.current_url, 'about:blank')
+        wd.quit()
+
+    def test_get_retried_on_a_new_connection(self):
+        wd = build_webdriver()
+        self.remote.server.hang_ups['title'] = 1
+        self.assertEqual(wd.title, 'Fake page')
+        self.assertEqual(self.remote.server.calls['title'], 2)
+        wd.quit()
+        self.assertEqual(self.remote.connections, 2)
+
+    def test_post_after_server_closed_idle_connection(self):
+        wd = build_webdriver()
+        self.remote.server.closes = ['title']
+        wd.title
+        pool = nose_selenium.connection_pool_for(self.remote.url)
+        deadline = time.time() + 5
+        while not pool._closed_by_server(pool._idle[0]):
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+        # not sent on the closed connection, so not lost either
+        wd.get('http://localhost/')
+        self.assertEqual(self.remote.server.calls['get'], 1)
+        self.assertEqual(wd.current_url, 'http://localhost/')
+        wd.quit()
+
+
+class TestUnpooledConnections(RemoteSessionBase):
+    http_pool_size = 0
+
+    def test_connection_per_command(self):
+        wd = build_webdriver()
+        for i in range(3):
+            wd.title
+        wd.quit()
+        # plus the probe RemoteConnection makes when resolving the host
+        self.assertTrue(self.remote.connections >= self.remote.requests)
@@ -0,0 +1,51 @@
+import time
+from unittest2 import TestCase
+from selenium.common.exceptions import NoSuchElementException
+from nose_selenium import SeleniumConfig, build_webdriver, \
+    close_connection_pools
+from fake_remote import FakeRemoteServer
+
+
+class TestFakeRemote(TestCase):
+
+    def setUp(self):
+        self.remote = FakeRemoteServer(latency=0.02,
+                                       latencies={'new_session': 0.1})
+        self.remote.start()
+        self.config = SeleniumConfig(
+            BROWSER_LOCATION='remote', BROWSER='FIREFOX', TIMEOUT=0,
+            REMOTE_ADDRESS='127.0.0.1', REMOTE_PORT=self.remote.port,
+            HTTP_POOL_SIZE=1)
+
+    def tearDown(self):
+        close_connection_pools()
+        self.remote.stop()
+
+    def test_commands_take_their_latency(self):
+        start = time.time()
+        wd = build_webdriver(config=self.config)
+        self.assertTrue(time.time() - start >= 0.1)
+        start = time.time()
+        self.assertEqual(wd.title, 'Fake page')
+        self.assertTrue(0.02 <= time.time() - start < 0.1)
+        wd.quit()
+
+    def test_elements(self):
+        self.remote.server.elements['#go'] = 'Go'
+        wd = build_webdriver(config=self.config)
+        element = wd.find_element_by_css_selector('#go')
+        self.assertEqual(element.text, 'Go')
+        element.click()
+        self.assertEqual(len(wd.find_elements_by_css_selector('#go')), 1)
+        self.assertEqual(wd.find_elements_by_css_selector('#stop'), [])
+        self.assertRaises(NoSuchElementException,
+                          wd.find_element_by_css_selector, '#stop')
+        wd.quit()
+
+    def test_page_contents(self):
+        self.remote.server.page_source = '<html><p>changed</p></html>'
+        wd = build_webdriver(config=self.config)
+        self.assertEqual(wd.page_source, '<html><p>changed</p></html>')
+        self.assertEqual(wd.get_screenshot_as_base64(), 'iVBORw0KGgo=')
+        self.assertEqual(wd.window_handles, ['main'])
+        wd.quit()
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from unittest2 import TestCase
+from selenium import webdriver
+from selenium.webdriver.firefox.firefox_profile import EXTENSION_NAME
+import nose_selenium
+from nose_selenium import ClonedFirefoxProfile, FirefoxProfileTemplate, \
+    SeleniumConfig, build_webdriver, parse_firefox_prefs, \
+    remove_firefox_profile_clones
+
+
+class TemplateBase(TestCase):
+
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        self.profile = tempfile.mkdtemp()
+        with open(os.path.join(self.profile, 'cert9.db'), 'w') as f:
+            f.write('certificates')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache)
+        shutil.rmtree(self.profile)
+
+    def template(self, **preferences):
+        return FirefoxProfileTemplate(self.profile, preferences=preferences,
+                                      cache_path=self.cache)
+
+
+class TestFirefoxProfileTemplate(TemplateBase):
+
+    def test_built_once_and_cached_by_content(self):
+        first = self.template(**{'browser.startup.page': 0})
+        key = first.key()
+        path = first.path()
+        self.assertEqual(first.builds, 1)
+        self.assertTrue(os.path.isdir(
+            os.path.join(path, 'extensions', EXTENSION_NAME)))
+        # another run with the same settings finds it on disk
+        second = self.template(**{'browser.startup.page': 0})
+        self.assertEqual(second.path(), path)
+        self.assertEqual(second.builds, 0)
+        # changed content, new template
+        with open(os.path.join(self.profile, 'cert9.db'), 'w') as f:
+            f.write('other certificates')
+        changed = self.template(**{'browser.startup.page': 0}).key()
+        self.assertNotEqual(changed, key)
+        self.assertNotEqual(self.template(**{'browser.startup.page': 1}).key(),
+                            changed)
+
+    def test_clone_links_extensions_and_copies_the_rest(self):
+        template = self.template(**{'browser.startup.page': 0})
+        profile = template.clone()
+        self.assertTrue(isinstance(profile, ClonedFirefoxProfile))
+        extension = os.path.join('extensions', EXTENSION_NAME, 'install.rdf')
+        self.assertTrue(os.path.samefile(
+            os.path.join(template.path(), extension),
+            os.path.join(profile.path, extension)))
+        self.assertFalse(os.path.samefile(
+            os.path.join(template.path(), 'cert9.db'),
+            os.path.join(profile.path, 'cert9.db')))
+        # what a session does with its profile
+        profile.port = 7055
+        profile.update_preferences()
+        profile.add_extension()
+        with open(profile.userPrefs) as f:
+            user_js = f.read()
+        self.assertIn('user_pref("browser.startup.page", 0);', user_js)
+        self.assertIn('user_pref("webdriver_firefox_port", 7055);', user_js)
+
+    def test_remove_clones(self):
+        template = self.template()
+        profile = template.clone()
+        template.remove_clones()
+        self.assertFalse(os.path.exists(profile.path))
+        self.assertTrue(os.path.isdir(template.path()))
+
+    def test_parse_prefs(self):
+        self.assertEqual(
+            parse_firefox_prefs(['browser.download.folderList=2',
+                                 'intl.accept_languages = de',
+                                 'app.update.enabled=false', '']),
+            {'browser.download.folderList': 2, 'intl.accept_languages': 'de',
+             'app.update.enabled': False})
+        self.assertRaises(TypeError, parse_firefox_prefs, ['no value'])
+
+
+class FakeFirefox(object):
+
+    def __init__(self, firefox_profile=None, capabilities=None):
+        self.profile = firefox_profile
+        self.capabilities = {}
+
+    def implicitly_wait(self, seconds):
+        pass
+
+
+class TestLocalFirefoxSessions(TemplateBase):
+
+    def setUp(self):
+        super(TestLocalFirefoxSessions, self).setUp()
+        self.saved = (webdriver.Firefox, nose_selenium.FIREFOX_PROFILE_CACHE_PATH)
+        webdriver.Firefox = FakeFirefox
+        nose_selenium.FIREFOX_PROFILE_CACHE_PATH = self.cache
+
+    def tearDown(self):
+        remove_firefox_profile_clones()
+        nose_selenium._PROFILE_TEMPLATES.clear()
+        webdriver.Firefox, nose_selenium.FIREFOX_PROFILE_CACHE_PATH = self.saved
+        super(TestLocalFirefoxSessions, self).tearDown()
+
+    def test_sessions_start_from_clones(self):
+        config = SeleniumConfig(BROWSER_LOCATION='local', BROWSER='FIREFOX',
+                                TIMEOUT=0, FIREFOX_PROFILE=self.profile,
+                                FIREFOX_PREFS={'browser.startup.page': 0})
+        first = build_webdriver(config=config)
+        second = build_webdriver(config=config)
+        self.assertNotEqual(first.profile.path, second.profile.path)
+        template = nose_selenium.firefox_profile_template(config)
+        self.assertEqual(template.builds, 1)
+        remove_firefox_profile_clones()
+        self.assertFalse(os.path.exists(first.profile.path))
+
+    def test_plain_sessions_unchanged(self):
+        config = SeleniumConfig(BROWSER_LOCATION='local', BROWSER='FIREFOX',
+                                TIMEOUT=0)
+        self.assertEqual(build_webdriver(config=config).profile, None)
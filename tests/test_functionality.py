@@ -99,6 +99,36 @@ class TestSauceLinuxOpera(FunctionalityBase):
     env = os.environ
 
 
+@skipUnless('FIREFOX_IS_INSTALLED' in os.environ,
+            "set FIREFOX_IS_INSTALLED environment variable to run this test")
+class TestClassSessionScope(NoseSeleniumBase):
+    args = [
+        '--browser-location=local',
+        '--session-scope=class',
+    ]
+
+    def makeSuite(self):
+        sessions = []
+
+        class TC(SeleniumTestCase):
+
+            def test_first(self):
+                sessions.append(self.wd.session_id)
+                self.wd.get("http://google.com")
+
+            def test_second(self):
+                sessions.append(self.wd.session_id)
+                self.assertEqual(self.wd.current_url, "about:blank")
+
+        self.sessions = sessions
+        return TestSuite([TC('test_first'), TC('test_second')])
+
+    def test_session_reused(self):
+        self.assertTrue('Ran 2 tests' in self.output)
+        self.assertTrue('OK' in self.output)
+        self.assertEqual(len(set(self.sessions)), 1)
+
+
 ########### server not responding test cases #6 ###############
 # class TestSauceInvalidCreds(ConfigurationErrorBase):
 #     args = [
@@ -143,14 +173,16 @@ LOCALHOST = '192.168.5.129'
 
 class LiveWebServerSeleniumTestCase(SeleniumTestCase):
 
-    def setUp(self):
-        super(LiveWebServerSeleniumTestCase, self).setUp()
-        self.webserver = SimpleWebServer()
-        self.webserver.start()
+    @classmethod
+    def setUpClass(cls):
+        super(LiveWebServerSeleniumTestCase, cls).setUpClass()
+        cls.webserver = SimpleWebServer(port=0)
+        cls.webserver.start()
 
-    def tearDown(self):
-        self.webserver.stop()
-        super(LiveWebServerSeleniumTestCase, self).tearDown()
+    @classmethod
+    def tearDownClass(cls):
+        cls.webserver.stop()
+        super(LiveWebServerSeleniumTestCase, cls).tearDownClass()
 
 
 @skipUnless('REMOTE_SELENIUM_ADDRESS' in os.environ,
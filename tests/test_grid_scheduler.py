@@ -0,0 +1,117 @@
+import threading
+import time
+from StringIO import StringIO
+from unittest2 import TestCase
+from unittest2.runner import _WritelnDecorator
+from selenium.common.exceptions import WebDriverException
+import nose_selenium
+from nose_selenium import GridHubProbe, GridScheduler, build_webdriver, \
+    close_connection_pools
+from fake_remote import FakeHubHandler, FakeRemoteServer
+from helpers import SavedGlobals
+
+
+class TestGridScheduler(TestCase):
+
+    def test_limits_pending_requests(self):
+        scheduler = GridScheduler(1, probe=lambda: None, timeout=0.2,
+                                  poll_frequency=0.01)
+        scheduler.acquire()
+        self.assertRaises(WebDriverException, scheduler.acquire)
+        scheduler.release()
+        scheduler.acquire()
+        self.assertEqual(scheduler.pending, 1)
+
+    def test_admits_in_priority_order(self):
+        scheduler = GridScheduler(1, probe=lambda: None, timeout=5,
+                                  poll_frequency=0.01)
+        scheduler.acquire()
+        admitted = []
+
+        def request(priority):
+            scheduler.acquire(priority)
+            admitted.append(priority)
+            scheduler.release()
+        threads = [threading.Thread(target=request, args=(priority,))
+                   for priority in [GridScheduler.PRIORITY_BACKGROUND,
+                                    GridScheduler.PRIORITY_TEST]]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted, [GridScheduler.PRIORITY_TEST,
+                                    GridScheduler.PRIORITY_BACKGROUND])
+
+    def test_backs_off_while_hub_is_full(self):
+        answers = [0, 0, 0, 1]
+        scheduler = GridScheduler(2, probe=lambda: answers.pop(0), timeout=5,
+                                  poll_frequency=0.01)
+        scheduler.acquire()
+        self.assertEqual(scheduler.backoffs, 3)
+        self.assertEqual(answers, [])
+
+    def test_report(self):
+        scheduler = GridScheduler(1, probe=lambda: None)
+        for i in range(3):
+            scheduler.acquire()
+            scheduler.release()
+        self.assertEqual(scheduler.waits.count, 3)
+        stream = StringIO()
+        scheduler.report(_WritelnDecorator(stream))
+        self.assertIn("max pending 1): 3 session requests", stream.getvalue())
+
+
+class TestGridSchedulerWithHub(SavedGlobals, TestCase):
+
+    saved_globals = ['BROWSER_LOCATION', 'BROWSER', 'OS', 'BROWSER_VERSION',
+                     'REMOTE_ADDRESS', 'REMOTE_PORT', 'TIMEOUT',
+                     'HTTP_POOL_SIZE', 'HTTP_TIMEOUT', 'MAX_BROWSERS',
+                     'GRID_MAX_PENDING', 'GRID_QUEUE_TIMEOUT', '_GRID_SCHEDULERS']
+
+    def setUp(self):
+        super(TestGridSchedulerWithHub, self).setUp()
+        self.hub = FakeRemoteServer(FakeHubHandler, slots=2)
+        self.hub.start()
+        nose_selenium.BROWSER_LOCATION = 'grid'
+        nose_selenium.BROWSER = 'FIREFOX'
+        nose_selenium.OS = 'linux'
+        nose_selenium.BROWSER_VERSION = ''
+        nose_selenium.REMOTE_ADDRESS = '127.0.0.1'
+        nose_selenium.REMOTE_PORT = self.hub.port
+        nose_selenium.TIMEOUT = 0
+        nose_selenium.HTTP_POOL_SIZE = 10
+        nose_selenium.HTTP_TIMEOUT = 10
+        nose_selenium.MAX_BROWSERS = 0
+        nose_selenium.GRID_MAX_PENDING = 1
+        nose_selenium.GRID_QUEUE_TIMEOUT = 10
+        nose_selenium._GRID_SCHEDULERS = {}
+
+    def tearDown(self):
+        close_connection_pools()
+        self.hub.stop()
+        super(TestGridSchedulerWithHub, self).tearDown()
+
+    def test_probe_reads_hub_capacity(self):
+        probe = GridHubProbe('127.0.0.1', self.hub.port)
+        self.assertEqual(probe(), 2)
+        build_webdriver()
+        self.assertEqual(probe(), 1)
+
+    def test_requests_queue_client_side_when_hub_is_full(self):
+        first = build_webdriver()
+        build_webdriver()
+        third = []
+        thread = threading.Thread(target=lambda: third.append(build_webdriver()))
+        thread.start()
+        time.sleep(0.3)
+        # held back by the scheduler rather than queued inside the hub
+        self.assertEqual(third, [])
+        self.assertEqual(self.hub.server.queued, 0)
+        first.quit()
+        thread.join(10)
+        self.assertEqual(len(third), 1)
+        self.assertTrue(nose_selenium._grid_scheduler(
+            nose_selenium.current_config()).backoffs > 0)
+        self.assertEqual(self.hub.server.peak_queued, 1)
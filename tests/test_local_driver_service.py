@@ -0,0 +1,74 @@
+from unittest2 import TestCase
+import nose_selenium
+from nose_selenium import LocalDriverService, SeleniumConfig, build_webdriver, \
+    close_connection_pools, stop_local_driver_services
+from fake_remote import FakeRemoteServer
+
+
+class FakeProcess(object):
+
+    def __init__(self):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+
+class FakeService(object):
+    """Stands in for chromedriver: a 'process' serving the fake remote."""
+
+    path = 'chromedriver'
+
+    def __init__(self, url):
+        self.service_url = url
+        self.process = None
+        self.stopped = 0
+
+    def start(self):
+        self.process = FakeProcess()
+
+    def stop(self):
+        self.stopped += 1
+        self.process.returncode = 0
+
+
+class TestLocalDriverService(TestCase):
+
+    def setUp(self):
+        self.remote = FakeRemoteServer()
+        self.remote.start()
+        self.service = FakeService(self.remote.url)
+        nose_selenium._DRIVER_SERVICES['CHROME'] = \
+            LocalDriverService(self.service)
+        self.config = SeleniumConfig(BROWSER_LOCATION='local',
+                                     BROWSER='CHROME', TIMEOUT=0,
+                                     LOCAL_DRIVER_SERVICE=True)
+
+    def tearDown(self):
+        stop_local_driver_services()
+        close_connection_pools()
+        self.remote.stop()
+
+    def test_sessions_share_one_service(self):
+        first = build_webdriver(config=self.config)
+        second = build_webdriver(config=self.config)
+        self.assertEqual(len(self.remote.sessions), 2)
+        self.assertEqual(nose_selenium._DRIVER_SERVICES['CHROME'].starts, 1)
+        self.assertEqual(first.capabilities['browserName'], 'chrome')
+        first.quit()
+        second.quit()
+        self.assertEqual(self.remote.sessions, {})
+        self.assertEqual(self.service.stopped, 0)
+
+    def test_stopped_at_the_end(self):
+        build_webdriver(config=self.config).quit()
+        stop_local_driver_services()
+        self.assertEqual(self.service.stopped, 1)
+        self.assertEqual(nose_selenium._DRIVER_SERVICES, {})
+
+    def test_restarted_when_it_dies(self):
+        service = nose_selenium._DRIVER_SERVICES['CHROME']
+        build_webdriver(config=self.config).quit()
+        self.service.process.returncode = 1
+        build_webdriver(config=self.config).quit()
+        self.assertEqual(service.starts, 2)
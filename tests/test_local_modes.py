@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+from unittest2 import TestCase
+from selenium import webdriver
+import nose_selenium
+from nose_selenium import SeleniumConfig, build_webdriver, local_capabilities
+
+
+class FakeDriver(object):
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.capabilities = {}
+
+    def implicitly_wait(self, seconds):
+        pass
+
+
+class FakeFirefoxBinary(object):
+
+    def __init__(self):
+        self.command_line = None
+
+    def add_command_line_options(self, *args):
+        self.command_line = args
+
+
+class TestLocalCapabilities(TestCase):
+
+    def test_defaults_left_to_the_driver(self):
+        self.assertEqual(local_capabilities('CHROME'), None)
+        self.assertEqual(local_capabilities('FIREFOX', lightweight=True), None)
+
+    def test_headless_chrome(self):
+        desired = local_capabilities('HEADLESS_CHROME')
+        self.assertEqual(desired['browserName'], 'chrome')
+        self.assertEqual(desired['chromeOptions']['args'],
+                         ['--headless', '--disable-gpu'])
+
+    def test_lightweight_chrome_keeps_own_options(self):
+        desired = local_capabilities('CHROME', {'chromeOptions': {
+            'args': ['--lang=de'],
+            'prefs': {'profile.managed_default_content_settings.images': 1}}},
+            lightweight=True)
+        options = desired['chromeOptions']
+        self.assertEqual(options['args'][-1], '--lang=de')
+        self.assertIn('--disable-extensions', options['args'])
+        self.assertEqual(
+            options['prefs']['profile.managed_default_content_settings.images'], 1)
+
+
+class TestLocalModes(TestCase):
+
+    def setUp(self):
+        self.saved = (webdriver.Chrome, webdriver.Firefox, webdriver.PhantomJS,
+                      nose_selenium.FirefoxBinary,
+                      nose_selenium.FIREFOX_PROFILE_CACHE_PATH)
+        webdriver.Chrome = webdriver.Firefox = webdriver.PhantomJS = FakeDriver
+        nose_selenium.FirefoxBinary = FakeFirefoxBinary
+        nose_selenium.FIREFOX_PROFILE_CACHE_PATH = tempfile.mkdtemp()
+
+    def tearDown(self):
+        nose_selenium.remove_firefox_profile_clones()
+        nose_selenium._PROFILE_TEMPLATES.clear()
+        shutil.rmtree(nose_selenium.FIREFOX_PROFILE_CACHE_PATH)
+        (webdriver.Chrome, webdriver.Firefox, webdriver.PhantomJS,
+         nose_selenium.FirefoxBinary,
+         nose_selenium.FIREFOX_PROFILE_CACHE_PATH) = self.saved
+
+    def build(self, browser, **settings):
+        return build_webdriver(config=SeleniumConfig(
+            BROWSER_LOCATION='local', BROWSER=browser, TIMEOUT=0, **settings))
+
+    def test_headless_chrome(self):
+        wd = self.build('HEADLESS_CHROME')
+        self.assertIn('--headless',
+                      wd.kwargs['desired_capabilities']['chromeOptions']['args'])
+
+    def test_headless_firefox(self):
+        binary = self.build('HEADLESS_FIREFOX').kwargs['firefox_binary']
+        self.assertEqual(binary.command_line, ('-headless',))
+
+    def test_headless_firefox_rejects_marionette(self):
+        self.assertRaises(TypeError, build_webdriver,
+                          capabilities={'marionette': True},
+                          config=SeleniumConfig(BROWSER_LOCATION='local',
+                                                BROWSER='HEADLESS_FIREFOX',
+                                                TIMEOUT=0))
+
+    def test_lightweight_phantomjs(self):
+        wd = self.build('PHANTOMJS', LIGHTWEIGHT_BROWSER=True)
+        self.assertEqual(wd.kwargs['service_args'], ['--load-images=false'])
+
+    def test_lightweight_firefox_uses_profile_template(self):
+        wd = self.build('FIREFOX', LIGHTWEIGHT_BROWSER=True)
+        profile = wd.kwargs['firefox_profile']
+        self.assertEqual(profile.default_preferences['permissions.default.image'], 2)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from optparse import OptionParser
+from nose.config import Config
+from unittest2 import TestCase
+import nose_selenium
+from nose_selenium import ArtifactStore, NoseSelenium, current_config, \
+    flush_failure_artifacts
+from helpers import SavedGlobals
+
+
+class TestMultiprocess(SavedGlobals, TestCase):
+    """configure() as nose's multiprocess plugin runs it: once in the
+    parent, with multiprocess_workers set, then again in every worker,
+    with conf.worker set."""
+
+    saved_globals = nose_selenium.CONFIG_SETTINGS + [
+        'CONFIG', '_FACTORY', '_WORKER_ID', 'start_webdriver_pool']
+
+    def setUp(self):
+        super(TestMultiprocess, self).setUp()
+        self.saved_run_id = os.environ.pop('NOSE_SELENIUM_RUN_ID', None)
+        self.pools = []
+        nose_selenium.start_webdriver_pool = self.pools.append
+
+    def tearDown(self):
+        if self.saved_run_id is None:
+            os.environ.pop('NOSE_SELENIUM_RUN_ID', None)
+        else:
+            os.environ['NOSE_SELENIUM_RUN_ID'] = self.saved_run_id
+        super(TestMultiprocess, self).tearDown()
+
+    def configure(self, worker):
+        plugin = NoseSelenium()
+        parser = OptionParser()
+        plugin.add_options(parser, env={})
+        options, args = parser.parse_args([
+            '--with-nose-selenium', '--browser-location=remote',
+            '--remote-address=127.0.0.1', '--browser=FIREFOX',
+            '--session-pool=2'])
+        options.multiprocess_workers = 2
+        conf = Config()
+        if worker:
+            conf.worker = True
+        plugin.configure(options, conf)
+        return plugin
+
+    def test_parent_skips_the_session_pool(self):
+        plugin = self.configure(worker=False)
+        self.assertTrue(plugin.parent_of_workers)
+        self.assertEqual(self.pools, [])
+        self.assertEqual(nose_selenium._WORKER_ID, None)
+
+    def test_worker_has_its_own_session_pool(self):
+        plugin = self.configure(worker=True)
+        self.assertFalse(plugin.parent_of_workers)
+        self.assertEqual(self.pools, [2])
+        self.assertEqual(nose_selenium._WORKER_ID, 'w%d' % os.getpid())
+
+    def test_workers_inherit_the_run_id(self):
+        self.configure(worker=False)
+        run_id = os.environ['NOSE_SELENIUM_RUN_ID']
+        self.assertEqual(nose_selenium._run_id(), run_id)
+        # a worker process started now shares the parent's lock directory
+        script = ("import nose_selenium\n"
+                  "print(nose_selenium._run_lock_dir())\n")
+        output = subprocess.Popen([sys.executable, '-c', script],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(output.strip(), nose_selenium._run_lock_dir())
+        self.assertTrue(nose_selenium._run_lock_dir().endswith(run_id))
+
+    def test_worker_id_recorded_with_artifacts(self):
+        self.configure(worker=True)
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        nose_selenium._queue_failure_artifacts(
+            'iVBORw0KGgo=', '<html></html>', 'http://localhost/', 'click',
+            current_config().replace(SAVED_FILES_PATH=path))
+        flush_failure_artifacts()
+        entries = list(ArtifactStore(path).entries())
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['worker'], 'w%d' % os.getpid())
+        self.assertEqual(entries[0]['run'], nose_selenium._run_id())
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from unittest2 import TestCase
+from selenium.common.exceptions import NoSuchElementException, \
+    TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+from nose_selenium import ScreenshotOnExceptionWebDriver, SeleniumConfig, \
+    flush_failure_artifacts, query_elements
+
+
+class ScriptedWebDriver(object):
+    """Answers execute_script with canned results."""
+
+    def __init__(self, results):
+        self.results = results
+        self.scripts = []
+
+    def execute_script(self, script, *args):
+        self.scripts.append(args)
+        return self.results
+
+
+class MissingElementsWebDriver(ScreenshotOnExceptionWebDriver):
+    """A ScreenshotOnExceptionWebDriver without a session, on whose page
+    no element is ever found."""
+
+    page_source = '<html></html>'
+    current_url = 'http://localhost/missing'
+
+    def __init__(self, config):
+        self._nose_selenium_config = config
+
+    def execute_script(self, script, *args):
+        return [None] * len(args[0])
+
+    def get_screenshot_as_base64(self):
+        return 'iVBORw0KGgo='
+
+
+class TestQueryElements(TestCase):
+
+    def test_one_round_trip(self):
+        wd = ScriptedWebDriver(None)
+        queries = {
+            ('css selector', 'h1'): ['text'],
+            ('link text', 'Anchor text'): ['href', 'visible'],
+        }
+        # results come back in the order the locators were sent
+        wd.results = [
+            {'text': 'Success!'} if spec == ('css selector', 'h1')
+            else {'href': 'http://localhost/#', 'visible': True}
+            for spec in queries.keys()]
+        results = query_elements(wd, queries)
+        self.assertEqual(len(wd.scripts), 1)
+        self.assertEqual(results[('css selector', 'h1')]['text'], 'Success!')
+        self.assertEqual(results[('link text', 'Anchor text')]['visible'], True)
+
+    def test_missing_element(self):
+        wd = ScriptedWebDriver([None])
+        try:
+            query_elements(wd, {('id', 'this-does-not-exist'): ['text']})
+        except NoSuchElementException as e:
+            self.assertIn('this-does-not-exist', e.msg)
+        else:
+            self.fail("NoSuchElementException not raised")
+
+    def test_invalid_strategy(self):
+        wd = ScriptedWebDriver([])
+        self.assertRaises(TypeError, query_elements, wd,
+                          {('jquery', '#foo'): ['text']})
+
+
+class TestQueryElementsArtifacts(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.wd = MissingElementsWebDriver(
+            SeleniumConfig(SAVED_FILES_PATH=self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def saved_files(self):
+        flush_failure_artifacts()
+        return sorted(os.path.splitext(name)[1]
+                      for root, dirs, files in os.walk(self.path)
+                      for name in files if name != 'manifest.jsonl')
+
+    def test_missing_element_saves_screenshot_and_html(self):
+        self.assertRaises(NoSuchElementException, self.wd.query_elements,
+                          {('id', 'missing'): ['text']})
+        self.assertEqual(self.saved_files(), ['.html', '.png'])
+
+    def test_nothing_saved_in_explicit_wait(self):
+        wait = WebDriverWait(self.wd, 0.05, poll_frequency=0.01)
+        self.assertRaises(TimeoutException, wait.until, lambda wd:
+                          wd.query_elements({('id', 'missing'): ['text']}))
+        self.assertRaises(TimeoutException, wait.until, lambda wd:
+                          query_elements(wd, {('id', 'missing'): ['text']}))
+        self.assertEqual(self.saved_files(), [])
@@ -0,0 +1,71 @@
+import errno
+import os
+import shutil
+import tempfile
+from unittest2 import TestCase
+import nose_selenium
+from helpers import SavedGlobals
+
+
+class SauceCatalogueBase(SavedGlobals, TestCase):
+    saved_globals = ['SAUCE_CACHE_PATH', 'SAUCE_BROWSERS_FILE',
+                     'SAUCE_CACHE_TTL', 'SAUCE_OFFLINE']
+
+    def setUp(self):
+        super(SauceCatalogueBase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        nose_selenium.SAUCE_CACHE_PATH = os.path.join(self.tmpdir, 'cache.json')
+        nose_selenium.SAUCE_BROWSERS_FILE = None
+        nose_selenium.SAUCE_CACHE_TTL = 60
+        nose_selenium.SAUCE_OFFLINE = False
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(SauceCatalogueBase, self).tearDown()
+
+
+class TestSauceCatalogue(SauceCatalogueBase):
+
+    def test_browsers_file(self):
+        nose_selenium.SAUCE_BROWSERS_FILE = 'tests/sauce_browsers.json'
+        browsers, oses, combos = nose_selenium.load_sauce_catalogue()
+        self.assertEqual(sorted(browsers),
+                         ['chrome', 'firefox', 'internet explorer', 'safari'])
+        self.assertIn('Linux', oses)
+        self.assertIn("Linux\t\tfirefox\t\t19", combos)
+
+    def test_fresh_cache_is_used(self):
+        catalogue = (['firefox'], ['Linux'], ["Linux\t\tfirefox\t\t19"])
+        nose_selenium._write_sauce_cache(catalogue)
+        self.assertEqual(nose_selenium.load_sauce_catalogue(), catalogue)
+
+    def test_cache_replaced_where_rename_wont_overwrite(self):
+        nose_selenium._write_sauce_cache((['firefox'], ['Linux'], []))
+        rename = os.rename
+
+        def windows_rename(source, destination):
+            if os.path.exists(destination):
+                raise OSError(errno.EEXIST, "File exists")
+            rename(source, destination)
+        os.rename = windows_rename
+        try:
+            catalogue = (['chrome'], ['Windows 10'],
+                         ["Windows 10\t\tchrome\t\t50"])
+            nose_selenium._write_sauce_cache(catalogue)
+        finally:
+            os.rename = rename
+        self.assertEqual(nose_selenium.load_sauce_catalogue(), catalogue)
+        self.assertEqual(os.listdir(os.path.dirname(
+            nose_selenium.SAUCE_CACHE_PATH)), [os.path.basename(
+                nose_selenium.SAUCE_CACHE_PATH)])
+
+    def test_offline_uses_stale_cache(self):
+        catalogue = (['firefox'], ['Linux'], ["Linux\t\tfirefox\t\t19"])
+        nose_selenium._write_sauce_cache(catalogue)
+        nose_selenium.SAUCE_CACHE_TTL = 0
+        nose_selenium.SAUCE_OFFLINE = True
+        self.assertEqual(nose_selenium.load_sauce_catalogue(), catalogue)
+
+    def test_offline_without_cache(self):
+        nose_selenium.SAUCE_OFFLINE = True
+        self.assertRaises(TypeError, nose_selenium.load_sauce_catalogue)
@@ -0,0 +1,62 @@
+import threading
+import time
+from unittest2 import TestCase
+from nose_selenium import WebDriverPool
+from helpers import FakeWebDriver
+
+
+class TestWebDriverPool(TestCase):
+
+    def setUp(self):
+        self.built = []
+        self.lock = threading.Lock()
+        self.pool = WebDriverPool(2, factory=self.factory, timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def factory(self):
+        wd = FakeWebDriver()
+        with self.lock:
+            self.built.append(wd)
+        return wd
+
+    def test_sessions_boot_in_background(self):
+        self.pool.start()
+        first = self.pool.checkout()
+        second = self.pool.checkout()
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(self.built), 2)
+        self.assertEqual(len(self.pool.wait_times), 2)
+
+    def test_checkin_reuses_session(self):
+        self.pool.start()
+        wd = self.pool.checkout()
+        self.pool.checkin(wd)
+        self.assertEqual(wd.url, 'about:blank')
+        self.pool.checkout()
+        self.pool.checkout()
+        self.assertEqual(len(self.built), 2)
+
+    def test_discard_refills_in_background(self):
+        self.pool.start()
+        wd = self.pool.checkout()
+        self.pool.discard(wd)
+        self.assertTrue(wd.quit_called)
+        self.pool.checkout()
+        self.pool.checkout()
+        self.assertEqual(len(self.built), 3)
+
+    def test_build_errors_reach_checkout(self):
+        def broken():
+            raise ValueError("no browser")
+        pool = WebDriverPool(1, factory=broken, timeout=5)
+        pool.start()
+        self.assertRaises(ValueError, pool.checkout)
+
+    def test_close_quits_idle_sessions(self):
+        self.pool.start()
+        wd = self.pool.checkout()
+        self.pool.checkin(wd)
+        self.pool.close()
+        self.assertTrue(wd.quit_called)
@@ -0,0 +1,112 @@
+import time
+from unittest2 import TestCase
+import nose_selenium
+from nose_selenium import SessionRecycler, WebDriverPool, \
+    acquire_webdriver, close_webdriver_sessions
+from helpers import FakeSessions, FakeWebDriver
+
+
+class RecyclingBase(FakeSessions, TestCase):
+    saved_globals = ['SESSION_MAX_USES', 'SESSION_MAX_AGE', '_RECYCLER']
+
+    def setUp(self):
+        super(RecyclingBase, self).setUp()
+        nose_selenium.SESSION_MAX_USES = 0
+        nose_selenium.SESSION_MAX_AGE = 0
+        nose_selenium._RECYCLER = SessionRecycler()
+
+
+class TestSessionRecycler(RecyclingBase):
+
+    def test_max_uses(self):
+        nose_selenium.SESSION_MAX_USES = 2
+        recycler = nose_selenium._RECYCLER
+        wd = recycler.handed_out(FakeWebDriver())
+        self.assertEqual(recycler.retire_reason(wd), None)
+        recycler.handed_out(wd)
+        self.assertEqual(recycler.retire_reason(wd), 'max-uses')
+
+    def test_max_age(self):
+        nose_selenium.SESSION_MAX_AGE = 60
+        recycler = nose_selenium._RECYCLER
+        wd = recycler.handed_out(FakeWebDriver())
+        self.assertEqual(recycler.retire_reason(wd), None)
+        wd._nose_selenium_born = time.time() - 61
+        self.assertEqual(recycler.retire_reason(wd), 'max-age')
+
+    def test_dead_session(self):
+        recycler = nose_selenium._RECYCLER
+        wd = recycler.handed_out(FakeWebDriver())
+        wd.alive = False
+        self.assertEqual(recycler.retire_reason(wd), 'dead')
+        self.assertEqual(recycler.retire_reason(wd, probe=False), None)
+
+    def test_reused_session_replaced_after_max_uses(self):
+        nose_selenium.SESSION_MAX_USES = 2
+        first = acquire_webdriver('class', RecyclingBase)
+        self.assertTrue(acquire_webdriver('class', RecyclingBase) is first)
+        third = acquire_webdriver('class', RecyclingBase)
+        self.assertFalse(third is first)
+        self.assertEqual(nose_selenium._RECYCLER.reasons, {'max-uses': 1})
+        # the stale session is quit on a background thread
+        for i in range(50):
+            if first.quit_called:
+                break
+            time.sleep(0.01)
+        self.assertTrue(first.quit_called)
+
+    def test_replacement_boots_during_the_last_use(self):
+        nose_selenium.SESSION_MAX_USES = 2
+        first = acquire_webdriver('class', RecyclingBase)
+        acquire_webdriver('class', RecyclingBase)
+        for i in range(50):
+            if len(self.built) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.built), 2)
+        self.assertTrue(acquire_webdriver('class', RecyclingBase) is
+                        self.built[1])
+        self.assertEqual(len(self.built), 2)
+
+    def test_unused_replacement_quit_with_its_class(self):
+        nose_selenium.SESSION_MAX_USES = 1
+        acquire_webdriver('class', RecyclingBase)
+        close_webdriver_sessions(RecyclingBase)
+        self.assertEqual(len(self.built), 2)
+        self.assertTrue(all(wd.quit_called for wd in self.built))
+        self.assertEqual(nose_selenium._REPLACEMENTS, {})
+
+    def test_dead_reused_session_replaced(self):
+        first = acquire_webdriver('module', RecyclingBase)
+        first.alive = False
+        self.assertFalse(acquire_webdriver('module', RecyclingBase) is first)
+        self.assertEqual(nose_selenium._RECYCLER.reasons, {'dead': 1})
+
+
+class TestPoolRecycling(RecyclingBase):
+
+    def setUp(self):
+        super(TestPoolRecycling, self).setUp()
+        self.pool = WebDriverPool(1, factory=self.build_webdriver, timeout=5)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.close()
+        super(TestPoolRecycling, self).tearDown()
+
+    def test_dead_idle_session_replaced_on_checkout(self):
+        wd = nose_selenium._RECYCLER.handed_out(self.pool.checkout())
+        self.pool.checkin(wd)
+        wd.alive = False
+        replacement = self.pool.checkout()
+        self.assertFalse(replacement is wd)
+        self.assertTrue(wd.quit_called)
+        self.assertEqual(nose_selenium._RECYCLER.reasons, {'dead': 1})
+
+    def test_worn_out_session_not_checked_in(self):
+        nose_selenium.SESSION_MAX_USES = 1
+        wd = nose_selenium._RECYCLER.handed_out(self.pool.checkout())
+        self.pool.checkin(wd)
+        self.assertTrue(wd.quit_called)
+        self.assertFalse(self.pool.checkout() is wd)
+        self.assertEqual(len(self.built), 2)
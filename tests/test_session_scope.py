@@ -0,0 +1,112 @@
+from nose.plugins import PluginTester
+from unittest2 import TestCase
+import nose_selenium
+from nose_selenium import NoseSelenium, SeleniumTestCase
+from helpers import FakeSessions
+
+# what the tests below saw and when their sessions were quit, in order
+EVENTS = []
+
+
+class ClassScoped(SeleniumTestCase):
+    __test__ = False
+    session_scope = 'class'
+
+    def test_1(self):
+        EVENTS.append(('test', 'class-1', self.wd))
+
+    def test_2_fails(self):
+        EVENTS.append(('test', 'class-2', self.wd))
+        self.fail("the session is discarded")
+
+    def test_3(self):
+        EVENTS.append(('test', 'class-3', self.wd))
+
+
+class ModuleScopedA(SeleniumTestCase):
+    __test__ = False
+    session_scope = 'module'
+
+    def test_a(self):
+        EVENTS.append(('test', 'module-a', self.wd))
+
+
+class ModuleScopedB(SeleniumTestCase):
+    __test__ = False
+    session_scope = 'module'
+
+    def test_b(self):
+        EVENTS.append(('test', 'module-b', self.wd))
+
+
+class TestSessionScopes(FakeSessions, PluginTester, TestCase):
+    """Class and module scoped sessions through a nose run, with
+    FakeWebDrivers."""
+    activate = '--with-nose-selenium'
+    plugins = [NoseSelenium()]
+    args = ['--browser-location=remote', '--remote-address=127.0.0.1',
+            '--browser=FIREFOX']
+    saved_globals = nose_selenium.CONFIG_SETTINGS + ['CONFIG', '_FACTORY']
+
+    def setUp(self):
+        del EVENTS[:]
+        self.saved_close = nose_selenium.close_webdriver_sessions
+        nose_selenium.close_webdriver_sessions = self.close_webdriver_sessions
+        super(TestSessionScopes, self).setUp()
+
+    def tearDown(self):
+        nose_selenium.close_webdriver_sessions = self.saved_close
+        super(TestSessionScopes, self).tearDown()
+
+    def makeSuite(self):
+        return [ClassScoped('test_1'), ClassScoped('test_2_fails'),
+                ClassScoped('test_3'), ModuleScopedA('test_a'),
+                ModuleScopedB('test_b')]
+
+    def close_webdriver_sessions(self, context=None):
+        EVENTS.append(('close', context, None))
+        self.saved_close(context)
+
+    def build_webdriver(self, *args, **kwargs):
+        wd = super(TestSessionScopes, self).build_webdriver(*args, **kwargs)
+        quit = wd.quit
+
+        def logged_quit():
+            EVENTS.append(('quit', None, wd))
+            quit()
+        wd.quit = logged_quit
+        return wd
+
+    def session(self, name):
+        return [wd for event, test, wd in EVENTS if test == name][0]
+
+    def index(self, event, name=None, wd=None):
+        return EVENTS.index([entry for entry in EVENTS
+                             if entry[0] == event and
+                             (name is None or entry[1] == name) and
+                             (wd is None or entry[2] is wd)][0])
+
+    def test_session_reused_within_class(self):
+        self.assertTrue(self.session('class-1') is self.session('class-2'))
+
+    def test_failed_test_discards_session(self):
+        failed = self.session('class-2')
+        self.assertTrue(self.session('class-3') is not failed)
+        self.assertTrue(self.index('quit', wd=failed) <
+                        self.index('test', 'class-3'))
+
+    def test_class_session_quit_at_class_teardown(self):
+        wd = self.session('class-3')
+        self.assertTrue(self.index('test', 'class-3') <
+                        self.index('quit', wd=wd) <
+                        self.index('test', 'module-a'))
+
+    def test_module_session_shared_and_quit_at_module_teardown(self):
+        wd = self.session('module-a')
+        self.assertTrue(self.session('module-b') is wd)
+        # before the sessions left at the end of the run are closed
+        self.assertTrue(self.index('test', 'module-b') <
+                        self.index('quit', wd=wd) <
+                        EVENTS.index(('close', None, None)))
+        self.assertEqual(len(self.built), 3)
+        self.assertTrue(all(wd.quit_called for wd in self.built))
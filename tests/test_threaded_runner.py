@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+from nose.plugins import PluginTester
+from nose.plugins.capture import Capture
+from nose.plugins.logcapture import LogCapture
+from unittest2 import TestCase, TestSuite
+import nose_selenium
+from nose_selenium import NoseSelenium, SeleniumTestCase, ThreadedSuite, \
+    TestThreads, close_connection_pools, run_in_threads
+from fake_remote import FakeRemoteServer
+from helpers import FakeSessions, FakeWebDriver, SavedGlobals
+
+
+class Rendezvous(object):
+    """Lets `parties` threads through once all of them have arrived."""
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.arrived = 0
+        self.condition = threading.Condition()
+
+    def wait(self, timeout=5):
+        deadline = time.time() + timeout
+        with self.condition:
+            self.arrived += 1
+            self.condition.notify_all()
+            while self.arrived < self.parties:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise AssertionError("tests did not run concurrently")
+                self.condition.wait(remaining)
+
+
+class ThreadedCase(SeleniumTestCase):
+    __test__ = False
+    rendezvous = None
+
+    def test_one(self):
+        self.wd.threads.add(threading.current_thread().name)
+        if self.rendezvous is not None:
+            self.rendezvous.wait()
+
+    test_two = test_three = test_four = test_five = test_six = test_one
+
+
+class PlainCase(TestCase):
+    __test__ = False
+
+    def test_main_thread(self):
+        self.assertEqual(threading.current_thread().name, 'MainThread')
+
+
+class TestThreadedRunner(FakeSessions, TestCase):
+
+    def setUp(self):
+        super(TestThreadedRunner, self).setUp()
+        self.threads = TestThreads(3)
+        self.threads.start()
+
+    def tearDown(self):
+        self.threads.stop()
+        ThreadedCase.rendezvous = None
+        ThreadedCase.session_scope = None
+        super(TestThreadedRunner, self).tearDown()
+
+    def suite(self, names):
+        return TestSuite([ThreadedCase(name) for name in names])
+
+    def test_selenium_tests_run_concurrently(self):
+        ThreadedCase.rendezvous = Rendezvous(3)
+        suite = self.suite(['test_one', 'test_two', 'test_three'])
+        run_in_threads(suite, self.threads)
+        result = self.defaultTestResult()
+        suite.run(result)
+        self.assertEqual(result.testsRun, 3)
+        self.assertEqual(result.failures + result.errors, [])
+
+    def test_other_tests_stay_on_main_thread(self):
+        suite = TestSuite([ThreadedCase('test_one'),
+                           PlainCase('test_main_thread'),
+                           ThreadedCase('test_two')])
+        run_in_threads(suite, self.threads)
+        self.assertEqual([type(test) for test in suite],
+                         [ThreadedSuite, PlainCase, ThreadedSuite])
+        result = self.defaultTestResult()
+        suite.run(result)
+        self.assertEqual(result.testsRun, 3)
+        self.assertEqual(result.failures + result.errors, [])
+
+    def test_each_worker_owns_its_sessions(self):
+        ThreadedCase.session_scope = 'class'
+        suite = self.suite(['test_one', 'test_two', 'test_three',
+                            'test_four', 'test_five', 'test_six'])
+        run_in_threads(suite, self.threads)
+        result = self.defaultTestResult()
+        suite.run(result)
+        self.assertEqual(result.testsRun, 6)
+        self.assertTrue(1 <= len(self.built) <= 3)
+        for wd in self.built:
+            self.assertEqual(len(wd.threads), 1)
+
+
+class TestResultLock(TestCase):
+
+    def test_failed_session_quit_outside_the_lock(self):
+        lock = threading.Lock()
+        plugin = NoseSelenium()
+        held = []
+
+        class LockCheckingWebDriver(FakeWebDriver):
+            def quit(self):
+                held.append(not lock.acquire(False))
+                if not held[-1]:
+                    lock.release()
+
+        class Result(object):
+            def addFailure(self, test, err):
+                plugin.addFailure(test, err)
+                # still to come, after the lock is released
+                self.quits = list(held)
+
+        test = ThreadedCase('test_one')
+        test.wd = LockCheckingWebDriver()
+        result = Result()
+        nose_selenium._LockedResult(result, lock).addFailure(test, None)
+        self.assertEqual(held, [False])
+        self.assertEqual(result.quits, [])
+        self.assertEqual(test.wd, None)
+
+
+class ThreadedPluginCase(SeleniumTestCase):
+
+    def test_title(self):
+        self.wd.get('http://localhost/')
+        self.assertEqual(self.wd.title, 'Fake page')
+
+    def test_fails(self):
+        self.fail("expected")
+
+    test_title_again = test_title
+
+
+ThreadedPluginCase.__test__ = False
+
+
+class TestThreadedRun(SavedGlobals, PluginTester, TestCase):
+    activate = '--with-nose-selenium'
+    plugins = [NoseSelenium()]
+    saved_globals = ['BROWSER_LOCATION', 'BROWSER', 'REMOTE_ADDRESS',
+                     'REMOTE_PORT', 'HTTP_POOL_SIZE', 'HTTP_TIMEOUT', 'THREADS']
+
+    def setUp(self):
+        self.remote = FakeRemoteServer()
+        self.remote.start()
+        self.args = ['--browser-location=remote', '--browser=FIREFOX',
+                     '--remote-address=127.0.0.1', '--threads=2',
+                     '--remote-port=%d' % self.remote.port]
+        super(TestThreadedRun, self).setUp()
+
+    def tearDown(self):
+        close_connection_pools()
+        self.remote.stop()
+        super(TestThreadedRun, self).tearDown()
+
+    def makeSuite(self):
+        # a list, so nose wraps each test and plugins see its results
+        return [ThreadedPluginCase('test_title'),
+                ThreadedPluginCase('test_fails'),
+                ThreadedPluginCase('test_title_again')]
+
+    def test_results_reported(self):
+        output = str(self.output)
+        self.assertIn("Ran 3 tests", output)
+        self.assertIn("FAILED (failures=1)", output)
+        self.assertIn("AssertionError: expected", output)
+        self.assertEqual(self.remote.sessions, {})
+        self.assertEqual(nose_selenium._TEST_THREADS, None)
+
+
+class CapturedCase(SeleniumTestCase):
+    rendezvous = None
+
+    def check_output(self, name):
+        print("stdout of %s" % name)
+        logging.getLogger('captured').warning("log of %s" % name)
+        # all three are running now, between beforeTest and afterTest
+        self.rendezvous.wait()
+        print("more stdout of %s" % name)
+        self.fail("expected")
+
+    def test_a(self):
+        self.check_output('a')
+
+    def test_b(self):
+        self.check_output('b')
+
+    def test_c(self):
+        self.check_output('c')
+
+
+CapturedCase.__test__ = False
+
+
+class TestThreadedCapture(SavedGlobals, PluginTester, TestCase):
+    activate = '--with-nose-selenium'
+    plugins = [NoseSelenium(), Capture(), LogCapture()]
+    saved_globals = ['BROWSER_LOCATION', 'BROWSER', 'REMOTE_ADDRESS',
+                     'REMOTE_PORT', 'HTTP_POOL_SIZE', 'HTTP_TIMEOUT', 'THREADS']
+
+    def setUp(self):
+        self.remote = FakeRemoteServer()
+        self.remote.start()
+        self.args = ['--browser-location=remote', '--browser=FIREFOX',
+                     '--remote-address=127.0.0.1', '--threads=3',
+                     '--remote-port=%d' % self.remote.port]
+        CapturedCase.rendezvous = Rendezvous(3)
+        super(TestThreadedCapture, self).setUp()
+
+    def tearDown(self):
+        CapturedCase.rendezvous = None
+        close_connection_pools()
+        self.remote.stop()
+        super(TestThreadedCapture, self).tearDown()
+
+    def makeSuite(self):
+        return [CapturedCase('test_a'), CapturedCase('test_b'),
+                CapturedCase('test_c')]
+
+    def test_each_test_has_its_own_output(self):
+        output = str(self.output)
+        self.assertIn("FAILED (failures=3)", output)
+        reports = output.split("=" * 70)[1:]
+        self.assertEqual(len(reports), 3)
+        for report in reports:
+            name = report.split("(")[0].split("test_")[1].strip()
+            self.assertIn("stdout of %s\nmore stdout of %s" % (name, name),
+                          report)
+            self.assertIn("captured: WARNING: log of %s" % name, report)
+            for other in set('abc') - set(name):
+                self.assertNotIn("of %s" % other, report)
@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+from StringIO import StringIO
+from unittest2 import TestCase
+from unittest2.runner import _WritelnDecorator
+from nose_selenium import LatencyHistogram, CommandStats, PhaseTimings, _test_context
+
+
+class TestLatencyHistogram(TestCase):
+
+    def test_percentiles_within_a_bucket(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000.0)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(50), 0.050, delta=0.050 * 0.05)
+        self.assertAlmostEqual(histogram.percentile(99), 0.099, delta=0.099 * 0.05)
+        self.assertEqual(histogram.percentile(100), 0.1)
+        self.assertEqual(histogram.max, 0.1)
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(50), 0.0)
+
+
+class TestCommandStats(TestCase):
+
+    def setUp(self):
+        self.stats = CommandStats()
+        _test_context.test_id = 'tests.SlowTest'
+        self.stats.record('get', 2.0)
+        self.stats.record('findElement', 0.01)
+        _test_context.test_id = 'tests.FastTest'
+        self.stats.record('findElement', 0.03)
+        _test_context.test_id = None
+
+    def test_grouped_by_command_and_test(self):
+        stats = self.stats.as_dict()
+        self.assertEqual(stats['commands']['findElement']['count'], 2)
+        self.assertEqual(stats['commands']['get']['max'], 2.0)
+        self.assertEqual(stats['tests']['tests.SlowTest']['count'], 2)
+        self.assertEqual(stats['tests']['tests.FastTest']['count'], 1)
+
+    def test_report(self):
+        stream = _WritelnDecorator(StringIO())
+        self.stats.report(stream)
+        output = stream.getvalue()
+        self.assertIn('WebDriver command latency', output)
+        self.assertIn('findElement', output)
+        self.assertIn('tests.SlowTest', output)
+
+    def test_write_json(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.stats.write(filename)
+            stats = json.load(open(filename))
+        finally:
+            os.remove(filename)
+        self.assertEqual(stats['commands']['get']['count'], 1)
+
+
+class TestPhaseTimings(TestCase):
+
+    def setUp(self):
+        self.timings = PhaseTimings()
+        self.timings.add('tests.Slow', {'session': 6.0, 'configure': 1.0,
+                                        'body': 2.0, 'teardown': 1.0})
+        self.timings.add('tests.Fast', {'body': 2.0})
+
+    def test_overhead_share(self):
+        timings = self.timings.as_dict()
+        self.assertEqual(timings['total'], 12.0)
+        self.assertEqual(timings['totals']['session'], 6.0)
+        self.assertAlmostEqual(timings['session_overhead_share'], 8.0 / 12.0)
+
+    def test_report(self):
+        stream = _WritelnDecorator(StringIO())
+        self.timings.report(stream)
+        output = stream.getvalue()
+        self.assertIn('67% of SeleniumTestCase time was session overhead.', output)
+        self.assertLess(output.index('tests.Slow'), output.index('tests.Fast'))
@@ -0,0 +1,177 @@
+import time
+from unittest2 import TestCase
+from selenium.common.exceptions import NoSuchElementException, \
+    TimeoutException, WebDriverException
+import nose_selenium
+from nose_selenium import AdaptiveWait, ObserverWait, SeleniumConfig, \
+    WaitStats
+
+
+class PollCountingDriver(object):
+    """Finds its element on the `appears_after`th poll."""
+
+    def __init__(self, appears_after=None, script_values=None):
+        self.appears_after = appears_after
+        self.script_values = script_values or []
+        self.polls = []
+
+    def find_element_by_id(self, id_):
+        self.polls.append(time.time())
+        if self.appears_after is None or len(self.polls) < self.appears_after:
+            raise NoSuchElementException("no %s" % id_)
+        return id_
+
+    def execute_script(self, script):
+        self.polls.append(time.time())
+        return self.script_values.pop(0)
+
+
+class TestAdaptiveWait(TestCase):
+
+    def setUp(self):
+        self.saved_stats = nose_selenium._WAIT_STATS
+        nose_selenium._WAIT_STATS = WaitStats()
+
+    def tearDown(self):
+        nose_selenium._WAIT_STATS = self.saved_stats
+
+    def test_interval_backs_off(self):
+        driver = PollCountingDriver(appears_after=5)
+        wait = AdaptiveWait(driver, timeout=5, poll_frequency=0.01,
+                            backoff=2, max_poll_frequency=0.04)
+        self.assertEqual(wait.until(lambda d: d.find_element_by_id('x')), 'x')
+        gaps = [b - a for a, b in zip(driver.polls, driver.polls[1:])]
+        self.assertTrue(gaps[0] < gaps[2])
+        self.assertTrue(gaps[3] < 0.04 * 3)
+
+    def test_timeout(self):
+        driver = PollCountingDriver()
+        wait = AdaptiveWait(driver, timeout=0.1, poll_frequency=0.01)
+        self.assertRaises(TimeoutException, wait.until,
+                          lambda d: d.find_element_by_id('x'))
+        stats = nose_selenium._WAIT_STATS.as_dict()
+        self.assertEqual(stats['timed_out']['count'], 1)
+        self.assertTrue(stats['timed_out']['total'] >= 0.1)
+
+    def test_until_not_on_missing_element(self):
+        driver = PollCountingDriver()
+        wait = AdaptiveWait(driver, timeout=5, poll_frequency=0.01)
+        self.assertTrue(wait.until_not(lambda d: d.find_element_by_id('x')))
+        self.assertEqual(len(driver.polls), 1)
+
+    def test_until_scripts_one_round_trip_per_poll(self):
+        driver = PollCountingDriver(script_values=[
+            [True, False], [True, 0], [True, 'ready']])
+        wait = AdaptiveWait(driver, timeout=5, poll_frequency=0.01)
+        values = wait.until_scripts(["window.loaded", "document.title"])
+        self.assertEqual(values, [True, 'ready'])
+        self.assertEqual(len(driver.polls), 3)
+        self.assertEqual(nose_selenium._WAIT_STATS.as_dict()
+                         ['satisfied']['count'], 1)
+
+    def test_defaults_from_driver_config(self):
+        driver = PollCountingDriver()
+        driver._nose_selenium_config = SeleniumConfig(
+            TIMEOUT=7, WAIT_POLL=0.2, WAIT_BACKOFF=3, WAIT_POLL_MAX=2)
+        wait = AdaptiveWait(driver)
+        self.assertEqual((wait._timeout, wait._poll, wait._backoff,
+                          wait._max_poll), (7, 0.2, 3, 2))
+
+    def test_until_scripts_any(self):
+        driver = PollCountingDriver(script_values=[[False, 'x']])
+        wait = AdaptiveWait(driver, timeout=5, poll_frequency=0.01)
+        self.assertEqual(wait.until_scripts(["a", "b"], require_all=False),
+                         [False, 'x'])
+
+
+class ObservingDriver(object):
+    """Answers execute_async_script from a list of results; an exception
+    in the list is raised instead, like a page navigating away. Timeouts
+    block for as long as the browser would."""
+
+    def __init__(self, async_results, script_values=None):
+        self.async_results = async_results
+        self.script_values = script_values or []
+        self.script_timeouts = []
+        self.async_calls = 0
+        self.polls = 0
+
+    def set_script_timeout(self, seconds):
+        self.script_timeouts.append(seconds)
+
+    def execute_async_script(self, script, block):
+        self.async_calls += 1
+        result = self.async_results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        if result.get('timeout'):
+            time.sleep(block / 1000.0)
+        return result
+
+    def execute_script(self, script):
+        self.polls += 1
+        value = self.script_values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+class TestObserverWait(TestCase):
+
+    def test_condition_met_in_browser(self):
+        driver = ObservingDriver([{'timeout': True}, {'value': 'loaded'}])
+        wait = ObserverWait(driver, timeout=5, max_block=0.01)
+        self.assertEqual(wait.until_script("window.state"), 'loaded')
+        self.assertEqual(driver.async_calls, 2)
+        self.assertEqual(driver.polls, 0)
+        self.assertEqual(driver.script_timeouts, [5.01])
+
+    def test_puts_back_the_script_timeout(self):
+        driver = ObservingDriver([{'timeout': True}] * 10)
+        driver._nose_selenium_script_timeout = 12
+        wait = ObserverWait(driver, timeout=0.05, max_block=1)
+        self.assertRaises(TimeoutException, wait.until_script, "window.state")
+        self.assertEqual(driver.script_timeouts, [6, 12])
+
+    def test_observes_again_after_navigation(self):
+        unloaded = WebDriverException("document unloaded while waiting for result")
+        driver = ObservingDriver(
+            [unloaded, {'timeout': True}, {'value': 'loaded'}],
+            script_values=[unloaded, {'value': False}])
+        wait = ObserverWait(driver, timeout=5, poll_frequency=0.01,
+                            max_block=0.01)
+        self.assertEqual(wait.until_script("window.state"), 'loaded')
+        self.assertEqual(driver.polls, 2)
+        self.assertEqual(driver.async_calls, 3)
+
+    def test_raises_condition_errors(self):
+        driver = ObservingDriver(
+            [{'error': "ReferenceError: app is not defined"}])
+        driver._nose_selenium_script_timeout = 12
+        wait = ObserverWait(driver, timeout=5)
+        with self.assertRaises(WebDriverException) as caught:
+            wait.until_script("app.ready")
+        self.assertIn("ReferenceError", caught.exception.msg)
+        self.assertEqual(driver.async_calls, 1)
+        self.assertEqual(driver.script_timeouts, [15, 12])
+
+    def test_raises_syntax_errors(self):
+        driver = ObservingDriver(
+            [WebDriverException("SyntaxError: missing ) in parenthetical")])
+        wait = ObserverWait(driver, timeout=5)
+        self.assertRaises(WebDriverException, wait.until_script, "(")
+        self.assertEqual(driver.polls, 0)
+
+    def test_polls_without_mutation_observer(self):
+        driver = ObservingDriver([{'unsupported': True}],
+                                 script_values=[{'value': False},
+                                                {'value': 'loaded'}])
+        wait = ObserverWait(driver, timeout=5, poll_frequency=0.01)
+        self.assertEqual(wait.until_script("window.state"), 'loaded')
+        self.assertEqual(driver.polls, 2)
+        self.assertEqual(driver.async_calls, 1)
+
+    def test_timeout(self):
+        driver = ObservingDriver([{'timeout': True}] * 10)
+        wait = ObserverWait(driver, timeout=0.05, max_block=1)
+        self.assertRaises(TimeoutException, wait.until_script, "window.state")
@@ -0,0 +1,109 @@
+import gzip
+import httplib
+import os
+import shutil
+import tempfile
+import time
+from cStringIO import StringIO
+from unittest2 import TestCase
+from webserver import DEFAULT_PAGE, SimpleWebServer
+
+
+class TestSimpleWebServer(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'index.html'), 'w') as f:
+            f.write('<html><body>%s</body></html>' % ('fixture ' * 100))
+        with open(os.path.join(self.root, 'pixel.png'), 'wb') as f:
+            f.write('\x89PNG\r\n\x1a\n')
+        self.server = SimpleWebServer(port=0, root=self.root, threads=4)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.root)
+
+    def connect(self):
+        return httplib.HTTPConnection('127.0.0.1', self.server.port,
+                                      timeout=5)
+
+    def get(self, connection, path, headers={}):
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_serves_fixtures(self):
+        connection = self.connect()
+        response, body = self.get(connection, '/')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), 'text/html')
+        self.assertTrue(body.startswith('<html><body>fixture'))
+        response, body = self.get(connection, '/pixel.png')
+        self.assertEqual(response.getheader('Content-Type'), 'image/png')
+        self.assertEqual(body, '\x89PNG\r\n\x1a\n')
+        self.assertEqual(self.get(connection, '/missing.html')[0].status, 404)
+        self.assertEqual(self.get(connection, '/%2e%2e/etc/passwd')[0].status,
+                         404)
+        # all of it over one kept-alive connection
+        self.assertEqual(self.server.server.connections, 1)
+
+    def test_files_are_cached(self):
+        connection = self.connect()
+        first = self.get(connection, '/')[1]
+        with open(os.path.join(self.root, 'index.html'), 'w') as f:
+            f.write('changed')
+        self.assertEqual(self.get(connection, '/')[1], first)
+        self.server.fixtures.clear()
+        self.assertEqual(self.get(connection, '/')[1], 'changed')
+
+    def test_etag(self):
+        connection = self.connect()
+        response, body = self.get(connection, '/')
+        etag = response.getheader('ETag')
+        response, body = self.get(connection, '/', {'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, '')
+        response, body = self.get(connection, '/', {'If-None-Match': '"old"'})
+        self.assertEqual(response.status, 200)
+
+    def test_gzip(self):
+        connection = self.connect()
+        plain = self.get(connection, '/')[1]
+        response, body = self.get(connection, '/',
+                                  {'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertTrue(len(body) < len(plain))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(body)).read(), plain)
+        response, body = self.get(connection, '/',
+                                  {'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(response.getheader('Content-Encoding'), None)
+        # already compressed
+        response, body = self.get(connection, '/pixel.png',
+                                  {'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), None)
+
+    def test_connections_served_at_once(self):
+        connections = [self.connect() for i in range(4)]
+        for connection in connections:
+            self.assertEqual(self.get(connection, '/')[0].status, 200)
+        # every connection is still open, and still answered
+        for connection in connections:
+            self.assertEqual(self.get(connection, '/')[0].status, 200)
+        self.assertEqual(self.server.server.connections, 4)
+
+    def test_stops_quickly_with_connections_open(self):
+        connection = self.connect()
+        self.get(connection, '/')
+        start = time.time()
+        self.server.stop()
+        self.assertTrue(time.time() - start < 0.5)
+        self.server = SimpleWebServer(port=0)
+        self.server.start()
+
+    def test_default_page(self):
+        self.server.stop()
+        self.server = SimpleWebServer(port=0)
+        self.server.start()
+        self.assertEqual(self.get(self.connect(), '/anything')[1],
+                         DEFAULT_PAGE)
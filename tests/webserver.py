@@ -13,61 +13,268 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""A simple web server for testing purposes."""
+"""A simple web server for testing purposes.
 
+It serves the files in a directory of fixtures (or, without one, a single
+page at every path) from memory, to as many browsers at once as it has
+threads, and starts and stops quickly enough for every test module to
+have its own:
+
+    def setUpModule():
+        global server
+        server = SimpleWebServer(port=0, root='tests/fixtures')
+        server.start()
+
+    def tearDownModule():
+        server.stop()
+"""
+
+import gzip
+import hashlib
 import logging
+import mimetypes
 import os
+import Queue
 import socket
 import threading
 import urllib
+import urlparse
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from cStringIO import StringIO
 
 LOGGER = logging.getLogger(__name__)
 
 DEFAULT_PORT = 8000
+DEFAULT_THREADS = 16
+
+DEFAULT_PAGE = '<html><body><h1>Success!</h1><a href="#">Anchor text</a></body></html>'
+
+# types worth gzipping; images and fonts are compressed already
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml')
+
+
+def _gzip(body):
+    out = StringIO()
+    # mtime=0 so the same file always gzips to the same bytes
+    f = gzip.GzipFile(fileobj=out, mode='wb', mtime=0)
+    f.write(body)
+    f.close()
+    return out.getvalue()
+
+
+def _accepts_gzip(header):
+    for coding in (header or '').split(','):
+        parts = [part.strip() for part in coding.split(';')]
+        if parts[0] in ('gzip', '*'):
+            return not [part for part in parts[1:]
+                        if part.replace(' ', '') in ('q=0', 'q=0.0')]
+    return False
+
+
+class Fixture(object):
+    """A file's contents with its ETag and, if it is worth it, a gzipped
+    copy."""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.gzipped = None
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            gzipped = _gzip(body)
+            if len(gzipped) < len(body):
+                self.gzipped = gzipped
+
+
+class FixtureCache(object):
+    """Fixtures by URL path, read from the directory `root` the first
+    time they are asked for and kept in memory after that. Without a
+    root every path is DEFAULT_PAGE."""
+
+    def __init__(self, root=None):
+        self.root = root and os.path.abspath(root)
+        self._fixtures = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """The Fixture for a request path, None if there is no such
+        file."""
+        path = urllib.unquote(urlparse.urlsplit(path).path)
+        fixture = self._fixtures.get(path)
+        if fixture is None:
+            fixture = self._load(path)
+            if fixture is not None:
+                with self._lock:
+                    fixture = self._fixtures.setdefault(path, fixture)
+        return fixture
+
+    def clear(self):
+        """Forget what was read, for fixtures changed on disk."""
+        with self._lock:
+            self._fixtures.clear()
+
+    def _load(self, path):
+        if self.root is None:
+            return Fixture(DEFAULT_PAGE, 'text/html')
+        filename = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if filename != self.root and \
+                not filename.startswith(self.root + os.sep):
+            return None
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, 'index.html')
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        return Fixture(body, content_type)
 
 
-class HtmlOnlyHandler(BaseHTTPRequestHandler):
-    """Http handler."""
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Http handler serving the server's FixtureCache."""
+
+    protocol_version = 'HTTP/1.1'
+    # send each response in one write, not one per header line
+    wbufsize = -1
+    # seconds a kept-alive connection may sit idle holding a thread
+    timeout = 30
 
     def do_GET(self):
         """GET method handler."""
+        self._serve(True)
+
+    def do_HEAD(self):
+        """HEAD method handler."""
+        self._serve(False)
+
+    def _serve(self, send_body):
+        fixture = self.server.fixtures.get(self.path)
+        if fixture is None:
+            return self._send(404, 'text/plain', 'Not found', send_body)
+        etags = [etag.strip() for etag in
+                 (self.headers.getheader('If-None-Match') or '').split(',')]
+        headers = [('ETag', fixture.etag),
+                   # revalidate every time: fixtures change between runs
+                   ('Cache-Control', 'no-cache')]
+        if fixture.gzipped is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if fixture.etag in etags or '*' in etags:
+            self.send_response(304)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        body = fixture.body
+        if fixture.gzipped is not None and \
+                _accepts_gzip(self.headers.getheader('Accept-Encoding')):
+            body = fixture.gzipped
+            headers.append(('Content-Encoding', 'gzip'))
+        self._send(200, fixture.content_type, body, send_body, headers)
 
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+    def _send(self, code, content_type, body, send_body, headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write('<html><body><h1>Success!</h1><a href="#">Anchor text</a></body></html>')
+        if send_body:
+            self.wfile.write(body)
 
     def log_message(self, format, *args):
         """Override default to avoid trashing stderr"""
         pass
 
 
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer handing connections to `threads` worker threads. A
+    kept-alive connection has its thread to itself until it closes."""
+
+    # several browsers connect at once; the default backlog of 5 drops some
+    request_queue_size = 128
+
+    def __init__(self, address, handler, threads=DEFAULT_THREADS):
+        HTTPServer.__init__(self, address, handler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self._queue = Queue.Queue()
+        self._open = set()
+        self._workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self._work,
+                                      name='webserver-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        self._queue.put((request, client_address))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            with self.lock:
+                self.connections += 1
+                self._open.add(request)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self.lock:
+                    self._open.discard(request)
+                self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        LOGGER.debug("error serving %s", client_address, exc_info=True)
+
+    def server_close(self):
+        """Stop listening and end the connections still open, so the
+        workers don't wait out idle keep-alive connections."""
+        HTTPServer.server_close(self)
+        for worker in self._workers:
+            self._queue.put(None)
+        with self.lock:
+            requests = list(self._open)
+        for request in requests:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for worker in self._workers:
+            worker.join()
+
+
 class SimpleWebServer(object):
-    """A very basic web server."""
+    """A very basic web server, serving the fixtures under `root`. Port 0
+    picks a free port."""
 
-    def __init__(self, port=DEFAULT_PORT):
-        self.stop_serving = False
-        port = port
+    def __init__(self, port=DEFAULT_PORT, root=None, threads=DEFAULT_THREADS):
         while True:
             try:
-                self.server = HTTPServer(
-                    ('', port), HtmlOnlyHandler)
-                self.port = port
+                self.server = ThreadPoolHTTPServer(
+                    ('', port), FixtureHandler, threads)
+                self.port = self.server.server_address[1]
                 break
             except socket.error:
                 LOGGER.debug("port %d is in use, trying to use next one"
                               % port)
                 port += 1
+        self.server.fixtures = FixtureCache(root)
+        self.fixtures = self.server.fixtures
 
         self.thread = threading.Thread(target=self._run_web_server)
+        self.thread.daemon = True
 
     def _run_web_server(self):
         """Runs the server loop."""
         LOGGER.debug("web server started")
-        while not self.stop_serving:
-            self.server.handle_request()
-        self.server.server_close()
+        self.server.serve_forever(poll_interval=0.01)
 
     def start(self):
         """Starts the server."""
@@ -75,13 +282,9 @@ class SimpleWebServer(object):
 
     def stop(self):
         """Stops the server."""
-        self.stop_serving = True
-        try:
-            # This is to force stop the server loop
-            urllib.URLopener().open("http://localhost:%d" % self.port)
-        except Exception:
-            pass
         LOGGER.info("Shutting down the webserver")
+        self.server.shutdown()
+        self.server.server_close()
         self.thread.join()
 
 
@@ -97,19 +300,25 @@ def main(argv=None):
     parser.add_option("-p", "--port", dest="port", type="int",
             help="port to listen (default: %s)" % DEFAULT_PORT,
             default=DEFAULT_PORT)
+    parser.add_option("-d", "--root", dest="root",
+            help="directory of fixtures to serve (default: one test page)")
+    parser.add_option("--threads", dest="threads", type="int",
+            help="connections served at once (default: %s)" % DEFAULT_THREADS,
+            default=DEFAULT_THREADS)
 
     opts, args = parser.parse_args(argv[1:])
     if args:
         parser.error("wrong number of arguments")  # Will exit
 
-    server = SimpleWebServer(opts.port)
+    server = SimpleWebServer(opts.port, opts.root, opts.threads)
     server.start()
-    print "Server started on port %s, hit CTRL-C to quit" % opts.port
+    print "Server started on port %s, hit CTRL-C to quit" % server.port
     try:
         while 1:
             sleep(0.1)
     except KeyboardInterrupt:
         pass
+    server.stop()
 
 
 if __name__ == "__main__":